@@ -0,0 +1,180 @@
+# Batch mode: compile many source files in one go, spread across a process pool.
+# Results come back in input order and a failing file is reported without
+# aborting the rest of the batch.
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from CompileCache import CompileCache, DEFAULT_CACHE_DIR
+from CPPCompiler import COMPILER_VERSION, add_optimization_arguments, compile_code, native_flags, optimization_options
+from GccBuild import GccBuilder, PROFILES, executable_path_for, print_build_results
+from OutputStage import MANIFEST_NAME, Manifest, write_generated
+from PgoBuild import PROFILE_DIR_SUFFIX
+
+# What output_path_for and write_generated put next to a source
+GENERATED_EXTENSIONS = ('.cpp', '.d')
+
+
+class BatchResult:
+    def __init__(self, path, output_path=None, error=None, cached=False, seconds=0.0, changed=True, digest=None):
+        self.path = path
+        self.output_path = output_path
+        self.error = error
+        self.cached = cached
+        self.seconds = seconds
+        self.changed = changed
+        self.digest = digest
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"BatchResult({self.path!r}, ok={self.ok}, cached={self.cached})"
+
+
+def source_paths(paths):
+    """Drop the outputs an earlier run wrote next to its sources: .cpp and .d files, manifests and executables."""
+    candidates = [path for path in paths if os.path.basename(path) != MANIFEST_NAME
+                  and os.path.splitext(path)[1] not in GENERATED_EXTENSIONS]
+    # An executable is named after its source, so it is only an output if some other file is that source
+    executables = set()
+    for path in candidates:
+        executable = executable_path_for(path)
+        if executable != path:
+            executables.add(executable)
+    return [path for path in candidates if path not in executables]
+
+
+def walk_files(directory):
+    for root, directories, names in os.walk(directory):
+        directories[:] = [name for name in directories if not name.endswith(PROFILE_DIR_SUFFIX)]
+        yield from (os.path.join(root, name) for name in names)
+
+
+def expand_inputs(patterns):
+    """Expand globs and directories into a sorted, de-duplicated file list (in pattern order).
+
+    Directories and globs only yield source files, so a second run over the
+    same inputs doesn't compile the first run's outputs. Files named
+    explicitly are always kept.
+    """
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(source_paths(walk_files(pattern)))
+        elif glob.has_magic(pattern):
+            matches = sorted(source_paths(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def output_path_for(path, output_dir):
+    """Put the .cpp next to its source, or mirror the source's relative path under output_dir."""
+    stem = os.path.splitext(path)[0]
+    if output_dir is None:
+        return stem + ".cpp"
+    relative = os.path.relpath(stem)
+    if relative.startswith(os.pardir):
+        relative = os.path.basename(stem)
+    return os.path.join(output_dir, relative + ".cpp")
+
+
+def compile_file(path, output_dir=None, cache_dir=None, options=None):
+    """Compile one file; runs inside a worker process and never raises."""
+    start = time.perf_counter()
+    try:
+        with open(path, 'r') as infile:
+            code = infile.read()
+        cache = CompileCache(cache_dir) if cache_dir else None
+        result = compile_code(code, options, cache=cache)
+        # The manifest is shared by the whole batch, so the parent records this file in it
+        output = write_generated(output_path_for(path, output_dir), result.cpp, [path])
+    except Exception as e:
+        return BatchResult(path, error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - start)
+    return BatchResult(path, output.output_path, cached=result.cached, seconds=time.perf_counter() - start,
+                       changed=output.changed, digest=output.digest)
+
+
+def record_outputs(manifest, results, options):
+    for result in results:
+        if result.ok:
+            manifest.record(result.output_path, [result.path], options, COMPILER_VERSION, result.digest)
+    manifest.save()
+
+
+def compile_batch(paths, jobs=None, output_dir=None, cache_dir=None, options=None):
+    """Compile every path, returning one BatchResult per path in the same order."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) <= 1:
+        return [compile_file(path, output_dir, cache_dir, options) for path in paths]
+    # Hand each worker a few files at a time to keep scheduling overhead low
+    chunksize = max(1, len(paths) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(compile_file, paths, repeat(output_dir), repeat(cache_dir), repeat(options),
+                             chunksize=chunksize))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile many source files to C++ in parallel.")
+    parser.add_argument('inputs', nargs='+', help="source files, directories or glob patterns")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('-o', '--output-dir', default=None, help="directory for the generated .cpp files")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="artifact cache directory")
+    parser.add_argument('--manifest', default=None,
+                        help=f"JSON dependency manifest (default: {MANIFEST_NAME} in the output directory)")
+    parser.add_argument('--no-cache', action='store_true', help="always run every stage")
+    parser.add_argument('--stream', action='store_true', help="lex lazily instead of building token lists")
+    add_optimization_arguments(parser)
+    parser.add_argument('--build', metavar='PROFILE', choices=sorted(PROFILES), default=None,
+                        help="also build each generated file with g++ using this profile")
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("no input files matched")
+
+    start = time.perf_counter()
+    options = optimization_options(args)
+    if args.stream:
+        options['stream_tokens'] = True
+    results = compile_batch(paths, args.jobs, args.output_dir, None if args.no_cache else args.cache_dir, options)
+    elapsed = time.perf_counter() - start
+    record_outputs(Manifest(args.manifest or os.path.join(args.output_dir or "", MANIFEST_NAME)), results, options)
+
+    failures = 0
+    for result in results:
+        if result.ok:
+            note = (" (cached)" if result.cached else "") + ("" if result.changed else " (unchanged)")
+            print(f"ok      {result.path} -> {result.output_path}{note}")
+        else:
+            failures += 1
+            print(f"FAILED  {result.path}: {result.error}")
+    print(f"{len(results) - failures} compiled, {failures} failed in {elapsed:.2f}s")
+
+    if args.build:
+        builder = GccBuilder(args.build, cache_dir=None if args.no_cache else os.path.join(args.cache_dir, "gcc"),
+                             extra_flags=native_flags(options))
+        sources = [(result.output_path, executable_path_for(result.output_path))
+                   for result in results if result.ok]
+        start = time.perf_counter()
+        build_failures = print_build_results(builder.build_many(sources, args.jobs))
+        print(f"{len(sources) - build_failures} built, {build_failures} failed in "
+              f"{time.perf_counter() - start:.2f}s")
+        failures += build_failures
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
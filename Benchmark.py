@@ -0,0 +1,391 @@
+# Benchmark suite: generates synthetic programs of a chosen shape and size,
+# measures each compiler phase's throughput and the compile's peak memory, and
+# times the native build against CPython running the same source.
+#
+# The generated programs are also valid Python with the same meaning, so both
+# runs must print the same thing. That takes some care in this language. A
+# block runs until the next if/else/while/for, so blocks hold only simple
+# statements and nothing but another compound statement (or the end) follows
+# one. Values are reduced modulo MODULUS so they never overflow an int64 or go
+# negative (C++ and Python disagree on % of a negative). There is no '/',
+# which is true division in Python, and no comparison chains or printed
+# booleans.
+#
+# Results can be saved as a JSON baseline. Later runs compare against it and
+# exit non-zero when throughput, memory or speedup regress past a tolerance.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from CPPCompiler import COMPILER_VERSION, add_optimization_arguments, compile_code, native_flags, optimization_options
+from GccBuild import GccBuilder, PROFILES, best_run
+from Tracing import Profiler
+
+MODULUS = 1000003  # Prime, and small enough that a value times a constant below 1000 fits an int64
+VARIABLE_POOL = 16
+NESTING_DEPTH = 8
+LOOP_ITERATIONS = 20000
+PRINTS_PER_UNIT = 1000  # Lines a 'prints' program of size 1 prints
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.25
+
+# (shape, size) of the default suite; --scale multiplies the sizes
+SUITE = (
+    ('straight', 4000),
+    ('nested', 500),
+    ('loops', 40),
+    ('variables', 2000),
+    ('prints', 100),
+)
+
+# Phases whose throughput is tracked, with the count compile_code records for them
+THROUGHPUT = {
+    'lex': 'tokens',
+    'parse': 'nodes',
+    'ir': 'instructions',
+    'cpp': 'lines',
+}
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class ProgramGenerator:
+    """Writes one synthetic program; each shape method fills in the body."""
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.prologue = []  # Simple statements, which must all come before the first compound one
+        self.body = []
+        self.results = []  # Variables printed at the end
+
+    def pool(self, prefix, count):
+        """Declare count variables in the prologue with random starting values."""
+        names = [f"{prefix}{index}" for index in range(count)]
+        self.prologue.extend(f"{name} = {self.random.randrange(MODULUS)}" for name in names)
+        return names
+
+    def constant(self):
+        return self.random.randrange(2, 1000)
+
+    def arithmetic(self, names):
+        """An expression over names whose value stays in [0, 2 * MODULUS)."""
+        first, second = self.random.choice(names), self.random.choice(names)
+        form = self.random.randrange(4)
+        if form == 0:
+            return f"({first} * {self.constant()} + {second}) % {MODULUS}"
+        if form == 1:
+            return f"({first} + {MODULUS} - {second} % {MODULUS}) % {MODULUS}"
+        if form == 2:
+            return f"({first} + {second} + {self.constant()}) % {MODULUS}"
+        divisor = self.constant()
+        return f"{first} % {divisor} + {second} % {divisor}"
+
+    def nested_arithmetic(self, names, depth):
+        """An expression depth parentheses deep."""
+        expression = self.random.choice(names)
+        for _ in range(depth):
+            expression = f"({expression} * {self.constant()} + {self.random.choice(names)}) % {MODULUS}"
+        return expression
+
+    def condition(self, names, terms):
+        parts = []
+        for _ in range(terms):
+            operator = self.random.choice(('<', '>=', '==', '!='))
+            divisor = self.random.randrange(2, 8)
+            part = f"{self.random.choice(names)} % {divisor} {operator} {self.random.randrange(divisor)}"
+            parts.append(f"not {part}" if self.random.random() < 0.2 else part)
+        joiner = ' or ' if self.random.random() < 0.25 else ' and '
+        return joiner.join(parts)
+
+    def straight(self, size):
+        """Long straight-line arithmetic."""
+        names = self.pool('v', VARIABLE_POOL)
+        for _ in range(size):
+            self.body.append(f"{self.random.choice(names)} = {self.arithmetic(names)}")
+        self.results = names
+
+    def nested(self, size):
+        """if/else with deep conditions and deeply parenthesised arithmetic.
+
+        A block can't hold another compound statement, so a nested decision
+        is written the way it flattens: one if/else guarded by the conjunction
+        of the conditions it would be nested under.
+        """
+        names = self.pool('v', VARIABLE_POOL)
+        for _ in range(size):
+            self.body.append(f"if {self.condition(names, NESTING_DEPTH)}:")
+            for _ in range(self.random.randint(1, 3)):
+                self.body.append(f"    {self.random.choice(names)} = {self.nested_arithmetic(names, NESTING_DEPTH)}")
+            if self.random.random() < 0.7:
+                self.body.append("else:")
+                for _ in range(self.random.randint(1, 3)):
+                    self.body.append(f"    {self.random.choice(names)} = {self.arithmetic(names)}")
+        self.results = names
+
+    def loops(self, size):
+        """Many loops of LOOP_ITERATIONS iterations each: the shape that runs long."""
+        names = self.pool('v', VARIABLE_POOL)
+        # Every counter starts in the prologue: a reset after a loop would run inside its body
+        counters = [f"i{index}" for index in range(size)]
+        self.prologue.extend(f"{counter} = 0" for counter in counters)
+        for counter in counters:
+            self.body.append(f"while {counter} < {LOOP_ITERATIONS}:")
+            for _ in range(self.random.randint(2, 5)):
+                self.body.append(f"    {self.random.choice(names)} = {self.arithmetic(names + [counter])}")
+            self.body.append(f"    {counter} = {counter} + 1")
+        self.results = names
+
+    def variables(self, size):
+        """Many distinct variables, each computed from earlier ones."""
+        names = self.pool('w', min(size, VARIABLE_POOL))
+        for index in range(len(names), size):
+            name = f"w{index}"
+            self.body.append(f"{name} = {self.arithmetic(names)}")
+            names.append(name)
+        self.results = names[-VARIABLE_POOL:]
+
+    def prints(self, size):
+        """A loop that prints on every iteration: output throughput more than arithmetic."""
+        names = self.pool('v', 4)
+        self.prologue.append("i0 = 0")
+        self.body.append(f"while i0 < {size * PRINTS_PER_UNIT}:")
+        self.body.append(f"    print({names[0]})")
+        self.body.append("    print(\"line\")")
+        self.body.append(f"    {names[0]} = {self.arithmetic(names + ['i0'])}")
+        self.body.append("    i0 = i0 + 1")
+        self.results = names
+
+    def source(self):
+        # The prints sit in a block so that a compound statement before them doesn't swallow them
+        lines = self.prologue + self.body + ["if 1:"] + [f"    print({name})" for name in self.results]
+        return '\n'.join(lines) + '\n'
+
+
+SHAPES = {
+    'straight': ProgramGenerator.straight,
+    'nested': ProgramGenerator.nested,
+    'loops': ProgramGenerator.loops,
+    'variables': ProgramGenerator.variables,
+    'prints': ProgramGenerator.prints,
+}
+
+
+def generate_program(shape, size, seed=0):
+    """Source of a synthetic program; it means the same in this language and in Python."""
+    if shape not in SHAPES:
+        raise BenchmarkError(f"Unknown shape '{shape}', expected one of {', '.join(SHAPES)}")
+    generator = ProgramGenerator(seed)
+    SHAPES[shape](generator, size)
+    return generator.source()
+
+
+def measure_compile(source, options, repeat=3):
+    """Best-of-repeat time, counts and throughput per phase, plus the peak memory of one compile."""
+    best = {}
+    for _ in range(repeat):
+        profiler = Profiler(trace_memory=False)
+        compile_code(source, options, profiler=profiler)
+        for record in profiler.phases:
+            name = record['name']
+            if name not in best or record['seconds'] < best[name]['seconds']:
+                best[name] = record
+    phases = {}
+    for name, record in best.items():
+        entry = {key: value for key, value in record.items() if key != 'name'}
+        unit = THROUGHPUT.get(name)
+        if unit in record and record['seconds'] > 0:
+            entry['per_second'] = record[unit] / record['seconds']
+        phases[name] = entry
+
+    # Measured apart from the timings, which tracing memory would slow down
+    tracemalloc.start()
+    try:
+        result = compile_code(source, options)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'source_bytes': len(source),
+        'compile_seconds': sum(entry['seconds'] for entry in phases.values()),
+        'peak_bytes': peak_bytes,
+        'phases': phases,
+    }, result.cpp
+
+
+def measure_native(name, source, cpp_code, builder, workdir, repeat=3):
+    """Time the g++ build of cpp_code against CPython running source; their output must match."""
+    python_path = os.path.join(workdir, name + ".py")
+    cpp_path = os.path.join(workdir, name + ".cpp")
+    with open(python_path, 'w') as outfile:
+        outfile.write(source)
+    with open(cpp_path, 'w') as outfile:
+        outfile.write(cpp_code)
+    build = builder.build(cpp_path)
+    if not build.ok:
+        raise BenchmarkError(f"{name}: g++ build failed: {build.error}")
+    native_seconds, native_output = best_run([build.output_path], repeat)
+    python_seconds, python_output = best_run([sys.executable, python_path], repeat)
+    if native_output != python_output:
+        raise BenchmarkError(f"{name}: native output differs from CPython's "
+                             f"({native_output.split()[:4]} vs {python_output.split()[:4]})")
+    return {
+        'native_seconds': native_seconds,
+        'python_seconds': python_seconds,
+        'speedup': python_seconds / native_seconds,
+        'lines_per_second': native_output.count('\n') / native_seconds,
+    }
+
+
+def run_suite(suite, options, repeat=3, seed=0, builder=None, output=sys.stdout):
+    """Benchmark each (shape, size); returns (results by benchmark name, failures)."""
+    results = {}
+    failures = []
+    workdir = tempfile.mkdtemp(prefix="cppcompiler_bench_")
+    try:
+        for shape, size in suite:
+            name = f"{shape}-{size}"
+            source = generate_program(shape, size, seed)
+            try:
+                result, cpp_code = measure_compile(source, options, repeat)
+                if builder is not None:
+                    result['native'] = measure_native(name, source, cpp_code, builder, workdir, repeat)
+            except Exception as e:
+                failures.append(f"{name}: {type(e).__name__}: {e}")
+                print(f"FAILED  {failures[-1]}", file=output)
+                continue
+            results[name] = result
+            print(format_result(name, result), file=output)
+            output.flush()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results, failures
+
+
+def format_rate(value):
+    for threshold, suffix in ((1e6, "M"), (1e3, "k")):
+        if value >= threshold:
+            return f"{value / threshold:.1f}{suffix}"
+    return f"{value:.0f}"
+
+
+def format_result(name, result):
+    parts = [f"{name:<16} compile {result['compile_seconds']:.3f}s"]
+    for phase, unit in THROUGHPUT.items():
+        entry = result['phases'].get(phase)
+        if entry and 'per_second' in entry:
+            parts.append(f"{phase} {format_rate(entry['per_second'])} {unit}/s")
+    parts.append(f"peak {result['peak_bytes'] / 2 ** 20:.1f} MB")
+    native = result.get('native')
+    if native:
+        parts.append(f"native {native['native_seconds']:.3f}s vs python {native['python_seconds']:.3f}s "
+                     f"(x{native['speedup']:.1f}, prints {format_rate(native['lines_per_second'])} lines/s)")
+    return "  ".join(parts)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Messages for every metric in results that is worse than baseline's by more than tolerance."""
+    regressions = []
+
+    def check(name, metric, current, previous, higher_is_better=True):
+        change = (current - previous) / previous if previous else 0.0
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{name} {metric}: {format_rate(previous)} -> {format_rate(current)} "
+                               f"({change:+.0%})")
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for phase, unit in THROUGHPUT.items():
+            current_rate = result['phases'].get(phase, {}).get('per_second')
+            previous_rate = previous['phases'].get(phase, {}).get('per_second')
+            if current_rate is not None and previous_rate is not None:
+                check(name, f"{phase} {unit}/s", current_rate, previous_rate)
+        check(name, "peak bytes", result['peak_bytes'], previous['peak_bytes'], higher_is_better=False)
+        if 'native' in result and 'native' in previous:
+            check(name, "native speedup over CPython", result['native']['speedup'], previous['native']['speedup'])
+            if 'lines_per_second' in previous['native']:
+                check(name, "printed lines/s", result['native']['lines_per_second'],
+                      previous['native']['lines_per_second'])
+    return regressions
+
+
+def report(results, options):
+    return {
+        'compiler_version': COMPILER_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+        'options': options,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiler on synthetic programs.")
+    parser.add_argument('--shape', action='append', choices=sorted(SHAPES), default=[],
+                        help="only run this shape (may be repeated; default: the whole suite)")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every program's size by this")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement; the fastest counts")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the program generator")
+    parser.add_argument('--emit', action='store_true', help="print the generated programs instead of benchmarking")
+    parser.add_argument('--no-native', action='store_true', help="skip timing the g++ build against CPython")
+    parser.add_argument('--build', metavar='PROFILE', choices=sorted(PROFILES), default='release',
+                        help="g++ profile for the native timing (default: release)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f"baseline JSON to compare against (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--save-baseline', action='store_true', help="record this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"fractional slowdown allowed before a metric counts as a regression "
+                             f"(default: {DEFAULT_TOLERANCE})")
+    parser.add_argument('--json', metavar='FILE', default=None, help="also write the results as JSON to FILE")
+    add_optimization_arguments(parser)
+    args = parser.parse_args()
+
+    suite = [(shape, max(1, int(size * args.scale))) for shape, size in SUITE
+             if not args.shape or shape in args.shape]
+    if args.emit:
+        for shape, size in suite:
+            print(f"# {shape}-{size}")
+            print(generate_program(shape, size, args.seed))
+        return 0
+
+    options = optimization_options(args)
+    builder = None if args.no_native else GccBuilder(args.build, extra_flags=native_flags(options))
+    results, failures = run_suite(suite, options, args.repeat, args.seed, builder)
+    current = report(results, options)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(current, outfile, indent=2)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as outfile:
+            json.dump(current, outfile, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as infile:
+            baseline = json.load(infile)
+        if baseline.get('options') != options:
+            print(f"Not comparing with {args.baseline}: it was recorded with options {baseline.get('options')}")
+        else:
+            regressions = compare(results, baseline['results'], args.tolerance)
+            for regression in regressions:
+                print(f"REGRESSION  {regression}")
+            print(f"{len(regressions)} regression(s) against {args.baseline}")
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
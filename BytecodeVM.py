@@ -0,0 +1,437 @@
+# Bytecode VM: runs an IRProgram directly, for when a g++ build would take
+# longer than the program itself. The IR is lowered to a flat array of ints,
+# four per instruction (opcode, dest, a, b), with labels resolved to
+# instruction offsets and every operand mapped to a register; constants are
+# registers preloaded with their value. Arithmetic is specialised by the
+# inferred operand types while lowering, so the dispatch loop never checks a
+# type and behaves like the C++ CppCodeGenerator emits: 64-bit wraparound
+# integers, truncating division, IEEE doubles and cout's default formatting.
+
+import io
+import math
+import os
+import sys
+from array import array
+from enum import IntEnum
+
+from IntermediateCode import OPERATOR_SYMBOLS, Opcode, OperandKind, ValueType
+from TypeInference import BOOLEAN_OPCODES, COMPARISON_OPCODES
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+# Taken jumps the VM runs in 'auto' mode before deciding the program is worth a
+# native build; about as long as g++ -O2 takes on a small file (~0.4s)
+AUTO_JUMP_BUDGET = 500_000
+
+RUN_MODES = ('auto', 'vm', 'native')
+
+# The NaN x86 produces for an invalid operation such as 0.0 / 0.0 has its sign bit set, so it prints as -nan
+DEFAULT_NAN = -math.nan
+
+# What both run modes report when the program divides an integer by zero
+DIVISION_FAULT = "Floating point exception (integer division overflow or by zero)"
+
+
+class VMOp(IntEnum):
+    HALT = 0
+    JUMP = 1  # pc = dest
+    JUMP_IF = 2  # if a: pc = dest
+    JUMP_IF_NOT = 3
+    MOVE = 4  # dest = a
+    TO_INT = 5  # dest = std::int64_t(a)
+    TO_FLOAT = 6  # dest = double(a)
+    PRINT = 7  # print a, formatted by the ValueType in b
+    ADD_INT = 8
+    SUB_INT = 9
+    MUL_INT = 10
+    DIV_INT = 11
+    MOD_INT = 12
+    ADD = 13  # Doubles, or std::string concatenation
+    SUB_FLOAT = 14
+    MUL_FLOAT = 15
+    DIV_FLOAT = 16
+    MOD_FLOAT = 17
+    EQ = 18  # Comparisons of two ints, two doubles or two strings
+    NE = 19
+    LT = 20
+    LE = 21
+    GT = 22
+    GE = 23
+    AND = 24
+    OR = 25
+
+
+INTEGER_OPS = {
+    Opcode.ADD: VMOp.ADD_INT,
+    Opcode.SUB: VMOp.SUB_INT,
+    Opcode.MUL: VMOp.MUL_INT,
+    Opcode.DIV: VMOp.DIV_INT,
+    Opcode.MOD: VMOp.MOD_INT,
+}
+FLOAT_OPS = {
+    Opcode.ADD: VMOp.ADD,
+    Opcode.SUB: VMOp.SUB_FLOAT,
+    Opcode.MUL: VMOp.MUL_FLOAT,
+    Opcode.DIV: VMOp.DIV_FLOAT,
+    Opcode.MOD: VMOp.MOD_FLOAT,
+}
+GENERIC_OPS = {
+    Opcode.ADD: VMOp.ADD,
+    Opcode.EQ: VMOp.EQ,
+    Opcode.NE: VMOp.NE,
+    Opcode.LT: VMOp.LT,
+    Opcode.LE: VMOp.LE,
+    Opcode.GT: VMOp.GT,
+    Opcode.GE: VMOp.GE,
+    Opcode.AND: VMOp.AND,
+    Opcode.OR: VMOp.OR,
+}
+
+ZERO_VALUES = {
+    ValueType.INT: 0,
+    ValueType.FLOAT: 0.0,
+    ValueType.STRING: "",
+}
+
+
+class VMError(Exception):
+    """A fault that would kill the compiled program, such as an integer division by zero."""
+    pass
+
+
+def wrap_int(value):
+    """value reduced to a two's-complement std::int64_t, the way x86 arithmetic wraps."""
+    return (value - INT_MIN) % 2 ** 64 + INT_MIN
+
+
+def to_int(value):
+    """double -> std::int64_t; out of range and NaN give INT_MIN, like cvttsd2si."""
+    if math.isfinite(value) and INT_MIN <= value < 2.0 ** 63:
+        return int(value)
+    return INT_MIN
+
+
+def divide_floats(left, right):
+    """IEEE division, where x / 0 is an infinity or NaN rather than an error."""
+    if right:
+        return left / right
+    if left == 0 or math.isnan(left):
+        return DEFAULT_NAN
+    return math.copysign(math.inf, left) * math.copysign(1.0, right)
+
+
+def float_remainder(left, right):
+    try:
+        return math.fmod(left, right)
+    except ValueError:
+        return DEFAULT_NAN  # fmod(x, 0) and fmod(inf, y) are NaN in C
+
+
+def format_double(value):
+    """std::cout's default rendering of a double: %g with six significant digits."""
+    if math.isnan(value):
+        return "-nan" if math.copysign(1.0, value) < 0 else "nan"
+    return "%g" % value
+
+
+class Bytecode:
+    """A lowered program: the instruction array plus each register's value on entry."""
+
+    def __init__(self, code, registers):
+        self.code = code  # array('q'), four ints per instruction
+        self.registers = registers
+
+    def __len__(self):
+        return len(self.code) // 4
+
+    def __repr__(self):
+        return f"Bytecode({len(self)} instructions, {len(self.registers)} registers)"
+
+
+class BytecodeCompiler:
+    def __init__(self, program):
+        self.program = program
+        self.code = array('q')
+        self.registers = []
+        self.label_offsets = {}
+        self.fixups = []  # Positions in code holding a label operand to resolve
+
+    def compile(self):
+        program = self.program
+        for kind, value, value_type in zip(program.kinds, program.values, program.types):
+            if kind == OperandKind.CONSTANT:
+                self.registers.append(value)
+            else:
+                self.registers.append(ZERO_VALUES.get(value_type, 0))
+        for instruction in program.instructions:
+            self.lower(instruction)
+        self.emit(VMOp.HALT)
+        for position in self.fixups:
+            self.code[position] = self.label_offsets[self.code[position]]
+        return Bytecode(self.code, self.registers)
+
+    def emit(self, op, dest=0, a=0, b=0):
+        self.code.extend((op, dest, a, b))
+
+    def emit_jump(self, op, label, condition=0):
+        self.fixups.append(len(self.code) + 1)
+        self.emit(op, label, condition)
+
+    def scratch(self):
+        """A register of its own for an intermediate value."""
+        self.registers.append(0)
+        return len(self.registers) - 1
+
+    def lower(self, instruction):
+        opcode = instruction.opcode
+        types = self.program.types
+        if opcode == Opcode.LABEL:
+            self.label_offsets[instruction.label] = len(self.code) // 4
+        elif opcode == Opcode.GOTO:
+            self.emit_jump(VMOp.JUMP, instruction.label)
+        elif opcode == Opcode.IF:
+            self.emit_jump(VMOp.JUMP_IF, instruction.label, instruction.a)
+        elif opcode == Opcode.IF_NOT:
+            self.emit_jump(VMOp.JUMP_IF_NOT, instruction.label, instruction.a)
+        elif opcode == Opcode.PRINT:
+            self.emit(VMOp.PRINT, 0, instruction.a, types[instruction.a])
+        elif opcode == Opcode.STORE:
+            self.emit(self.conversion(types[instruction.a], types[instruction.dest]), instruction.dest, instruction.a)
+        elif opcode in OPERATOR_SYMBOLS:
+            self.lower_binary(instruction)
+        else:
+            raise ValueError(f"Can't lower {instruction!r}")
+
+    @staticmethod
+    def conversion(source_type, dest_type):
+        if dest_type == ValueType.INT and source_type == ValueType.FLOAT:
+            return VMOp.TO_INT
+        if dest_type == ValueType.FLOAT and source_type == ValueType.INT:
+            return VMOp.TO_FLOAT
+        return VMOp.MOVE
+
+    def lower_binary(self, instruction):
+        opcode = instruction.opcode
+        types = self.program.types
+        left, right = instruction.a, instruction.b
+        operand_types = (types[left], types[right])
+        if ValueType.STRING in operand_types:
+            op, result_type = GENERIC_OPS[opcode], ValueType.STRING
+        elif ValueType.FLOAT in operand_types:
+            op, result_type = FLOAT_OPS.get(opcode) or GENERIC_OPS[opcode], ValueType.FLOAT
+            if opcode in COMPARISON_OPCODES:
+                # C++ compares an integer with a double as two doubles; Python would compare exactly
+                if types[left] == ValueType.INT:
+                    left = self.converted(left)
+                if types[right] == ValueType.INT:
+                    right = self.converted(right)
+        else:
+            op, result_type = INTEGER_OPS.get(opcode) or GENERIC_OPS[opcode], ValueType.INT
+        if opcode in BOOLEAN_OPCODES:
+            result_type = ValueType.INT
+        dest = instruction.dest
+        self.emit(op, dest, left, right)
+        conversion = self.conversion(result_type, types[dest])
+        if conversion != VMOp.MOVE:
+            self.emit(conversion, dest, dest)
+
+    def converted(self, operand):
+        register = self.scratch()
+        self.emit(VMOp.TO_FLOAT, register, operand)
+        return register
+
+
+def compile_bytecode(program):
+    """Lower a typed IRProgram to Bytecode."""
+    return BytecodeCompiler(program).compile()
+
+
+class VirtualMachine:
+    def __init__(self, bytecode, output=None):
+        self.bytecode = bytecode
+        self.output = output if output is not None else sys.stdout
+        # Decoded once: indexing a list of tuples is much faster than slicing the array every step
+        code = bytecode.code
+        self.instructions = [tuple(code[position:position + 4]) for position in range(0, len(code), 4)]
+
+    def run(self, jump_budget=-1):
+        """Run to the end; returns False if jump_budget taken jumps ran out first (-1: no limit)."""
+        instructions = self.instructions
+        registers = list(self.bytecode.registers)
+        write = self.output.write
+        jumps = 0
+        pc = 0
+        HALT, JUMP, JUMP_IF, JUMP_IF_NOT = VMOp.HALT.value, VMOp.JUMP.value, VMOp.JUMP_IF.value, VMOp.JUMP_IF_NOT.value
+        MOVE, TO_INT, TO_FLOAT, PRINT = VMOp.MOVE.value, VMOp.TO_INT.value, VMOp.TO_FLOAT.value, VMOp.PRINT.value
+        ADD_INT, SUB_INT, MUL_INT = VMOp.ADD_INT.value, VMOp.SUB_INT.value, VMOp.MUL_INT.value
+        DIV_INT, MOD_INT = VMOp.DIV_INT.value, VMOp.MOD_INT.value
+        ADD, SUB_FLOAT, MUL_FLOAT = VMOp.ADD.value, VMOp.SUB_FLOAT.value, VMOp.MUL_FLOAT.value
+        DIV_FLOAT, MOD_FLOAT = VMOp.DIV_FLOAT.value, VMOp.MOD_FLOAT.value
+        EQ, NE, LT, LE, GT, GE = (VMOp.EQ.value, VMOp.NE.value, VMOp.LT.value, VMOp.LE.value,
+                                  VMOp.GT.value, VMOp.GE.value)
+        AND, OR = VMOp.AND.value, VMOp.OR.value
+        INT, FLOAT = ValueType.INT.value, ValueType.FLOAT.value
+
+        # Ordered roughly by how often loops execute each opcode
+        while True:
+            op, dest, a, b = instructions[pc]
+            pc += 1
+            if op == MOVE:
+                registers[dest] = registers[a]
+            elif op == ADD_INT:
+                value = registers[a] + registers[b]
+                registers[dest] = value if INT_MIN <= value <= INT_MAX else wrap_int(value)
+            elif op == JUMP_IF_NOT:
+                if not registers[a]:
+                    pc = dest
+                    jumps += 1
+                    if jumps == jump_budget:
+                        return False
+            elif op == JUMP:
+                pc = dest
+                jumps += 1
+                if jumps == jump_budget:
+                    return False
+            elif op == LT:
+                registers[dest] = 1 if registers[a] < registers[b] else 0
+            elif op == SUB_INT:
+                value = registers[a] - registers[b]
+                registers[dest] = value if INT_MIN <= value <= INT_MAX else wrap_int(value)
+            elif op == MUL_INT:
+                value = registers[a] * registers[b]
+                registers[dest] = value if INT_MIN <= value <= INT_MAX else wrap_int(value)
+            elif op == JUMP_IF:
+                if registers[a]:
+                    pc = dest
+                    jumps += 1
+                    if jumps == jump_budget:
+                        return False
+            elif op == LE:
+                registers[dest] = 1 if registers[a] <= registers[b] else 0
+            elif op == GT:
+                registers[dest] = 1 if registers[a] > registers[b] else 0
+            elif op == GE:
+                registers[dest] = 1 if registers[a] >= registers[b] else 0
+            elif op == EQ:
+                registers[dest] = 1 if registers[a] == registers[b] else 0
+            elif op == NE:
+                registers[dest] = 1 if registers[a] != registers[b] else 0
+            elif op == ADD:
+                registers[dest] = registers[a] + registers[b]
+            elif op == PRINT:
+                value = registers[a]
+                if b == INT:
+                    write(f"{value}\n")
+                elif b == FLOAT:
+                    write(format_double(value) + "\n")
+                else:
+                    write(value + "\n")
+            elif op == DIV_INT or op == MOD_INT:
+                left, right = registers[a], registers[b]
+                if right == 0 or (right == -1 and left == INT_MIN):
+                    raise VMError(DIVISION_FAULT)
+                # C++ truncates towards zero and the remainder takes the dividend's sign
+                quotient = abs(left) // abs(right)
+                if (left < 0) != (right < 0):
+                    quotient = -quotient
+                registers[dest] = quotient if op == DIV_INT else left - right * quotient
+            elif op == SUB_FLOAT:
+                registers[dest] = registers[a] - registers[b]
+            elif op == MUL_FLOAT:
+                registers[dest] = registers[a] * registers[b]
+            elif op == DIV_FLOAT:
+                registers[dest] = divide_floats(registers[a], registers[b])
+            elif op == MOD_FLOAT:
+                registers[dest] = float_remainder(registers[a], registers[b])
+            elif op == AND:
+                registers[dest] = 1 if registers[a] and registers[b] else 0
+            elif op == OR:
+                registers[dest] = 1 if registers[a] or registers[b] else 0
+            elif op == TO_INT:
+                registers[dest] = to_int(registers[a])
+            elif op == TO_FLOAT:
+                registers[dest] = float(registers[a])
+            elif op == HALT:
+                return True
+            else:
+                raise VMError(f"Bad opcode {op} at {pc - 1}")
+
+
+def run_vm(program, output=None, jump_budget=-1):
+    """Run a typed IRProgram in the VM; returns False if it ran out of jump_budget."""
+    return VirtualMachine(compile_bytecode(program), output).run(jump_budget)
+
+
+# The native side imports the g++ driver and its process helpers when it first runs,
+# so the VM alone stays cheap to import
+
+
+def native_available(compiler='g++'):
+    import shutil
+    return shutil.which(compiler) is not None
+
+
+def run_native(cpp_code, output=None, builder=None):
+    """Build cpp_code with g++ and run it, copying its output.
+
+    Raises VMError if the program dies or exits non-zero, after copying what it printed first.
+    """
+    import shutil
+    import signal
+    import subprocess
+    import tempfile
+
+    from GccBuild import GccBuilder
+
+    output = output if output is not None else sys.stdout
+    builder = builder or GccBuilder('release')
+    build_dir = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(build_dir, "program.cpp")
+        with open(source_path, 'w') as outfile:
+            outfile.write(cpp_code)
+        build = builder.build(source_path)
+        if not build.ok:
+            raise VMError(f"Native build failed: {build.error}")
+        completed = subprocess.run([build.output_path], stdout=subprocess.PIPE)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    output.write(completed.stdout.decode('utf-8', errors='replace'))
+    status = completed.returncode
+    # g++ turns a division it can prove divides by zero into a trap instruction, hence SIGILL
+    if status < 0 and -status in (signal.SIGFPE, signal.SIGILL):
+        raise VMError(DIVISION_FAULT)
+    if status < 0:
+        raise VMError(f"Killed by signal {-status}")
+    if status:
+        raise VMError(f"Exited with status {status}")
+
+
+def run_program(program, cpp_code, mode='auto', output=None, jump_budget=AUTO_JUMP_BUDGET, builder=None):
+    """Run a compiled program in the VM or natively; returns the mode that actually ran it.
+
+    'auto' runs natively straight away if the executable is already in the
+    build cache. Otherwise it starts in the VM and buffers what it prints:
+    short programs finish there without paying for a g++ build, while one
+    still running after jump_budget taken jumps is expected to outlast the
+    build, so its output is discarded and it is rerun natively from the start.
+    """
+    output = output if output is not None else sys.stdout
+    if mode == 'vm' or (mode == 'auto' and not native_available()):
+        run_vm(program, output)
+        return 'vm'
+    from GccBuild import GccBuilder
+    builder = builder or GccBuilder('release')
+    if mode == 'auto' and not builder.is_cached(cpp_code):
+        buffer = io.StringIO()
+        try:
+            finished = run_vm(program, buffer, jump_budget)
+        except VMError:
+            output.write(buffer.getvalue())  # Everything the native program would have printed before dying
+            raise
+        if finished:
+            output.write(buffer.getvalue())
+            return 'vm'
+    run_native(cpp_code, output, builder)
+    return 'native'
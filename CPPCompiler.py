@@ -1,109 +1,49 @@
-import re
-
-
-# Define a Token class to represent a token
-class Token:
-    def __init__(self, token_type, value, position):
-        self.type = token_type
-        self.value = value
-        self.position = position
-
-    def __repr__(self):
-        return f"Token(type='{self.type}', value={self.value!r}, position={self.position})"
-
-
-# Define node classes for the AST
-class NumberNode:
-    def __init__(self, value):
-        self.value = value
-
-    def __repr__(self):
-        return f"NumberNode({self.value})"
-
-
-class WhileNode:
-    def __init__(self, condition, body):
-        self.condition = condition
-        self.body = body
-
-
-class ForNode:
-    def __init__(self, init, condition, update, body):
-        self.init = init
-        self.condition = condition
-        self.update = update
-        self.body = body
-
-    def __repr__(self):
-        return f"ForNode({self.init}, {self.condition}, {self.update}, {self.body})"
-
-
-def __repr__(self):
-    return f"WhileNode({self.condition}, {self.body})"
-
-
-class PrintNode:
-    def __init__(self, expression):
-        self.expression = expression
-
-
-class VariableNode:
-    def __init__(self, name):
-        self.name = name
-
-    def __repr__(self):
-        return f"VariableNode({self.name})"
-
-
-class StringNode:
-    def __init__(self, value):
-        self.value = value
-
-    def __repr__(self):
-        return f"StringNode({self.value})"
+# Importing this module only defines the compiler. The back-end stages (type
+# inference, the optimizer, structuring, temp reuse and the OpenMP analysis),
+# the VM, the g++ driver, the artifact cache and the command line are imported
+# where they are first used, so a library import doesn't pay for them and a
+# compile only pays for the stages its options run.
 
+import os
+import re
+import sys
 
-class BinOpNode:
-    def __init__(self, left, op, right):
-        self.left = left
-        self.op = op
-        self.right = right
+from PrintRuntime import BUFFERING_MODES, HEADERS as PRINT_HEADERS, print_statement, runtime_lines
+from IntermediateCode import IRProgram, Instruction, Opcode, OperandKind, ValueType, BINARY_OPCODES, OPERATOR_SYMBOLS
+from SyntaxTree import (AssignmentNode, BinOpNode, FlatNodeBuilder, ForNode, IfNode, NodeBuilder, NumberNode,
+                        PrintNode, StringNode, UnaryOpNode, VariableNode, WhileNode)
+from Tracing import LOG_LEVELS, NULL_PROFILER, Profiler, configure_tracing, tracer
+from Visitor import NodeVisitor
 
-    def __repr__(self):
-        return f"BinOpNode({self.left}, {self.op}, {self.right})"
+# Part of every cache key; bump it whenever a stage's output changes
+COMPILER_VERSION = "0.17.0"
 
 
-class IfNode:
-    def __init__(self, condition, true_branch, false_branch):
-        self.condition = condition
-        self.true_branch = true_branch
-        self.false_branch = false_branch
-
-    def __repr__(self):
-        return f"IfNode({self.condition}, {self.true_branch}, {self.false_branch})"
-
+# Define a Token class to represent a token
+class Token:
+    __slots__ = ('type', 'value', 'position', 'line', 'column')
 
-class AssignmentNode:
-    def __init__(self, variable, value):
-        self.variable = variable  # This should be a VariableNode object
+    def __init__(self, token_type, value, position, line=1, column=1):
+        self.type = token_type
         self.value = value
+        self.position = position  # Offset into the source
+        self.line = line
+        self.column = column
 
     def __repr__(self):
-        return f"AssignmentNode({self.variable}, {self.value})"
+        return (f"Token(type='{self.type}', value={self.value!r}, position={self.position}, "
+                f"line={self.line}, column={self.column})")
 
 
 # Token specifications using regular expressions
 TOKEN_SPECIFICATION = [
     ('NUMBER', r'\d+(\.\d*)?'),  # Integer or decimal number
     ('STRING', r'\".*?\"|\'.*?\''),
-    ('PRINT', r'print'),
-    ('KEYWORD', r'if|else|while|for'),  # Keywords
     ('CMP', r'==|!=|<=|>=|<|>'),  # Comparison operators
     ('ASSIGN', r'='),  # Assignment operator
     ('END', r';'),  # Statement terminator
-    ('ID', r'[A-Za-z_]\w*'),  # Identifiers
+    ('ID', r'[A-Za-z_]\w*'),  # Identifiers, keywords are picked out via KEYWORDS
     ('OP', r'[+\-*/%]'),  # Arithmetic operators
-    ('LOGICAL', r'and|or|not'),  # Logical operators
     ('PAREN', r'[\(\)]'),  # Parentheses
     ('BRACE', r'[\{\}]'),  # Braces
     ('BRACKET', r'[\[\]]'),  # Brackets
@@ -116,51 +56,85 @@ TOKEN_SPECIFICATION = [
     ('MISMATCH', r'.'),  # Any other character
 ]
 
+# Reserved words and the token type they get instead of ID
+KEYWORDS = {
+    'if': 'KEYWORD',
+    'else': 'KEYWORD',
+    'while': 'KEYWORD',
+    'for': 'KEYWORD',
+    'print': 'PRINT',
+    'and': 'LOGICAL',
+    'or': 'LOGICAL',
+    'not': 'LOGICAL',
+}
+
 # Build the regular expression for all tokens
 token_regex = '|'.join(f'(?P<{pair[0]}>{pair[1]})' for pair in TOKEN_SPECIFICATION)
+TOKEN_REGEX = re.compile(token_regex)
 
 
-def tokenize(code):
-    tokens = []
-    position = 0
-    for match in re.finditer(token_regex, code):
+def iter_tokens(code, start=0):
+    """Lazily yield tokens from code, tracking offset, line and column.
+
+    start, which must be where a token begins, resumes lexing partway through.
+    """
+    line = code.count('\n', 0, start) + 1
+    line_start = code.rfind('\n', 0, start) + 1
+    keywords = KEYWORDS
+    for match in TOKEN_REGEX.finditer(code, start):
         token_type = match.lastgroup
-        token_value = match.group(token_type)
+        if token_type == 'SKIP':  # Skip whitespace
+            continue
 
-        if token_type == 'NUMBER':
+        token_value = match.group(token_type)
+        position = match.start()
+        if token_type == 'ID':
+            token_type = keywords.get(token_value, 'ID')
+        elif token_type == 'NUMBER':
             token_value = float(token_value) if '.' in token_value else int(token_value)
+        elif token_type == 'MISMATCH':
+            column = position - line_start + 1
+            raise SyntaxError(f"Unexpected character {token_value!r} at line {line}, column {column}")
 
-        if token_type == 'ID' and token_value in {'if', 'else', 'while'}:
-            token_type = 'KEYWORD'  # Reclassify keywords if needed
+        yield Token(token_type, token_value, position, line, position - line_start + 1)
 
-        if token_type == 'SKIP':  # Skip whitespace
-            continue
-        elif token_type == 'MISMATCH':
-            raise SyntaxError(f"Unexpected character: {token_value}")
+        if token_type == 'NEWLINE':
+            line += 1
+            line_start = match.end()
 
-        # Append token with its type and value
-        tokens.append(Token(token_type, token_value, position))
 
-        # Update position correctly
-        position += len(str(token_value))
+def tokenize(code):
+    tokens = list(iter_tokens(code))
 
     # Print tokens for debugging
-    print("Tokens:", tokens)
+    if tracer.enabled:
+        tracer.debug(f"Tokens: {tokens}")
 
     return tokens
 
 
-class ProgramNode:
-    def __init__(self, statements):
-        self.statements = statements
-
-    def __repr__(self):
-        return f"ProgramNode({self.statements})"
+# Binding power of the binary operators, all of which group to the left
+BINARY_PRECEDENCE = {
+    'or': 1,
+    'and': 2,
+    '==': 4, '!=': 4, '<': 4, '<=': 4, '>': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+}
+# 'not' binds looser than a comparison: not a == b is not (a == b); a minus sign binds tightest of all
+UNARY_PRECEDENCE = {'not': 3, '-': 7}
+ASSIGNMENT_PRECEDENCE = 0
+BRACKET_PRECEDENCE = -1  # Below everything, so nothing is applied across an unclosed bracket
+BRACKETS = {'(': ')', '[': ']'}
 
 
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, builder=None):
+        # Any iterable works; a generator from iter_tokens() is consumed lazily
+        self.tokens = iter(tokens)
+        # Makes the nodes: SyntaxTree.NodeBuilder for node objects, FlatNodeBuilder for a NodeTable
+        self.builder = builder or NodeBuilder()
+        self.build = self.builder.node
         self.current_token = None
         self.index = -1
         self.advance()
@@ -168,10 +142,7 @@ class Parser:
     def advance(self):
         """Advance to the next token."""
         self.index += 1
-        if self.index < len(self.tokens):
-            self.current_token = self.tokens[self.index]
-        else:
-            self.current_token = None
+        self.current_token = next(self.tokens, None)
 
     def expect(self, token_type):
         if self.current_token and self.current_token.type == token_type:
@@ -185,188 +156,235 @@ class Parser:
 
     def parse(self):
         """Parse the tokens into an AST."""
-        print("Starting parsing process")
+        if tracer.enabled:
+            tracer.debug("Starting parsing process")
         return self.program()
 
     def program(self):
         """Parse a sequence of statements."""
-        print("Parsing program")
+        if tracer.enabled:
+            tracer.debug("Parsing program")
         statements = []
         while self.current_token:
-            print(f"Current token: {self.current_token}")
+            if tracer.enabled:
+                tracer.debug(f"Current token: {self.current_token}")
             stmt = self.statement()
-            if stmt:
+            if stmt is not None:
                 statements.append(stmt)
-                print(f"Added statement: {stmt}")
+                if tracer.enabled:
+                    tracer.debug(f"Added statement: {stmt}")
             while self.current_token and self.current_token.type == 'NEWLINE':
                 self.advance()
-        return statements
+        return self.builder.tree(statements)
 
     def statement(self):
-        print(f"Parsing statement, current token: {self.current_token}")
+        if tracer.enabled:
+            tracer.debug(f"Parsing statement, current token: {self.current_token}")
         if self.current_token and self.current_token.type == 'ID':
             var_name = self.current_token.value
             self.advance()
             if self.current_token and self.current_token.type == 'ASSIGN':
                 self.advance()
                 expr = self.expression()
-                return AssignmentNode(var_name, expr)
+                return self.build(AssignmentNode, var_name, expr)
             else:
-                return VariableNode(var_name)
+                return self.build(VariableNode, var_name)
         elif self.current_token and self.current_token.type == 'PRINT':
             return self.print_statement()
         elif self.current_token and self.current_token.type == 'KEYWORD':
             if self.current_token.value == 'if':
-                print("Entering if_statement")
+                if tracer.enabled:
+                    tracer.debug("Entering if_statement")
                 return self.if_statement()
             elif self.current_token.value == 'while':
-                print("Entering while_statement")
+                if tracer.enabled:
+                    tracer.debug("Entering while_statement")
                 return self.while_statement()
             elif self.current_token.value == 'for':
-                print("Entering for_statement")
+                if tracer.enabled:
+                    tracer.debug("Entering for_statement")
                 return self.for_statement()
         return self.expression()
 
     def print_statement(self):
         self.expect('PRINT')
         expr = self.expression()
-        return PrintNode(expr)
+        return self.build(PrintNode, expr)
 
     def while_statement(self):
-        print("Parsing while statement")
+        if tracer.enabled:
+            tracer.debug("Parsing while statement")
         self.expect('KEYWORD')  # Expect 'while'
         condition = self.condition()
-        print(f"While condition: {condition}")
+        if tracer.enabled:
+            tracer.debug(f"While condition: {condition}")
         self.expect('COLON')  # Expect ':' instead of 'then'
         body = self.block()
-        print(f"While body: {body}")
-        return WhileNode(condition, body)
+        if tracer.enabled:
+            tracer.debug(f"While body: {body}")
+        return self.build(WhileNode, condition, body)
 
     def for_statement(self):
-        print("Parsing for statement")
+        if tracer.enabled:
+            tracer.debug("Parsing for statement")
         self.expect('KEYWORD')  # Expect 'for'
         self.expect('PAREN')  # Expect '('
         init = self.statement()
-        print(f"For init: {init}")
+        if tracer.enabled:
+            tracer.debug(f"For init: {init}")
         self.expect('END')  # Expect ';'
         condition = self.condition()
-        print(f"For condition: {condition}")
+        if tracer.enabled:
+            tracer.debug(f"For condition: {condition}")
         self.expect('END')  # Expect ';'
         update = self.statement()
-        print(f"For update: {update}")
+        if tracer.enabled:
+            tracer.debug(f"For update: {update}")
         self.expect('PAREN')  # Expect ')'
         body = self.block()
-        print(f"For body: {body}")
-        return ForNode(init, condition, update, body)
+        if tracer.enabled:
+            tracer.debug(f"For body: {body}")
+        return self.build(ForNode, init, condition, update, body)
 
     def if_statement(self):
-        print("Parsing if statement")
+        if tracer.enabled:
+            tracer.debug("Parsing if statement")
         self.expect('KEYWORD')  # Expect 'if'
         condition = self.condition()
-        print(f"If condition: {condition}")
+        if tracer.enabled:
+            tracer.debug(f"If condition: {condition}")
         self.expect('COLON')  # Expect ':' instead of 'then'
         true_branch = self.block()
-        print(f"If true branch: {true_branch}")
+        if tracer.enabled:
+            tracer.debug(f"If true branch: {true_branch}")
         false_branch = None
         if self.current_token and self.current_token.type == 'KEYWORD' and self.current_token.value == 'else':
             self.advance()
             self.expect('COLON')  # Expect ':' after 'else' as well
             false_branch = self.block()
-            print(f"If false branch: {false_branch}")
-        return IfNode(condition, true_branch, false_branch)
+            if tracer.enabled:
+                tracer.debug(f"If false branch: {false_branch}")
+        return self.build(IfNode, condition, true_branch, false_branch)
 
     def condition(self):
-        left = self.expression()
-        if self.current_token and self.current_token.type == 'CMP':
-            op = self.current_token.value
-            self.advance()
-            right = self.expression()
-            return BinOpNode(left, op, right)
-        return left
+        return self.expression()
 
     def block(self):
         statements = []
         while self.current_token and self.current_token.type not in {'KEYWORD', 'END'}:
             stmt = self.statement()
-            if stmt:
+            if stmt is not None:
                 statements.append(stmt)
             while self.current_token and self.current_token.type == 'NEWLINE':
                 self.advance()
-        return statements
-
-    def expression(self):
-        """Parse an expression."""
-        node = self.term()
-
-        while self.current_token and self.current_token.type in {'OP', 'CMP'}:
-            op = self.current_token.value
-            self.advance()
-            right = self.term()
-            node = BinOpNode(node, op, right)
-
-        return node
-
-    def logical_expression(self):
-        """Parse a logical expression like 'x and y'."""
-        left = self.term()
-        op = self.current_token.value
-        self.advance()  # Move past the logical operator
-        right = self.term()
-        return BinOpNode(left, op, right)
-
-    def comparison_expression(self):
-        """Parse a comparison expression like 'x == y'."""
-        left = self.term()
-        op = self.current_token.value
-        self.advance()  # Move past the comparison operator
-        right = self.term()
-        return BinOpNode(left, op, right)
+        return self.builder.list(statements)
 
-    def term(self):
-        """Parse a term (numbers, variables, and strings)."""
-        while self.current_token and self.current_token.type == 'NEWLINE' or self.current_token and self.current_token.type == 'COMMENT':
+    def skip_blank_lines(self):
+        while self.current_token and self.current_token.type in ('NEWLINE', 'COMMENT'):
             self.advance()
 
-        def term(self):
-            if self.current_token is None:
+    def expression(self):
+        """Parse an expression by precedence climbing, without recursing into subexpressions.
+
+        Operators wait on a stack until one that binds no tighter follows, so
+        operators of equal precedence group to the left. Opening parentheses
+        and brackets sit on the same stack as markers, and an inline
+        assignment (x = ...) is a prefix binding loosest of all, so the Python
+        stack stays flat however long or deeply nested the expression is.
+        """
+        build = self.build
+        operands = []
+        pending = []  # (precedence, kind, value); kind is 'binary', 'unary', 'assign' or 'bracket'
+        openers = 0
+
+        def reduce(precedence):
+            """Apply the pending operators that bind at least as tightly as precedence."""
+            while pending and pending[-1][0] >= precedence:
+                _, kind, value = pending.pop()
+                if kind == 'binary':
+                    right = operands.pop()
+                    operands.append(build(BinOpNode, operands.pop(), value, right))
+                elif kind == 'unary':
+                    operands.append(build(UnaryOpNode, value, operands.pop()))
+                else:
+                    operands.append(build(AssignmentNode, value, operands.pop()))
+
+        while True:
+            # Prefix position: opening brackets, 'not', '-' and 'name =' until an operand
+            self.skip_blank_lines()
+            token = self.current_token
+            if token is None:
                 raise CompilerError("Unexpected end of input", -1)
+            if token.value in BRACKETS and token.type in ('PAREN', 'BRACKET'):
+                self.advance()
+                pending.append((BRACKET_PRECEDENCE, 'bracket', token.value))
+                openers += 1
+                continue
+            if token.type in ('LOGICAL', 'OP') and token.value in UNARY_PRECEDENCE:
+                self.advance()
+                pending.append((UNARY_PRECEDENCE[token.value], 'unary', token.value))
+                continue
+            if token.type == 'ID':
+                self.advance()
+                if self.current_token and self.current_token.type == 'ASSIGN':
+                    self.advance()
+                    pending.append((ASSIGNMENT_PRECEDENCE, 'assign', token.value))
+                    continue
+                operands.append(build(VariableNode, token.value))
+            else:
+                operands.append(self.term())
+
+            # Infix position: closing brackets, then a binary operator or the end of the expression
+            operator = None
+            while True:
+                if openers:
+                    self.skip_blank_lines()  # Line breaks are free inside brackets
+                token = self.current_token
+                if token is None:
+                    break
+                if token.type in ('OP', 'CMP', 'LOGICAL') and token.value in BINARY_PRECEDENCE:
+                    operator = token.value
+                    self.advance()
+                    break
+                if not openers or token.type not in ('PAREN', 'BRACKET') or token.value in BRACKETS:
+                    break
+                reduce(ASSIGNMENT_PRECEDENCE)
+                _, _, opener = pending.pop()
+                if BRACKETS[opener] != token.value:
+                    raise CompilerError(f"Expected '{BRACKETS[opener]}', got '{token.value}'", token.position)
+                openers -= 1
+                self.advance()
+            if operator is None:
+                break
+            precedence = BINARY_PRECEDENCE[operator]
+            reduce(precedence)
+            pending.append((precedence, 'binary', operator))
+
+        if openers:
+            opener = next(value for _, kind, value in reversed(pending) if kind == 'bracket')
+            raise CompilerError(f"Expected '{BRACKETS[opener]}', got {token.type if token else 'EOF'}",
+                                token.position if token else -1)
+        reduce(ASSIGNMENT_PRECEDENCE)
+        return operands[0]
 
+    def term(self):
+        """Parse an operand that isn't a variable: a literal, a { } block or a statement used as a value."""
         token = self.current_token
 
         if token.type == 'NUMBER':
             self.advance()
-            return NumberNode(token.value)
+            return self.build(NumberNode, token.value)
         elif token.type == 'COLON':
             self.advance()
 
-        elif token.type == 'ID':
-            var_name = token.value
-            self.advance()
-            if self.current_token and self.current_token.type == 'ASSIGN':
-                self.advance()
-                value = self.expression()
-                return AssignmentNode(var_name, value)
-            else:
-                return VariableNode(var_name)
         elif token.type == 'STRING':
             self.advance()
-            return StringNode(token.value)
-        elif token.type == 'PAREN' and token.value == '(':
-            self.advance()
-            expr = self.expression()
-            self.expect('PAREN')
-            return expr
-        elif token.type == 'LOGICAL':
-            return self.logical_expression()
+            return self.build(StringNode, token.value)
+        elif token.type in ('LOGICAL', 'CMP', 'OP'):
+            # 'not' and '-' are prefixes; a binary operator can't start an operand
+            raise CompilerError(f"Unexpected operator '{token.value}' at line {token.line}", token.position)
         elif token.type == 'PRINT':
             return self.print_statement()
-        elif token.type == 'CMP':
-            return self.comparison_expression()
-        elif token.type == 'BRACKET' and token.value == '[':
-            self.advance()
-            expr = self.expression()
-            self.expect('BRACKET')
-            return expr
         elif token.type == 'BRACE' and token.value == '{':
             self.advance()
             statements = self.block()
@@ -409,126 +427,103 @@ class SymbolTable:
         return f"SymbolTable(variables={self.variables})"
 
 
-class SemanticAnalyzer:
+COMPARISON_OPERATORS = ('==', '!=', '<', '<=', '>', '>=')
+
+
+class SemanticAnalyzer(NodeVisitor):
+    """Type checks the AST; each expression handler returns 'number', 'string' or 'unknown'."""
+    method_prefix = 'analyze_'
+
     def __init__(self):
         self.variables = {}
 
     def analyze(self, node):
         """Perform semantic analysis on the AST."""
-        if isinstance(node, ProgramNode):
-            for stmt in node.statements:
-                self.analyze(stmt)
-        elif isinstance(node, AssignmentNode):
-            self.analyze_assignment(node)
-        elif isinstance(node, BinOpNode):
-            self.analyze_binop(node)
-        elif isinstance(node, WhileNode):
-            self.analyze_while(node)
-        elif isinstance(node, ForNode):
-            self.analyze_for(node)
-
-        elif isinstance(node, IfNode):
-            self.analyze_if(node)
-        elif isinstance(node, VariableNode):
-            self.analyze_variable(node)
-        elif isinstance(node, NumberNode):
-            return
-        elif isinstance(node, StringNode):
-            return
-        else:
-            raise Exception(f"Unknown node type: {type(node)}")
+        return self.walk(node)
+
+    def analyze_list(self, statements):
+        for stmt in statements:
+            yield stmt
+
+    def analyze_program(self, node):
+        yield node.statements
+
+    def analyze_print(self, node):
+        yield node.expression
+
+    def analyze_number(self, node):
+        return 'number'
+
+    def analyze_string(self, node):
+        return 'string'
 
     def analyze_assignment(self, node):
         """Check that the assigned value is valid."""
         var_name = node.variable  # Corrected from 'node.var_name' to 'node.variable'
-        expr = node.value  # Corrected from 'node.expr' to 'node.value'
-
-        # Analyze the expression part
-        self.analyze(expr)
-
-        # Determine the type of the assigned value
-        if isinstance(expr, NumberNode):
-            self.variables[var_name] = 'number'
-            print(f"Assigning number to variable '{var_name}'")
-        elif isinstance(expr, StringNode):
-            self.variables[var_name] = 'string'
-            print(f"Assigning string to variable '{var_name}'")
-        elif isinstance(expr, BinOpNode):
-            # Determine the type of the binary operation result
-            left_type = self.get_expression_type(expr.left)
-            right_type = self.get_expression_type(expr.right)
-            if left_type != right_type:
-                raise CompilerError(f"Type mismatch in binary operation: {left_type} {expr.op} {right_type}",
-                                    node.position)
-            self.variables[var_name] = left_type
-            print(f"Assigning binary operation result to variable '{var_name}'")
-        else:
-            print(f"Assigning expression to variable '{var_name}'")
-
-    def get_expression_type(self, expr):
-        """Get the type of the expression."""
-        if isinstance(expr, VariableNode):
-            return self.variables.get(expr.name, 'unknown')
-        elif isinstance(expr, NumberNode):
-            return 'number'
-        elif isinstance(expr, StringNode):
-            return 'string'
-        else:
-            return 'unknown'
+
+        # Analyze the expression part and determine the type of the assigned value
+        value_type = yield node.value
+
+        # The variable is declared either way
+        previous = self.variables.get(var_name, 'unknown')
+        if 'unknown' not in (previous, value_type) and previous != value_type:
+            raise CompilerError(f"Cannot assign a {value_type} to {previous} variable '{var_name}'", -1)
+        self.variables[var_name] = value_type if value_type != 'unknown' else previous
+        if tracer.enabled:
+            tracer.debug(f"Assigning {value_type} to variable '{var_name}'")
 
     def analyze_binop(self, node):
         """Check that both sides of the binary operation are compatible."""
-        left = node.left
-        right = node.right
         op = node.op
 
         # Analyze both sides
-        self.analyze(left)
-        self.analyze(right)
-
-        # Check types for simple compatibility
-        if isinstance(left, VariableNode) and left.name in self.variables:
-            left_type = self.variables[left.name]
-        elif isinstance(left, NumberNode):
-            left_type = 'number'
-        elif isinstance(left, StringNode):
-            left_type = 'string'
-        else:
-            left_type = 'unknown'
-
-        if isinstance(right, VariableNode) and right.name in self.variables:
-            right_type = self.variables[right.name]
-        elif isinstance(right, NumberNode):
-            right_type = 'number'
-        elif isinstance(right, StringNode):
-            right_type = 'string'
+        left_type = yield node.left
+        right_type = yield node.right
+
+        if op in COMPARISON_OPERATORS or op in ('and', 'or'):
+            result_type = 'number'  # 0 or 1
         else:
-            right_type = 'unknown'
+            result_type = left_type if left_type == right_type else 'unknown'
 
+        # Check types for simple compatibility; anything still unknown is left to TypeInference
+        if 'unknown' in (left_type, right_type):
+            return result_type
         if left_type != right_type:
-            raise Exception(f"Type mismatch in binary operation: {left_type} {op} {right_type}")
-        else:
-            print(f"Binary operation '{op}' between {left_type} and {right_type} is valid.")
+            raise CompilerError(f"Type mismatch in binary operation: {left_type} {op} {right_type}", -1)
+        if left_type == 'string' and op != '+' and op not in COMPARISON_OPERATORS:
+            raise CompilerError(f"Operator '{op}' can't be applied to strings", -1)
+        elif tracer.enabled:
+            tracer.debug(f"Binary operation '{op}' between {left_type} and {right_type} is valid.")
+        return result_type
+
+    def analyze_unaryop(self, node):
+        operand_type = yield node.operand
+        if operand_type == 'string':
+            raise CompilerError(f"Operator '{node.op}' can't be applied to strings", -1)
+        return operand_type if node.op == '-' else 'number'  # not gives 0 or 1
 
     def analyze_if(self, node):
         """Analyze the condition and the branches of the if statement."""
-        print("Analyzing if statement")
-        self.analyze(node.condition)
-        print("Analyzing true branch")
-        self.analyze(node.true_branch)
+        if tracer.enabled:
+            tracer.debug("Analyzing if statement")
+        yield node.condition
+        if tracer.enabled:
+            tracer.debug("Analyzing true branch")
+        yield node.true_branch
         if node.false_branch:
-            print("Analyzing false branch")
-            self.analyze(node.false_branch)
+            if tracer.enabled:
+                tracer.debug("Analyzing false branch")
+            yield node.false_branch
 
     def analyze_while(self, node):
-        self.analyze(node.condition)
-        self.analyze(node.body)
+        yield node.condition
+        yield node.body
 
     def analyze_for(self, node):
-        self.analyze(node.init)
-        self.analyze(node.condition)
-        self.analyze(node.update)
-        self.analyze(node.body)
+        yield node.init
+        yield node.condition
+        yield node.update
+        yield node.body
 
     def analyze_variable(self, node):
         """Check that the variable is declared."""
@@ -536,73 +531,76 @@ class SemanticAnalyzer:
 
         if name not in self.variables:
             raise NameError(f"Variable '{name}' is not defined")
-        else:
-            print(f"Variable '{name}' is declared and used correctly.")
+        elif tracer.enabled:
+            tracer.debug(f"Variable '{name}' is declared and used correctly.")
+        return self.variables[name]
 
 
-class IntermediateCodeGenerator:
+class IntermediateCodeGenerator(NodeVisitor):
+    """Lowers the AST to IR; each expression handler returns the operand holding its value."""
+    method_prefix = 'generate_'
+
     def __init__(self):
-        self.temp_count = 0
-        self.label_count = 0
-        self.instructions = []
+        self.program = IRProgram()
+        self.instructions = self.program.instructions
 
     def new_temp(self):
-        self.temp_count += 1
-        return f"T{self.temp_count}"
+        return self.program.new_temp()
 
     def new_label(self):
-        self.label_count += 1
-        return f"L{self.label_count}"
+        return self.program.new_label()
 
     def generate(self, node):
-        if isinstance(node, list):
-            for stmt in node:
-                self.generate(stmt)
-        elif isinstance(node, ProgramNode):
-            for stmt in node.statements:
-                self.generate(stmt)
-        elif isinstance(node, AssignmentNode):
-            self.generate_assignment(node)
-        elif isinstance(node, BinOpNode):
-            return self.generate_binop(node)
-        elif isinstance(node, NumberNode):
-            return str(node.value)
-        elif isinstance(node, StringNode):
-            return f'"{node.value}"'  # Add this line to handle StringNode
-        elif isinstance(node, PrintNode):
-            self.generate_print(node)
-        elif isinstance(node, IfNode):
-            self.generate_if(node)
-        elif isinstance(node, VariableNode):
-            return node.name
-        elif isinstance(node, WhileNode):
-            self.generate_while(node)
-        elif isinstance(node, ForNode):
-            self.generate_for(node)
-        else:
-            raise Exception(f"Unknown node type: {type(node)}")
+        return self.walk(node)
+
+    def generate_list(self, statements):
+        for stmt in statements:
+            yield stmt
+
+    def generate_program(self, node):
+        yield node.statements
+
+    def generate_number(self, node):
+        return self.program.constant(node.value)
+
+    def generate_string(self, node):
+        return self.program.constant(node.value[1:-1])  # Strip the quotes kept by the tokenizer
+
+    def generate_variable(self, node):
+        return self.program.variable(node.name)
 
     def generate_assignment(self, node):
-        value = self.generate(node.value)
-        self.instructions.append(f"STORE {value} {node.variable}")
+        value = yield node.value
+        self.program.emit(Opcode.STORE, dest=self.program.variable(node.variable), a=value)
 
     def generate_binop(self, node):
-        left = self.generate(node.left)
-        right = self.generate(node.right)
+        left = yield node.left
+        right = yield node.right
         result = self.new_temp()
-        self.instructions.append(f"{node.op} {left} {right} {result}")
+        self.program.emit(BINARY_OPCODES[node.op], dest=result, a=left, b=right)
+        return result
+
+    def generate_unaryop(self, node):
+        operand = yield node.operand
+        result = self.new_temp()
+        if node.op == '-':
+            # -x is x * -1, which keeps the type and gives -0.0 for 0.0 as C++ does; constants fold
+            self.program.emit(Opcode.MUL, dest=result, a=operand, b=self.program.constant(-1))
+        else:
+            # not x is x == 0, as in C++ for both ints and doubles
+            self.program.emit(Opcode.EQ, dest=result, a=operand, b=self.program.constant(0))
         return result
 
     def generate_while(self, node):
         start_label = self.new_label()
         end_label = self.new_label()
 
-        self.instructions.append(f"{start_label}:")
-        condition = self.generate(node.condition)
-        self.instructions.append(f"IF NOT {condition} GOTO {end_label}")
-        self.generate(node.body)
-        self.instructions.append(f"GOTO {start_label}")
-        self.instructions.append(f"{end_label}:")
+        self.program.emit(Opcode.LABEL, label=start_label)
+        condition = yield node.condition
+        self.program.emit(Opcode.IF_NOT, a=condition, label=end_label)
+        yield node.body
+        self.program.emit(Opcode.GOTO, label=start_label)
+        self.program.emit(Opcode.LABEL, label=end_label)
 
     def generate_for(self, node):
         init_label = self.new_label()
@@ -610,42 +608,43 @@ class IntermediateCodeGenerator:
         update_label = self.new_label()
         end_label = self.new_label()
 
-        self.instructions.append(f"{init_label}:")
-        self.generate(node.init)
-        self.instructions.append(f"{start_label}:")
-        condition = self.generate(node.condition)
-        self.instructions.append(f"IF NOT {condition} GOTO {end_label}")
-        self.generate(node.body)
-        self.instructions.append(f"{update_label}:")
-        self.generate(node.update)
-        self.instructions.append(f"GOTO {start_label}")
-        self.instructions.append(f"{end_label}:")
+        self.program.emit(Opcode.LABEL, label=init_label)
+        yield node.init
+        self.program.emit(Opcode.LABEL, label=start_label)
+        condition = yield node.condition
+        self.program.emit(Opcode.IF_NOT, a=condition, label=end_label)
+        yield node.body
+        self.program.emit(Opcode.LABEL, label=update_label)
+        yield node.update
+        self.program.emit(Opcode.GOTO, label=start_label)
+        self.program.emit(Opcode.LABEL, label=end_label)
 
     def generate_print(self, node):
-        value = self.generate(node.expression)
-        self.instructions.append(f"PRINT {value}")
+        value = yield node.expression
+        self.program.emit(Opcode.PRINT, a=value)
 
     def generate_if(self, node):
-        condition = self.generate(node.condition)
+        condition = yield node.condition
         true_label = self.new_label()
         false_label = self.new_label()
         end_label = self.new_label()
 
-        self.instructions.append(f"IF {condition} GOTO {true_label}")
-        self.instructions.append(f"GOTO {false_label}")
+        self.program.emit(Opcode.IF, a=condition, label=true_label)
+        self.program.emit(Opcode.GOTO, label=false_label)
 
-        self.instructions.append(f"{true_label}:")
-        self.generate(node.true_branch)
-        self.instructions.append(f"GOTO {end_label}")
+        self.program.emit(Opcode.LABEL, label=true_label)
+        yield node.true_branch
+        self.program.emit(Opcode.GOTO, label=end_label)
 
-        self.instructions.append(f"{false_label}:")
+        self.program.emit(Opcode.LABEL, label=false_label)
         if node.false_branch:
-            self.generate(node.false_branch)
+            yield node.false_branch
 
-        self.instructions.append(f"{end_label}:")
+        self.program.emit(Opcode.LABEL, label=end_label)
 
     def get_code(self):
-        return "\n".join(self.instructions)
+        """Text dump of the generated IR, for debugging."""
+        return self.program.dump()
 
 
 class CompilerError(Exception):
@@ -657,46 +656,471 @@ class CompilerError(Exception):
         return f"CompilerError at position {self.position}: {self.message}"
 
 
+# Operators whose C++ spelling differs from the source language
+CPP_OPERATORS = {
+    Opcode.AND: '&&',
+    Opcode.OR: '||',
+}
+
+# C++ declaration for each inferred type, with the zero value a variable starts out as
+CPP_TYPES = {
+    ValueType.INT: ('std::int64_t', ' = 0'),
+    ValueType.FLOAT: ('double', ' = 0.0'),
+    ValueType.STRING: ('std::string', ''),
+}
+
+
+def cpp_literal(value):
+    """Render a constant operand as a C++ literal."""
+    if isinstance(value, str):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return str(value)
+
+
+def include_lines(headers):
+    """#include lines for headers, <iostream> first."""
+    return [f"#include {header}" for header in sorted(headers, key=lambda header: (header != "<iostream>", header))]
+
+
+def prologue_lines(headers, prints, print_buffering='auto'):
+    """Everything before main(): the #includes, then the output runtime if the program prints."""
+    lines = include_lines(headers)
+    if prints:
+        lines += runtime_lines(print_buffering)
+    return lines
+
+
 class CppCodeGenerator:
-    def __init__(self, intermediate_code):
-        self.intermediate_code = intermediate_code.split('\n')
+    def __init__(self, program, structured=True, parallel_loops=None, print_buffering='auto'):
+        self.program = program
+        self.structured = structured
+        # Minimum trip count for running an independent for loop under OpenMP; None never does
+        self.parallel_loops = parallel_loops
+        self.print_buffering = print_buffering
+        self.prints = False  # Whether the output runtime is needed
+        # compile_code infers types before optimizing; a program built some other way may not have them yet
+        if ValueType.UNKNOWN in (program.types[operand] for operand, kind in enumerate(program.kinds)
+                                 if kind == OperandKind.VARIABLE or kind == OperandKind.TEMP):
+            from TypeInference import infer_types
+
+            infer_types(program)
         self.cpp_code = []
-        self.label_map = {}
+        self.headers = {"<iostream>", "<cstdint>"}
+        # Render every operand once up front instead of once per use
+        self.names = [cpp_literal(value) if kind == OperandKind.CONSTANT else value
+                      for kind, value in zip(program.kinds, program.values)]
+        self.block_labels = {}  # id(block) -> label name, for blocks a structured goto targets
+        self.handlers = {
+            Opcode.LABEL: self.process_label,
+            Opcode.GOTO: self.process_goto,
+            Opcode.IF: self.process_if,
+            Opcode.IF_NOT: self.process_if_not,
+            Opcode.STORE: self.process_store,
+            Opcode.PRINT: self.process_print,
+        }
+        for opcode in OPERATOR_SYMBOLS:
+            self.handlers[opcode] = self.process_binop
 
     def generate(self):
-        self.cpp_code.append("#include <iostream>")
+        statements, structurer = self.structure()
         self.cpp_code.append("int main() {")
-
-        for line in self.intermediate_code:
-            if line.strip():
-                self.process_line(line.strip())
-
+        # Declare every variable and temporary once with its inferred type, at function
+        # scope so jumps never cross an initialisation
+        self.declare((OperandKind.VARIABLE, OperandKind.TEMP), structurer)
+        self.emit_body(statements, structurer)
         self.cpp_code.append("    return 0;")
         self.cpp_code.append("}")
-
-        return '\n'.join(self.cpp_code)
-
-    def process_line(self, line):
-        if line.startswith('STORE'):
-            _, value, var = line.split()
-            self.cpp_code.append(f"    int {var} = {value};")
-        elif line.startswith('PRINT'):
-            _, value = line.split(maxsplit=1)
-            self.cpp_code.append(f'    std::cout << {value} << std::endl;')
-        elif line.startswith('L'):
-            label = line.rstrip(':')
-            self.cpp_code.append(f"{label}:")
-        elif line.startswith('GOTO'):
-            _, label = line.split()
-            self.cpp_code.append(f"    goto {label};")
-        elif line.startswith('IF'):
-            parts = line.split()
-            condition = ' '.join(parts[1:-2])
-            label = parts[-1]
-            self.cpp_code.append(f"    if ({condition}) goto {label};")
+        return '\n'.join(prologue_lines(self.headers, self.prints, self.print_buffering) + self.cpp_code)
+
+    def generate_fragment(self):
+        """(temp declarations, statements) for a program that is one piece of a larger main().
+
+        The caller declares the variables, which the pieces share. Temps and
+        labels are the piece's own, so nothing here may jump out of it: a
+        piece structuring can't express without a goto is emitted with IR
+        labels instead, which are unique program-wide.
+        """
+        statements, structurer = self.structure()
+        if structurer is not None and structurer.goto_targets:
+            statements, structurer = None, None
+        self.declare((OperandKind.TEMP,), structurer)
+        declarations = self.cpp_code
+        self.cpp_code = []
+        self.emit_body(statements, structurer)
+        return declarations, self.cpp_code
+
+    def structure(self):
+        """(structured statements, Structurer), or (None, None) to emit one goto per jump."""
+        if not self.structured:
+            return None, None
+        from Structuring import Structurer
+
+        structurer = Structurer(self.program)
+        statements = structurer.structure()
+        return (statements, structurer) if statements is not None else (None, None)
+
+    def declare(self, kinds, structurer, declared=()):
+        """Declare the operands of kinds, except those inlined or in declared."""
+        types = self.program.types
+        inlined = structurer.inlined if structurer is not None else ()
+        for operand, kind in enumerate(self.program.kinds):
+            if kind in kinds and operand not in inlined and operand not in declared:
+                cpp_type, initialiser = CPP_TYPES[types[operand]]
+                if types[operand] == ValueType.STRING:
+                    self.headers.add("<string>")
+                self.cpp_code.append(f"    {cpp_type} {self.names[operand]}{initialiser};")
+
+    def emit_body(self, statements, structurer):
+        if statements is None:
+            # Irreducible control flow (or structuring turned off): one goto per jump
+            handlers = self.handlers
+            for instruction in self.program.instructions:
+                indent = "" if instruction.opcode == Opcode.LABEL else "    "
+                self.cpp_code.append(indent + handlers[instruction.opcode](instruction))
+        else:
+            self.render(statements, 1, structurer.goto_targets)
+
+    def render(self, statements, depth, goto_targets):
+        """Append structured statements to the output, indented depth levels."""
+        from Structuring import BlockLabel, IfStatement, JumpStatement, LoopStatement
+
+        indent = "    " * depth
+        code = self.cpp_code
+        labelled = False  # A label must be followed by a statement
+        previous = None  # The instruction control reaches the statement from
+        for statement in statements:
+            if isinstance(statement, BlockLabel):
+                if id(statement.block) in goto_targets:
+                    code.append(f"{indent[4:]}{self.block_label(statement.block)}:")
+                    labelled = True
+                    previous = None
+                continue
+            labelled = False
+            if isinstance(statement, LoopStatement) and self.parallel_loops is not None:
+                from ParallelLoops import analyze_loop
+
+                plan = analyze_loop(self.program, statement, goto_targets, previous)
+                if plan is not None and (plan.trips is None or plan.trips >= max(self.parallel_loops, 1)):
+                    self.render_parallel_loop(statement, plan, depth, goto_targets)
+                    previous = None
+                    continue
+            previous = statement if isinstance(statement, Instruction) else None
+            if isinstance(statement, IfStatement):
+                condition, then_body, else_body = statement.condition, statement.then_body, statement.else_body
+                # A body of labels no goto targets renders as nothing
+                if self.renders_empty(else_body, goto_targets):
+                    else_body = []
+                elif self.renders_empty(then_body, goto_targets):
+                    condition, then_body, else_body = condition.inverted(), else_body, []
+                condition = self.condition_text(condition)
+                if len(then_body) == 1 and isinstance(then_body[0], JumpStatement) and not else_body:
+                    code.append(f"{indent}if ({condition}) {self.jump_text(then_body[0])}")
+                    continue
+                code.append(f"{indent}if ({condition}) {{")
+                self.render(then_body, depth + 1, goto_targets)
+                if else_body:
+                    code.append(f"{indent}}} else {{")
+                    self.render(else_body, depth + 1, goto_targets)
+                code.append(f"{indent}}}")
+            elif isinstance(statement, LoopStatement):
+                if statement.condition is None:
+                    code.append(f"{indent}while (true) {{")
+                elif statement.update is None:
+                    code.append(f"{indent}while ({self.condition_text(statement.condition)}) {{")
+                else:
+                    # Assignments are expressions in C++, so the update is them joined with commas
+                    update = ", ".join(self.handlers[instruction.opcode](instruction)[:-1]
+                                       for instruction in statement.update)
+                    code.append(f"{indent}for (; {self.condition_text(statement.condition)}; {update}) {{")
+                self.render(statement.body, depth + 1, goto_targets)
+                code.append(f"{indent}}}")
+            elif isinstance(statement, JumpStatement):
+                code.append(indent + self.jump_text(statement))
+            else:
+                code.append(indent + self.handlers[statement.opcode](statement))
+        if labelled:
+            code.append(indent + ";")
+
+    @staticmethod
+    def renders_empty(statements, goto_targets):
+        from Structuring import BlockLabel
+
+        return all(isinstance(statement, BlockLabel) and id(statement.block) not in goto_targets
+                   for statement in statements)
+
+    def render_parallel_loop(self, loop, plan, depth, goto_targets):
+        """Append a for loop as '#pragma omp parallel for' over OpenMP's canonical form of it."""
+        from ParallelLoops import ASCENDING
+
+        indent = "    " * depth
+        code = self.cpp_code
+        names = self.names
+        counter = names[plan.counter]
+        test = f"{counter} {OPERATOR_SYMBOLS[plan.opcode]} {names[plan.bound]}"
+        step = f"{counter} += {plan.step}" if plan.step > 0 else f"{counter} -= {-plan.step}"
+        clauses = []
+        if plan.trips is None:
+            # The start can't be counter itself, which the loop makes private. A loop that doesn't run at
+            # all is skipped, since its lastprivate variables would be left undefined rather than untouched.
+            start = self.fresh_name(f"{counter}_start")
+            code.append(f"{indent}if ({test}) {{")
+            indent += "    "
+            depth += 1
+            code.append(f"{indent}const std::int64_t {start} = {counter};")
+            if self.parallel_loops > 1:
+                span = f"{names[plan.bound]} - {start}" if ASCENDING[plan.opcode] else f"{start} - {names[plan.bound]}"
+                inclusive = plan.opcode in (Opcode.LE, Opcode.GE)
+                clauses.append(f"if({span} {'>=' if inclusive else '>'} {(self.parallel_loops - 1) * abs(plan.step)})")
         else:
-            # Handle other intermediate code instructions
-            self.cpp_code.append(f"    // TODO: {line}")
+            start = plan.initial
+        if plan.private:
+            clauses.append(f"private({', '.join(names[operand] for operand in plan.private)})")
+        clauses.append(f"lastprivate({', '.join(names[operand] for operand in plan.lastprivate)})")
+        operators = {}
+        for operand, operator in plan.reductions.items():
+            operators.setdefault(operator, []).append(names[operand])
+        for operator, reduced in operators.items():
+            clauses.append(f"reduction({operator}: {', '.join(reduced)})")
+        code.append(f"{indent}#pragma omp parallel for {' '.join(clauses)}")
+        code.append(f"{indent}for ({counter} = {start}; {test}; {step}) {{")
+        self.render(loop.body, depth + 1, goto_targets)
+        code.append(f"{indent}}}")
+        if plan.trips is None:
+            code.append(f"{indent[4:]}}}")
+
+    def fresh_name(self, stem):
+        """A C++ name based on stem that no operand of the program uses."""
+        taken = set(self.program.values)
+        name, suffix = stem, 1
+        while name in taken:
+            suffix += 1
+            name = f"{stem}{suffix}"
+        return name
+
+    def block_label(self, block):
+        name = self.block_labels.get(id(block))
+        if name is None:
+            # Reuse the IR's label where the block has one; B<n> can't clash with an IR label L<n>
+            name = self.names[block.labels[0]] if block.labels else f"B{len(self.block_labels) + 1}"
+            self.block_labels[id(block)] = name
+        return name
+
+    def jump_text(self, statement):
+        if statement.keyword == 'goto':
+            return f"goto {self.block_label(statement.target)};"
+        if statement.keyword == 'return':
+            return "return 0;"
+        return f"{statement.keyword};"
+
+    def condition_text(self, condition):
+        if condition.expression is None:
+            text = self.names[condition.operand]
+            return f"!{text}" if condition.negated else text
+        text = self.expression_text(condition.expression)
+        return f"!({text})" if condition.negated else text
+
+    def process_label(self, instruction):
+        return f"{self.names[instruction.label]}:"
+
+    def process_goto(self, instruction):
+        return f"goto {self.names[instruction.label]};"
+
+    def process_if(self, instruction):
+        return f"if ({self.names[instruction.a]}) goto {self.names[instruction.label]};"
+
+    def process_if_not(self, instruction):
+        return f"if (!{self.names[instruction.a]}) goto {self.names[instruction.label]};"
+
+    def process_store(self, instruction):
+        return f"{self.names[instruction.dest]} = {self.names[instruction.a]};"
+
+    def process_print(self, instruction):
+        if not self.prints:
+            self.prints = True
+            self.headers.update(PRINT_HEADERS)
+        return print_statement(self.program.types[instruction.a], self.names[instruction.a])
+
+    def process_binop(self, instruction):
+        return f"{self.names[instruction.dest]} = {self.expression_text(instruction)};"
+
+    def expression_text(self, instruction):
+        """The right-hand side of a binary instruction."""
+        program = self.program
+        opcode = instruction.opcode
+        left, right = self.names[instruction.a], self.names[instruction.b]
+        left_type = program.types[instruction.a]
+        kinds = program.kinds
+        if kinds[instruction.a] == OperandKind.CONSTANT and kinds[instruction.b] == OperandKind.CONSTANT:
+            # Two literals would otherwise be int arithmetic (overflow) or pointer arithmetic (strings)
+            if left_type == ValueType.INT:
+                left = f"std::int64_t({left})"
+            elif left_type == ValueType.STRING:
+                from TypeInference import COMPARISON_OPCODES
+
+                if opcode == Opcode.ADD or opcode in COMPARISON_OPCODES:
+                    left = f"std::string({left})"
+        if opcode == Opcode.MOD and ValueType.FLOAT in (left_type, program.types[instruction.b]):
+            self.headers.add("<cmath>")
+            return f"std::fmod({left}, {right})"
+        operator = CPP_OPERATORS.get(opcode, OPERATOR_SYMBOLS[opcode])
+        return f"{left} {operator} {right}"
+
+
+class CompilationResult:
+    """The artifacts produced by every stage of the pipeline."""
+
+    def __init__(self, tokens, ast, ir, cpp, cached=False):
+        self.tokens = tokens  # None when the parser streamed them
+        self.ast = ast
+        self.ir = ir
+        self.cpp = cpp
+        self.cached = cached
+
+    def artifacts(self):
+        return {'tokens': self.tokens, 'ast': self.ast, 'ir': self.ir, 'cpp': self.cpp}
+
+    def __repr__(self):
+        token_count = "streamed" if self.tokens is None else len(self.tokens)
+        return f"CompilationResult({token_count} tokens, {self.ir}, cached={self.cached})"
+
+
+class NodeCounter(NodeVisitor):
+    method_prefix = 'count_'
+
+    def count_list(self, nodes):
+        total = 0
+        for node in nodes:
+            total += yield node
+        return total
+
+    def generic_visit(self, node):
+        total = 1
+        for child in self.visit_children(node):
+            total += yield child
+        return total
+
+
+def count_nodes(ast):
+    """Count the AST nodes reachable from ast (a node or a list of them)."""
+    return NodeCounter().walk(ast)
+
+
+def compile_code(code, options=None, cache=None, profiler=NULL_PROFILER):
+    """Run tokenize -> parse -> analyze -> IR -> types -> optimize -> temps -> C++ on code.
+
+    Cached artifacts are reused when the input is unchanged.
+
+    With options['stream_tokens'] the parser pulls tokens from the lexer one at a
+    time and the token list is never materialised (result.tokens is None).
+    options['opt_level'] (0-2) picks the IR optimization passes; 'enabled_passes'
+    and 'disabled_passes' add or remove individual ones. options['structured'] =
+    False emits gotos instead of rebuilt loops and if/else, and
+    options['reuse_temps'] = False gives every temp its own C++ local.
+    options['flat_ast'] builds the AST as a SyntaxTree.NodeTable, which takes a
+    fraction of the memory of node objects on large inputs.
+    options['parallel_loops'] = n runs independent for loops of at least n
+    iterations under OpenMP; build the C++ with native_flags(options).
+    options['print_buffering'] is one of PrintRuntime.BUFFERING_MODES.
+    Pass a Tracing.Profiler to record time, memory and counts for each phase.
+    """
+    options = options or {}
+    key = None
+    if cache is not None:
+        from CompileCache import cache_key
+        with profiler.phase('cache'):
+            key = cache_key(code, COMPILER_VERSION, options)
+            artifacts = cache.get(key)
+        if artifacts is not None:
+            return CompilationResult(cached=True, **artifacts)
+
+    # Step 1: Tokenize the input code
+    if options.get('stream_tokens'):
+        tokens = None
+        token_stream = iter_tokens(code)
+    else:
+        with profiler.phase('lex') as phase:
+            tokens = token_stream = tokenize(code)
+        phase['tokens'] = len(tokens)
+
+    # Step 2: Parse the tokens into an AST (lexing happens here too when streaming)
+    with profiler.phase('parse') as phase:
+        ast = Parser(token_stream, FlatNodeBuilder() if options.get('flat_ast') else None).parse()
+    if profiler.enabled:
+        phase['nodes'] = count_nodes(ast)
+
+    # Step 3: Check the AST
+    with profiler.phase('analyze'):
+        SemanticAnalyzer().analyze(ast)
+
+    program, cpp_code = generate_cpp(ast, options, profiler)
+    result = CompilationResult(tokens, ast, program, cpp_code)
+    if cache is not None:
+        with profiler.phase('cache_store'):
+            cache.put(key, result.artifacts())
+    return result
+
+
+def compile_source(text, options=None, profiler=NULL_PROFILER):
+    """Compile source text to C++ and return the CompilationResult; the library entry point.
+
+    Nothing is read, written, printed or cached: the result's cpp, ir and ast
+    are all there is. options are compile_code's.
+    """
+    return compile_code(text, options, profiler=profiler)
+
+
+def generate_cpp(ast, options, profiler=NULL_PROFILER):
+    """The back half of compile_code: IR, types, optimization, temps and C++ for a checked AST.
+
+    Returns (IR program, C++ source).
+    """
+    program = generate_ir(ast, options, profiler)
+
+    # Step 8: Generate C++ from the intermediate code
+    with profiler.phase('cpp') as phase:
+        cpp_code = CppCodeGenerator(program, options.get('structured', True), options.get('parallel_loops'),
+                                    options.get('print_buffering', 'auto')).generate()
+    phase['lines'] = cpp_code.count('\n') + 1
+    return program, cpp_code
+
+
+def generate_ir(ast, options, profiler=NULL_PROFILER, variable_types=None):
+    """IR, types, optimization and temps for a checked AST; returns the IR program ready for a code generator.
+
+    variable_types (name -> ValueType) gives the types of variables the program
+    reads without assigning them, which the caller sets before it runs.
+    """
+    from TypeInference import infer_types
+
+    # Step 4: Generate intermediate code from the AST
+    with profiler.phase('ir') as phase:
+        ir_gen = IntermediateCodeGenerator()
+        ir_gen.generate(ast)
+    phase['instructions'] = len(ir_gen.program.instructions)
+
+    # Step 5: Infer a C++ type for every variable and temp
+    with profiler.phase('types'):
+        for name, value_type in (variable_types or {}).items():
+            if name in ir_gen.program.variables:
+                ir_gen.program.types[ir_gen.program.variables[name]] = value_type
+        infer_types(ir_gen.program)
+
+    # Step 6: Optimize the intermediate code
+    opt_level = options.get('opt_level', 0)
+    if opt_level or options.get('enabled_passes'):
+        from Optimizer import optimize
+
+        with profiler.phase('optimize') as phase:
+            optimize(ir_gen.program, opt_level, options.get('disabled_passes', ()), options.get('enabled_passes', ()))
+        phase['instructions'] = len(ir_gen.program.instructions)
+
+    # Step 7: Let temps whose live ranges don't overlap share a C++ local
+    if options.get('reuse_temps', True):
+        from TempAllocation import reuse_temps
+
+        with profiler.phase('temps') as phase:
+            phase['reused'] = reuse_temps(ir_gen.program)
+    return ir_gen.program
 
 
 code = """
@@ -719,43 +1143,200 @@ z = x + y
 print z
 
 """
-try:
-    # Step 1: Tokenize the input code
-    tokens = tokenize(code)
-
-    # Check if tokens are generated correctly
-    print("Tokens:", tokens)
-
-    # Step 2: Parse the tokens into an AST
-    parser = Parser(tokens)  # Ensure your Parser class is defined and works with tokens
-    ast = parser.parse()  # This should return the AST, which is stored in `ast`
 
-    # Check if the AST is generated correctly
-    print("\nGenerated AST:")
-    for node in ast:
-        print(node)
 
-    # Step 3: Generate intermediate code from the AST
-    ir_gen = IntermediateCodeGenerator()
-    for node in ast:
-        ir_gen.generate(node)
-
-    # Step 4: Print the intermediate code
-    print("\nIntermediate Code:")
-    print(ir_gen.get_code())
-    # Step 5:
-    ir_code = ir_gen.get_code()
-    cpp_generator = CppCodeGenerator(ir_code)
-
-    cpp_code = cpp_generator.generate()
-
-    with open("CPPFile.cpp", 'a') as File:
-        File.writelines(cpp_code)
-        print(cpp_code)
+def add_optimization_arguments(arg_parser):
+    from Optimizer import OPTIMIZATION_LEVELS, PASSES
+    from ParallelLoops import DEFAULT_MIN_TRIPS
+
+    arg_parser.add_argument('-O', dest='opt_level', type=int, choices=sorted(OPTIMIZATION_LEVELS), default=0,
+                            help="IR optimization level (default: 0)")
+    arg_parser.add_argument('--enable-pass', action='append', choices=sorted(PASSES), default=[],
+                            help="run an optimization pass even if the level doesn't include it")
+    arg_parser.add_argument('--disable-pass', action='append', choices=sorted(PASSES), default=[],
+                            help="skip an optimization pass")
+    arg_parser.add_argument('--no-structure', dest='structured', action='store_false',
+                            help="emit every jump as a goto instead of rebuilding loops and if/else")
+    arg_parser.add_argument('--no-temp-reuse', dest='reuse_temps', action='store_false',
+                            help="give every IR temp its own C++ local")
+    arg_parser.add_argument('--flat-ast', action='store_true',
+                            help="build the AST as a compact node table instead of node objects")
+    arg_parser.add_argument('--openmp', dest='parallel_loops', metavar='MIN_TRIPS', type=int, nargs='?',
+                            const=DEFAULT_MIN_TRIPS, default=None,
+                            help="run for loops whose iterations are independent on every core with OpenMP, "
+                                 f"when they go round at least MIN_TRIPS times (default: {DEFAULT_MIN_TRIPS})")
+    arg_parser.add_argument('--print-buffering', choices=BUFFERING_MODES, default='auto',
+                            help="when the program's output is written: after every line ('line'), when the buffer "
+                                 "fills or at exit ('full'), or per line only on a terminal ('auto', the default)")
+
+
+def optimization_options(args):
+    options = {}
+    if args.opt_level:
+        options['opt_level'] = args.opt_level
+    if args.enable_pass:
+        options['enabled_passes'] = sorted(args.enable_pass)
+    if args.disable_pass:
+        options['disabled_passes'] = sorted(args.disable_pass)
+    if not args.structured:
+        options['structured'] = False
+    if not args.reuse_temps:
+        options['reuse_temps'] = False
+    if args.flat_ast:
+        options['flat_ast'] = True
+    if args.parallel_loops is not None:
+        options['parallel_loops'] = max(args.parallel_loops, 0)
+    if args.print_buffering != 'auto':
+        options['print_buffering'] = args.print_buffering
+    return options
+
+
+def native_flags(options):
+    """Extra g++ flags the C++ generated with options needs."""
+    return ['-fopenmp'] if options.get('parallel_loops') is not None else []
+
+
+def main():
+    import argparse
+
+    from BytecodeVM import RUN_MODES
+    from GccBuild import PROFILES
+
+    arg_parser = argparse.ArgumentParser(description="Compile a source file to C++.")
+    arg_parser.add_argument('input', nargs='?', help="source file (default: the built-in sample program)")
+    arg_parser.add_argument('-o', '--output', default="CPPFile.cpp",
+                            help="generated C++ file, rewritten only if its content changes (default: CPPFile.cpp)")
+    arg_parser.add_argument('--manifest', default=None,
+                            help="JSON dependency manifest to record the output in "
+                                 "(default: cppcompiler_deps.json next to the output)")
+    arg_parser.add_argument('--log-level', choices=sorted(LOG_LEVELS), default='off',
+                            help="trace compiler internals to stderr: a summary of each phase at info, "
+                                 "every token, node and statement at debug")
+    arg_parser.add_argument('--profile', metavar='FILE', nargs='?', const='-', default=None,
+                            help="write per-phase timings, counts and peak memory as JSON to FILE (default: stdout)")
+    arg_parser.add_argument('--build', metavar='PROFILE', choices=sorted(PROFILES), default=None,
+                            help="also build the generated C++ with g++")
+    arg_parser.add_argument('--pgo', metavar='TRAINING_INPUT', nargs='?', const=os.devnull, default=None,
+                            help="build with profile-guided optimization: train an instrumented build by running "
+                                 "it with TRAINING_INPUT on stdin (default: none), rebuild on the profile and "
+                                 "report the speedup over the plain build; implies --build")
+    arg_parser.add_argument('--run', metavar='MODE', choices=RUN_MODES, nargs='?', const='auto', default=None,
+                            help="run the program: in the bytecode VM, natively, or 'auto' (the default) to "
+                                 "fall back to a native build only if it runs long")
+    arg_parser.add_argument('--no-cache', action='store_true', help="always run every stage")
+    arg_parser.add_argument('--dump', action='store_true',
+                            help="print the tokens, AST, IR and C++ of every stage, and the cache statistics")
+    add_optimization_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    from BytecodeVM import VMError, run_program
+    from CompileCache import CompileCache
+    from GccBuild import BuildError, GccBuilder, executable_path_for
+    from OutputStage import MANIFEST_NAME, Manifest, write_generated
+    from TypeInference import TypeInferenceError
+
+    configure_tracing(args.log_level)
+    if args.profile:
+        profiler = Profiler()
+    else:
+        profiler = Profiler(trace_memory=False) if tracer.info_enabled else NULL_PROFILER
+    # Keep stdout clean for the JSON report when it goes there
+    show_status = args.profile != '-'
+    show_artifacts = args.dump and show_status
+    source = code
+    if args.input:
+        try:
+            with open(args.input, 'r') as infile:
+                source = infile.read()
+        except OSError as e:
+            print(f"Can't read {args.input}: {e.strerror}", file=sys.stderr)
+            return 1
+
+    result = None
+    status = 0
+    try:
+        cache = None if args.no_cache else CompileCache()
+        options = optimization_options(args)
+        result = compile_code(source, options, cache=cache, profiler=profiler)
+
+        if show_artifacts:
+            # Check if tokens are generated correctly
+            print("Tokens:", result.tokens)
+
+            # Check if the AST is generated correctly
+            print("\nGenerated AST:")
+            for node in result.ast:
+                print(node)
+
+            # Print the intermediate code
+            print("\nIntermediate Code:")
+            print(result.ir.dump())
+
+        cpp_code = result.cpp
+
+        with profiler.phase('output') as phase:
+            manifest = Manifest(args.manifest or os.path.join(os.path.dirname(args.output), MANIFEST_NAME))
+            output = write_generated(args.output, cpp_code, [args.input] if args.input else [], options,
+                                     COMPILER_VERSION, manifest)
+            manifest.save()
+        phase['changed'] = output.changed
+        if show_artifacts:
+            print(cpp_code)
+            print("Cache:", cache.stats if cache else "disabled")
+        if show_status:
+            print(f"Wrote {args.output}" if output.changed else f"{args.output} unchanged")
+
+        if args.pgo:
+            from PgoBuild import PgoBuilder, format_speedup
+            with profiler.phase('pgo') as phase:
+                pgo_builder = PgoBuilder(args.build or 'release', extra_flags=native_flags(options))
+                build = pgo_builder.build(args.output, executable_path_for(args.output), args.pgo)
+                pgo_builder.measure(build, args.pgo)
+            phase['trained'] = build.trained
+            phase['speedup'] = build.speedup
+            if show_status:
+                print(f"Built {build.output_path} with PGO ({'trained' if build.trained else 'profile reused'})")
+                print(format_speedup(build))
+        elif args.build:
+            with profiler.phase('gcc'):
+                build = GccBuilder(args.build, extra_flags=native_flags(options)).build(
+                    args.output, executable_path_for(args.output))
+            if build.error:
+                raise CompilerError(build.error, -1)
+            if show_status:
+                print(f"Built {build.output_path}" + (" (cached)" if build.cached else ""))
+
+        if args.run:
+            with profiler.phase('run') as phase:
+                builder = GccBuilder(args.build or 'release', extra_flags=native_flags(options))
+                phase['mode'] = run_program(result.ir, cpp_code, args.run, builder=builder)
+
+    except (CompilerError, TypeInferenceError) as e:
+        print(f"Compilation error: {e}", file=sys.stderr)
+        status = 1
+    except VMError as e:
+        print(f"Runtime error: {e}", file=sys.stderr)
+        status = 1
+    except BuildError as e:
+        print(f"Build error: {e}", file=sys.stderr)
+        status = 1
+    except Exception as e:
+        print(f"Unexpected error: {e}", file=sys.stderr)
+        status = 1
+
+    if tracer.info_enabled:
+        profiler.trace_summary()
+    if args.profile:
+        profiler.stop()
+        report = profiler.to_json(compiler_version=COMPILER_VERSION, source_bytes=len(source),
+                                  cached=result is not None and result.cached)
+        if args.profile == '-':
+            print(report)
+        else:
+            with open(args.profile, 'w') as outfile:
+                outfile.write(report + "\n")
+    return status
 
 
-except CompilerError as e:
-    print(f"Compilation error: {e}")
-except Exception as e:
-    print(f"Unexpected error: {e}")
-print("Slipe was here hehehe")
+if __name__ == '__main__':
+    sys.exit(main())
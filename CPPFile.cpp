@@ -1,26 +1,118 @@
 #include <iostream>
+#include <charconv>
+#include <csignal>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <string_view>
+
+#ifdef _WIN32
+#include <io.h>
+#else
+#include <unistd.h>
+#endif
+
+namespace cppcompiler {
+
+inline bool is_terminal() {
+#ifdef _WIN32
+    return _isatty(_fileno(stdout));
+#else
+    return isatty(1);
+#endif
+}
+
+// Printed lines collect here and are written out when the buffer fills and at exit
+class Output {
+public:
+    Output() : line_buffered_(is_terminal()) {
+        std::setvbuf(stdout, nullptr, _IONBF, 0);  // Buffered here already
+        std::signal(SIGFPE, flush_and_die);
+        std::signal(SIGILL, flush_and_die);
+    }
+    ~Output() { flush(); }
+
+    // Where the next size bytes can go
+    char* reserve(std::size_t size) {
+        if (size > sizeof(buffer_) - used_) flush();
+        return buffer_ + used_;
+    }
+    void write(const char* data, std::size_t size) {
+        if (size > sizeof(buffer_) - used_) {
+            flush();
+            if (size > sizeof(buffer_)) {
+                emit(data, size);
+                return;
+            }
+        }
+        std::memcpy(buffer_ + used_, data, size);
+        used_ += size;
+    }
+    // Finish a line whose text was written up to end
+    void end_line(char* end) {
+        *end++ = '\n';
+        used_ = end - buffer_;
+        if (line_buffered_) flush();
+    }
+    void flush() {
+        if (used_) emit(buffer_, used_);
+        used_ = 0;
+    }
+
+private:
+    void emit(const char* data, std::size_t size) { std::fwrite(data, 1, size, stdout); }
+    static void flush_and_die(int signal);
+
+    char buffer_[65536];
+    std::size_t used_ = 0;
+    bool line_buffered_;
+};
+
+static Output output;
+
+// Not async-signal-safe, but the program is dying anyway and stdout is unbuffered
+inline void Output::flush_and_die(int signal) {
+    output.flush();
+    std::signal(signal, SIG_DFL);
+    std::raise(signal);
+}
+
+inline void print_int(std::int64_t value) {
+    char* first = output.reserve(21);  // -9223372036854775808 and the newline
+    output.end_line(std::to_chars(first, first + 20, value).ptr);
+}
+
+inline void print_double(double value) {
+    char* first = output.reserve(32);
+    output.end_line(std::to_chars(first, first + 31, value, std::chars_format::general, 6).ptr);
+}
+
+inline void print_string(std::string_view text) {
+    output.write(text.data(), text.size());
+    output.end_line(output.reserve(1));
+}
+
+}  // namespace cppcompiler
+
 int main() {
-    int x = 5;
-    int y = 10;
-L1:
-    // TODO: < x 10 T1
-    if (NOT T1) goto L2;
-    std::cout << x << std::endl;
-    // TODO: + x 1 T2
-    int x = T2;
-    // TODO: > y 5 T3
-    if (T3) goto L3;
-    goto L4;
-L3:
-    std::cout << ""y is greater than 5"" << std::endl;
-    goto L5;
-L4:
-    std::cout << ""y is not greater than 5"" << std::endl;
-    // TODO: + x y T4
-    int z = T4;
-    std::cout << z << std::endl;
-L5:
-    goto L1;
-L2:
+    std::int64_t x = 0;
+    std::int64_t y = 0;
+    std::int64_t T2 = 0;
+    std::int64_t z = 0;
+    x = 5;
+    y = 10;
+    while (x < 10) {
+        cppcompiler::print_int(x);
+        T2 = x + 1;
+        x = T2;
+        if (y > 5) {
+            cppcompiler::print_string("y is greater than 5");
+        } else {
+            cppcompiler::print_string("y is not greater than 5");
+            T2 = x + y;
+            z = T2;
+            cppcompiler::print_int(z);
+        }
+    }
     return 0;
 }
\ No newline at end of file
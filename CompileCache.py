@@ -0,0 +1,192 @@
+# On-disk, content-addressed cache for compiler stage artifacts.
+# Entries are keyed by a hash of the source text, the compiler version and the
+# compiler options, and hold the output of every stage (tokens, AST, IR, C++)
+# so an unchanged input can skip straight to the emitted C++.
+#
+# Loading a pickle can run arbitrary code, so the cache lives in the user's
+# own cache directory and an entry is only loaded if this user wrote it and
+# nobody else can write to it.
+
+import hashlib
+import json
+import os
+import pickle
+import stat
+import tempfile
+
+
+def user_cache_dir():
+    """The per-user cache directory: %LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or ~/.cache elsewhere."""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', "")
+        if not os.path.isabs(base):  # The XDG spec says to ignore a relative path
+            base = os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "cppcompiler")
+
+
+DEFAULT_CACHE_DIR = user_cache_dir()
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_SUFFIX = ".pickle"
+SIZE_FILE = "size"  # Running total of the entries' sizes, so a store needn't list the whole cache
+EVICT_TO = 0.9  # Eviction frees space down to this fraction of max_bytes, so the next store doesn't evict again
+
+
+def cache_key(source, version, options):
+    """Hash everything that can change the compiler's output."""
+    digest = hashlib.sha256()
+    digest.update(version.encode())
+    digest.update(b"\0")
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    digest.update(b"\0")
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """Size-bounded store of pickled artifacts with least-recently-used eviction.
+
+    Entries live in two-level sharded directories like ccache. Every hit
+    refreshes the entry's mtime, so eviction removes the oldest mtimes first.
+    Like ccache, the total size is kept in a file that each store updates, and
+    the entries are only listed when it goes over budget. Concurrent stores
+    can make it drift; eviction recounts it.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Return the artifacts stored under key, or None on a miss."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                if not self.trusted(file):
+                    self.stats['misses'] += 1
+                    return None
+                artifacts = pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            # Truncated entry or one written by an incompatible compiler or Python; drop it
+            self.remove(path)
+            self.stats['misses'] += 1
+            return None
+        except OSError:
+            # Missing, or unreadable (permissions, I/O); a miss either way
+            self.stats['misses'] += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats['hits'] += 1
+        return artifacts
+
+    def put(self, key, artifacts):
+        """Store artifacts under key, then evict old entries if over budget."""
+        try:
+            data = pickle.dumps(artifacts, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError):
+            return False
+        if len(data) > self.max_bytes:
+            return False
+        path = self.path(key)
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            self.write_file(path, data)
+        except OSError:
+            return False
+        self.stats['stores'] += 1
+        if self.add_size(len(data) - replaced) > self.max_bytes:
+            self.evict()
+        return True
+
+    @staticmethod
+    def trusted(file):
+        """Whether an open entry belongs to this user and only they can write it."""
+        if not hasattr(os, 'getuid'):
+            return True  # Windows, where %LOCALAPPDATA% is private to the user
+        info = os.fstat(file.fileno())
+        return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    @classmethod
+    def write_file(cls, path, data):
+        """Write to a temp file and rename, so readers never see a partial file; the file is 0600."""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            cls.remove(temp_path)
+            raise
+
+    def add_size(self, delta):
+        """Add delta to the recorded total size and return it; counts the entries if there is no record."""
+        try:
+            with open(os.path.join(self.directory, SIZE_FILE), 'r') as file:
+                total = int(file.read()) + delta
+        except (OSError, ValueError):
+            total = self.size()
+        self.record_size(total)
+        return total
+
+    def record_size(self, total):
+        try:
+            self.write_file(os.path.join(self.directory, SIZE_FILE), str(total).encode())
+        except OSError:
+            pass
+
+    def entries(self):
+        """List (mtime, size, path) for every entry in the cache."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    info = entry.stat()
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """If the cache is over max_bytes, remove least recently used entries down to EVICT_TO of it."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                if self.remove(path):
+                    total -= size
+                    self.stats['evictions'] += 1
+        self.record_size(total)
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.remove(path)
+        self.remove(os.path.join(self.directory, SIZE_FILE))
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def __repr__(self):
+        return f"CompileCache({self.directory!r}, stats={self.stats})"
@@ -0,0 +1,418 @@
+# Control-flow graph over an IRProgram, plus the analyses the optimizer passes
+# and the C++ backend share: reachability, dominators, postdominators,
+# dominance frontiers, natural loops and liveness.
+# Edges are kept on the blocks themselves (jump/fallthrough), so passes can
+# reorder, split or delete blocks freely and linearize() writes a consistent
+# instruction list back, adding gotos and labels only where they are needed.
+
+from IntermediateCode import BRANCH_OPCODES, NO_OPERAND, VALUE_KINDS, Instruction, Opcode
+
+
+class BasicBlock:
+    __slots__ = ('labels', 'instructions', 'jump', 'fallthrough', 'predecessors', 'phis', 'index')
+
+    def __init__(self):
+        self.labels = []  # Label operands that name this block
+        self.instructions = []  # Never contains LABEL; a branch, if any, is last
+        self.jump = None  # Block a GOTO/IF/IF_NOT terminator goes to
+        self.fallthrough = None  # Block reached when the terminator doesn't jump
+        self.predecessors = []
+        self.phis = []  # Only populated while the optimizer holds the graph in SSA form
+        self.index = -1  # Position in the last computed reverse postorder
+
+    @property
+    def terminator(self):
+        if self.instructions and self.instructions[-1].opcode in BRANCH_OPCODES:
+            return self.instructions[-1]
+        return None
+
+    @property
+    def successors(self):
+        if self.jump is None:
+            return [self.fallthrough] if self.fallthrough is not None else []
+        if self.fallthrough is None or self.fallthrough is self.jump:
+            return [self.jump]
+        return [self.jump, self.fallthrough]
+
+    def replace_successor(self, old, new):
+        if self.jump is old:
+            self.jump = new
+        if self.fallthrough is old:
+            self.fallthrough = new
+
+    def __repr__(self):
+        return f"BasicBlock(labels={self.labels}, {len(self.instructions)} instructions)"
+
+
+class NaturalLoop:
+    __slots__ = ('header', 'body', 'latches', 'parent', 'follow')
+
+    def __init__(self, header):
+        self.header = header
+        self.body = {id(header)}  # ids of the blocks in the loop
+        self.latches = []  # Sources of the back edges to the header
+        self.parent = None  # Innermost enclosing loop
+        self.follow = None  # The exit that stays in the enclosing loop's body, if there is one
+
+    def exits(self):
+        """(block, successor) for every edge that leaves the loop."""
+        return [(block, successor) for block in self.blocks() for successor in block.successors
+                if id(successor) not in self.body]
+
+    def blocks(self):
+        """The loop's blocks, header first; the rest are in no particular order."""
+        blocks = [self.header]
+        seen = {id(self.header)}
+        worklist = list(self.latches)
+        while worklist:
+            block = worklist.pop()
+            if id(block) not in seen:
+                seen.add(id(block))
+                blocks.append(block)
+                worklist.extend(block.predecessors)
+        return blocks
+
+
+class ControlFlowGraph:
+    def __init__(self, program):
+        self.program = program
+        self.blocks = []  # Layout order; linearize() emits blocks in this order
+        self.build()
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def build(self):
+        label_blocks = {}
+        # The entry block stays empty so nothing can jump back to it
+        entry = BasicBlock()
+        self.blocks.append(entry)
+        block = self.start_block(entry)
+        for instruction in self.program.instructions:
+            if instruction.opcode == Opcode.LABEL:
+                if block.instructions:
+                    block = self.start_block(block)
+                block.labels.append(instruction.label)
+                label_blocks[instruction.label] = block
+                continue
+            block.instructions.append(instruction)
+            if instruction.opcode in BRANCH_OPCODES:
+                block = self.start_block(block)
+        # An empty exit block gives the end of the program a block to fall into
+        if block.instructions or block.labels:
+            self.start_block(block)
+
+        for block in self.blocks:
+            terminator = block.terminator
+            if terminator is not None:
+                block.jump = label_blocks[terminator.label]
+                if terminator.opcode == Opcode.GOTO:
+                    block.fallthrough = None
+                elif block.jump is block.fallthrough:
+                    # A conditional jump to the block we fall into anyway
+                    block.instructions.pop()
+                    block.jump = None
+        self.compute_predecessors()
+
+    def start_block(self, block):
+        following = BasicBlock()
+        block.fallthrough = following
+        self.blocks.append(following)
+        return following
+
+    def compute_predecessors(self):
+        for block in self.blocks:
+            block.predecessors = []
+        for block in self.blocks:
+            for successor in block.successors:
+                successor.predecessors.append(block)
+
+    def reverse_postorder(self):
+        """Blocks reachable from the entry in reverse postorder; also sets block.index."""
+        order = []
+        visited = {id(self.entry)}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if id(successor) not in visited:
+                    visited.add(id(successor))
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        for index, block in enumerate(order):
+            block.index = index
+        return order
+
+    def remove_unreachable(self):
+        """Delete blocks the entry can't reach; returns True if any were removed."""
+        reachable = {id(block) for block in self.reverse_postorder()}
+        if len(reachable) == len(self.blocks):
+            return False
+        removed = [block for block in self.blocks if id(block) not in reachable]
+        self.blocks = [block for block in self.blocks if id(block) in reachable]
+        for block in removed:
+            for successor in block.successors:
+                for phi in successor.phis:
+                    phi.args.pop(block, None)
+        self.compute_predecessors()
+        return True
+
+    def dominators(self):
+        """Immediate dominator of every reachable block (Cooper, Harvey and Kennedy)."""
+        order = self.reverse_postorder()
+        idom = {id(self.entry): self.entry}
+
+        def intersect(first, second):
+            while first is not second:
+                while first.index > second.index:
+                    first = idom[id(first)]
+                while second.index > first.index:
+                    second = idom[id(second)]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                new_idom = None
+                for predecessor in block.predecessors:
+                    if id(predecessor) in idom:
+                        new_idom = predecessor if new_idom is None else intersect(predecessor, new_idom)
+                if idom.get(id(block)) is not new_idom:
+                    idom[id(block)] = new_idom
+                    changed = True
+        return idom
+
+    def postdominators(self):
+        """Immediate postdominator of every block that can reach the end of the program.
+
+        Blocks without successors hang off a virtual exit, which is represented
+        by None; blocks stuck in an infinite loop are left out entirely.
+        """
+        exits = [block for block in self.blocks if not block.successors]
+        order = []
+        visited = {id(block) for block in exits}
+        stack = [(block, iter(block.predecessors)) for block in exits]
+        while stack:
+            block, predecessors = stack[-1]
+            for predecessor in predecessors:
+                if id(predecessor) not in visited:
+                    visited.add(id(predecessor))
+                    stack.append((predecessor, iter(predecessor.predecessors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        # The virtual exit (None) comes first in the order
+        position = {id(block): index + 1 for index, block in enumerate(order)}
+        position[id(None)] = 0
+        ipdom = {id(block): None for block in exits}
+
+        def intersect(first, second):
+            while first is not second:
+                while position[id(first)] > position[id(second)]:
+                    first = ipdom[id(first)]
+                while position[id(second)] > position[id(first)]:
+                    second = ipdom[id(second)]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order:
+                if not block.successors:
+                    continue
+                processed = [successor for successor in block.successors if id(successor) in ipdom]
+                if not processed:
+                    continue
+                new_ipdom = processed[0]
+                for successor in processed[1:]:
+                    new_ipdom = intersect(successor, new_ipdom)
+                if id(block) not in ipdom or ipdom[id(block)] is not new_ipdom:
+                    ipdom[id(block)] = new_ipdom
+                    changed = True
+        return ipdom
+
+    @staticmethod
+    def dominates(idom, dominator, block):
+        while block is not dominator:
+            parent = idom[id(block)]
+            if parent is block:
+                return False
+            block = parent
+        return True
+
+    def natural_loops(self, idom):
+        """Natural loops keyed by id(header), plus id(block) -> innermost loop containing it.
+
+        Returns None if a retreating edge goes to a block that doesn't dominate
+        its source, i.e. the graph has a loop with more than one entry.
+        """
+        order = self.reverse_postorder()
+        loops = {}
+        for block in order:
+            for successor in block.successors:
+                if successor.index > block.index:
+                    continue
+                if not self.dominates(idom, successor, block):
+                    return None
+                loop = loops.get(id(successor))
+                if loop is None:
+                    loop = loops[id(successor)] = NaturalLoop(successor)
+                loop.latches.append(block)
+                worklist = [block]
+                while worklist:
+                    member = worklist.pop()
+                    if id(member) not in loop.body:
+                        loop.body.add(id(member))
+                        worklist.extend(member.predecessors)
+
+        # Outer loops first, so each block ends up with the innermost loop containing it
+        innermost = {}
+        for loop in sorted(loops.values(), key=lambda loop: -len(loop.body)):
+            loop.parent = innermost.get(id(loop.header))
+            for member in loop.body:
+                innermost[member] = loop
+        for loop in loops.values():
+            exits = [successor for _, successor in loop.exits()
+                     if self.loop_region(innermost, successor) is loop.parent]
+            if exits:
+                loop.follow = min(exits, key=lambda block: block.index)
+        return loops, innermost
+
+    @staticmethod
+    def loop_region(innermost, block):
+        """The loop whose body a block sits in; a header belongs to the loop around its own."""
+        loop = innermost.get(id(block))
+        if loop is not None and loop.header is block:
+            return loop.parent
+        return loop
+
+    def dominator_tree(self, idom):
+        """Children of each block in the dominator tree, keyed by id(block)."""
+        children = {id(block): [] for block in self.blocks}
+        for block in self.reverse_postorder()[1:]:
+            children[id(idom[id(block)])].append(block)
+        return children
+
+    def dominance_frontiers(self, idom):
+        frontiers = {id(block): set() for block in self.blocks}
+        members = {}
+        for block in self.blocks:
+            if len(block.predecessors) < 2:
+                continue
+            for predecessor in block.predecessors:
+                runner = predecessor
+                while id(runner) in idom and runner is not idom[id(block)]:
+                    frontiers[id(runner)].add(id(block))
+                    members[id(block)] = block
+                    if runner is self.entry:
+                        break
+                    runner = idom[id(runner)]
+        return {key: [members[member] for member in frontier] for key, frontier in frontiers.items()}
+
+    def split_edge(self, source, target):
+        """Insert an empty block on the edge source -> target and return it."""
+        middle = BasicBlock()
+        middle.fallthrough = target
+        source.replace_successor(target, middle)
+        # Placing it straight after the source keeps fallthrough edges free of extra gotos
+        position = self.blocks.index(source) + 1 if source.fallthrough is middle else self.blocks.index(target)
+        self.blocks.insert(position, middle)
+        for phi in target.phis:
+            if source in phi.args:
+                phi.args[middle] = phi.args.pop(source)
+        return middle
+
+    def split_critical_edges(self):
+        for block in list(self.blocks):
+            if len(block.predecessors) > 1:
+                for predecessor in list(block.predecessors):
+                    if len(predecessor.successors) > 1:
+                        self.split_edge(predecessor, block)
+        self.compute_predecessors()
+
+    def value_operand(self, operand):
+        return operand != NO_OPERAND and self.program.kinds[operand] in VALUE_KINDS
+
+    def uses(self, instruction):
+        """Variable and temp operands the instruction reads."""
+        return [operand for operand in (instruction.a, instruction.b) if self.value_operand(operand)]
+
+    def liveness(self):
+        """Operands live on entry to and exit from every block, keyed by id(block)."""
+        gen, kill = {}, {}
+        for block in self.blocks:
+            used, defined = set(), set()
+            for instruction in block.instructions:
+                for operand in self.uses(instruction):
+                    if operand not in defined:
+                        used.add(operand)
+                if instruction.dest != NO_OPERAND:
+                    defined.add(instruction.dest)
+            gen[id(block)], kill[id(block)] = used, defined
+
+        live_in = {id(block): set() for block in self.blocks}
+        live_out = {id(block): set() for block in self.blocks}
+        order = list(reversed(self.reverse_postorder()))
+        changed = True
+        while changed:
+            changed = False
+            for block in order:
+                out = set()
+                for successor in block.successors:
+                    out |= live_in[id(successor)]
+                new_in = gen[id(block)] | (out - kill[id(block)])
+                if len(new_in) != len(live_in[id(block)]) or len(out) != len(live_out[id(block)]):
+                    live_in[id(block)], live_out[id(block)] = new_in, out
+                    changed = True
+        return live_in, live_out
+
+    def label_for(self, block):
+        if not block.labels:
+            block.labels.append(self.program.new_label())
+        return block.labels[0]
+
+    def linearize(self):
+        """Write the blocks back to program.instructions in layout order.
+
+        Only labels something jumps to are emitted, a jump to the block that
+        follows is dropped, and a conditional jump over an unconditional one is
+        inverted into a single branch.
+        """
+        blocks = self.blocks
+        exits = []  # Per block: list of (opcode, condition, target block)
+        for position, block in enumerate(blocks):
+            following = blocks[position + 1] if position + 1 < len(blocks) else None
+            terminator = block.terminator
+            branches = []
+            if terminator is not None and terminator.opcode != Opcode.GOTO:
+                if block.jump is following and block.fallthrough is not following:
+                    inverted = Opcode.IF_NOT if terminator.opcode == Opcode.IF else Opcode.IF
+                    branches.append((inverted, terminator.a, block.fallthrough))
+                else:
+                    branches.append((terminator.opcode, terminator.a, block.jump))
+                    if block.fallthrough is not following:
+                        branches.append((Opcode.GOTO, NO_OPERAND, block.fallthrough))
+            else:
+                target = block.jump if terminator is not None else block.fallthrough
+                if target is not None and target is not following:
+                    branches.append((Opcode.GOTO, NO_OPERAND, target))
+            exits.append(branches)
+
+        targets = {id(target) for branches in exits for _, _, target in branches}
+        instructions = []
+        for block, branches in zip(blocks, exits):
+            if id(block) in targets:
+                instructions.append(Instruction(Opcode.LABEL, label=self.label_for(block)))
+            body = block.instructions[:-1] if block.terminator is not None else block.instructions
+            instructions.extend(body)
+            for opcode, condition, target in branches:
+                instructions.append(Instruction(opcode, a=condition, label=self.label_for(target)))
+        self.program.instructions[:] = instructions
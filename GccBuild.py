@@ -0,0 +1,253 @@
+# Build stage after CppCodeGenerator: turns generated C++ into executables,
+# object files or shared libraries with g++. Outputs are cached ccache-style, keyed by a hash of
+# the C++ text, the flags and the compiler identity, and translation units are
+# built in parallel. The <iostream> prelude every generated file starts with is
+# compiled once per flag set into a precompiled header. best_run times what was
+# built, for the benchmark suite and the PGO training run.
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from CompileCache import CompileCache, DEFAULT_CACHE_DIR
+from OutputStage import write_if_changed
+
+DEFAULT_BUILD_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "gcc")
+DEFAULT_BUILD_CACHE_BYTES = 512 * 1024 * 1024
+RUN_TIMEOUT = 120  # Seconds, per run of a built program
+
+BASE_FLAGS = ['-std=c++17', '-pipe']
+PROFILES = {
+    'debug': ['-O0', '-g'],
+    'release': ['-O2'],
+    'fast': ['-O3', '-march=native'],
+    'size': ['-Os'],
+}
+PRELUDE = "#include <iostream>\n"
+PRELUDE_NAME = "cppcompiler_prelude.h"
+
+
+class BuildError(Exception):
+    def __init__(self, message, output=""):
+        super().__init__(message)
+        self.message = message
+        self.output = output
+
+    def __str__(self):
+        return f"{self.message}\n{self.output}".rstrip()
+
+
+class RunError(BuildError):
+    """A built program timed out or exited with a non-zero status."""
+
+
+class BuildResult:
+    def __init__(self, source_path, output_path=None, error=None, cached=False, seconds=0.0):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.error = error
+        self.cached = cached
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"BuildResult({self.source_path!r}, ok={self.ok}, cached={self.cached})"
+
+
+SHARED_SUFFIX = ".dll" if os.name == 'nt' else ".so"
+# What each build mode adds to the command line, and the suffix of what it builds
+MODE_ARGUMENTS = {'executable': [], 'object': ['-c'], 'shared': ['-shared']}
+MODE_SUFFIXES = {'object': ".o", 'shared': SHARED_SUFFIX}
+
+
+def executable_path_for(path):
+    return os.path.splitext(path)[0] + (".exe" if os.name == 'nt' else "")
+
+
+def best_run(command, repeat, input_path=None, timeout=RUN_TIMEOUT):
+    """(fastest wall time, stdout) over repeat runs of command, reading input_path (default: nothing) on stdin."""
+    best, output = None, None
+    for _ in range(repeat):
+        with open(input_path or os.devnull, 'rb') as stdin:
+            start = time.perf_counter()
+            try:
+                completed = subprocess.run(command, stdin=stdin, capture_output=True, text=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                raise RunError(f"{' '.join(command)} ran for over {timeout}s") from None
+            seconds = time.perf_counter() - start
+        if completed.returncode != 0:
+            raise RunError(f"{' '.join(command)} exited with {completed.returncode}", completed.stderr)
+        best = seconds if best is None else min(best, seconds)
+        output = completed.stdout
+    return best, output
+
+
+_compiler_identities = {}
+
+
+def compiler_identity(compiler):
+    """Resolved path plus version of the compiler, so upgrading it invalidates the cache."""
+    identity = _compiler_identities.get(compiler)
+    if identity is None:
+        path = shutil.which(compiler)
+        if path is None:
+            raise BuildError(f"C++ compiler '{compiler}' not found on PATH")
+        version = subprocess.run([path, '--version'], capture_output=True, text=True).stdout
+        identity = _compiler_identities[compiler] = f"{path}\n{version}"
+    return identity
+
+
+class GccBuilder:
+    def __init__(self, profile='release', compiler='g++', cache_dir=DEFAULT_BUILD_CACHE_DIR,
+                 extra_flags=(), use_pch=True, max_bytes=DEFAULT_BUILD_CACHE_BYTES):
+        if profile not in PROFILES:
+            raise BuildError(f"Unknown build profile '{profile}', expected one of {', '.join(PROFILES)}")
+        self.profile = profile
+        self.compiler = compiler
+        self.flags = BASE_FLAGS + PROFILES[profile] + list(extra_flags)
+        self.cache = CompileCache(cache_dir, max_bytes) if cache_dir else None
+        self.cache_dir = cache_dir
+        self.use_pch = use_pch and cache_dir is not None
+        self.pch_header = None
+
+    def key(self, cpp_code, mode):
+        digest = hashlib.sha256()
+        for part in (compiler_identity(self.compiler), mode, ' '.join(self.flags), cpp_code):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def is_cached(self, cpp_code, mode='executable'):
+        """Whether building cpp_code would be a cache hit, i.e. practically free."""
+        return self.cache is not None and os.path.exists(self.cache.path(self.key(cpp_code, mode)))
+
+    def run_compiler(self, arguments):
+        command = [self.compiler] + self.flags + arguments
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise BuildError(f"{' '.join(command)} failed with exit code {completed.returncode}",
+                             completed.stderr)
+
+    def ensure_pch(self):
+        """Precompile the prelude for the current flags; returns the header to -include."""
+        if not self.use_pch:
+            return None
+        if self.pch_header is None:
+            flags_key = hashlib.sha256((compiler_identity(self.compiler) + ' '.join(self.flags)).encode())
+            directory = os.path.join(self.cache_dir, "pch", flags_key.hexdigest()[:16])
+            header = os.path.join(directory, PRELUDE_NAME)
+            if not os.path.exists(header + ".gch"):
+                os.makedirs(directory, exist_ok=True)
+                with open(header, 'w') as file:
+                    file.write(PRELUDE)
+                temp_gch = header + f".{os.getpid()}.tmp"
+                try:
+                    self.run_compiler(['-x', 'c++-header', header, '-o', temp_gch])
+                    os.replace(temp_gch, header + ".gch")
+                except BuildError:
+                    # Build without the PCH rather than failing the whole build
+                    CompileCache.remove(temp_gch)
+                    self.use_pch = False
+                    return None
+            self.pch_header = header
+        return self.pch_header
+
+    def build(self, source_path, output_path=None, mode='executable'):
+        """Compile one translation unit; mode is 'executable', 'object' or 'shared'.
+
+        A shared library needs position-independent code: build it with '-fPIC'
+        in extra_flags, so the precompiled header is built that way too.
+        """
+        start = time.perf_counter()
+        if output_path is None:
+            output_path = executable_path_for(source_path) if mode == 'executable' \
+                else os.path.splitext(source_path)[0] + MODE_SUFFIXES[mode]
+        try:
+            with open(source_path, 'r') as file:
+                cpp_code = file.read()
+            key = self.key(cpp_code, mode)
+            data = self.cache.get(key) if self.cache else None
+            cached = data is not None
+            if not cached:
+                data = self.compile(source_path, mode)
+                if self.cache:
+                    self.cache.put(key, data)
+            # Rewritten only if different, so a cached rebuild leaves the output's mtime alone
+            write_if_changed(output_path, data, executable=mode != 'object')
+        except (BuildError, OSError) as e:
+            return BuildResult(source_path, error=str(e), seconds=time.perf_counter() - start)
+        return BuildResult(source_path, output_path, cached=cached, seconds=time.perf_counter() - start)
+
+    def compile(self, source_path, mode):
+        arguments = []
+        header = self.ensure_pch()
+        if header:
+            arguments += ['-include', header, '-Winvalid-pch']
+        arguments += MODE_ARGUMENTS[mode]
+        fd, temp_output = tempfile.mkstemp(suffix=MODE_SUFFIXES.get(mode, ".out"))
+        os.close(fd)
+        try:
+            self.run_compiler(arguments + [source_path, '-o', temp_output])
+            with open(temp_output, 'rb') as file:
+                return file.read()
+        finally:
+            CompileCache.remove(temp_output)
+
+    def build_many(self, sources, jobs=None, mode='executable'):
+        """Build (source_path, output_path) pairs in parallel; results keep input order."""
+        jobs = jobs or os.cpu_count() or 1
+        if sources:
+            try:
+                self.ensure_pch()  # Once, before the workers race for it
+            except BuildError as e:
+                return [BuildResult(source, error=str(e)) for source, _ in sources]
+        # g++ runs in its own process, so threads are enough to keep every core busy
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(lambda pair: self.build(pair[0], pair[1], mode), sources))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build generated C++ files with g++.")
+    parser.add_argument('sources', nargs='+', help="generated .cpp files")
+    parser.add_argument('-p', '--profile', default='release', choices=sorted(PROFILES))
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="parallel g++ jobs (default: CPU count)")
+    parser.add_argument('-c', '--object', action='store_true', help="build object files instead of executables")
+    parser.add_argument('--compiler', default='g++')
+    parser.add_argument('--cache-dir', default=DEFAULT_BUILD_CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--no-pch', action='store_true', help="don't precompile the <iostream> prelude")
+    args = parser.parse_args()
+
+    builder = GccBuilder(args.profile, args.compiler, None if args.no_cache else args.cache_dir,
+                         use_pch=not args.no_pch)
+    mode = 'object' if args.object else 'executable'
+    start = time.perf_counter()
+    results = builder.build_many([(source, None) for source in args.sources], args.jobs, mode)
+    failures = print_build_results(results)
+    print(f"{len(results) - failures} built, {failures} failed in {time.perf_counter() - start:.2f}s")
+    return 1 if failures else 0
+
+
+def print_build_results(results):
+    failures = 0
+    for result in results:
+        if result.ok:
+            note = " (cached)" if result.cached else ""
+            print(f"built   {result.source_path} -> {result.output_path}{note}")
+        else:
+            failures += 1
+            print(f"FAILED  {result.source_path}: {result.error}")
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# Typed intermediate representation shared by IntermediateCodeGenerator and
+# CppCodeGenerator. Instructions are small __slots__ records whose operands are
+# integer ids into the program's operand table, so no text is formatted or
+# re-parsed between the two stages. dump() gives the old text form for debugging.
+
+import math
+from enum import IntEnum
+
+
+class Opcode(IntEnum):
+    LABEL = 0  # label:
+    GOTO = 1  # goto label
+    IF = 2  # if a goto label
+    IF_NOT = 3  # if not a goto label
+    STORE = 4  # dest = a
+    PRINT = 5  # print a
+    ADD = 6  # dest = a + b
+    SUB = 7
+    MUL = 8
+    DIV = 9
+    MOD = 10
+    EQ = 11
+    NE = 12
+    LT = 13
+    LE = 14
+    GT = 15
+    GE = 16
+    AND = 17
+    OR = 18
+
+
+class OperandKind(IntEnum):
+    VARIABLE = 0
+    TEMP = 1
+    CONSTANT = 2
+    LABEL = 3
+
+
+class ValueType(IntEnum):
+    UNKNOWN = 0  # Not inferred yet
+    INT = 1
+    FLOAT = 2
+    STRING = 3
+
+
+def constant_type(value):
+    if isinstance(value, str):
+        return ValueType.STRING
+    return ValueType.FLOAT if isinstance(value, float) else ValueType.INT
+
+
+def constant_key(value):
+    """What constants are interned by: 1 and 1.0 stay apart, and so do 0.0 and -0.0."""
+    if isinstance(value, float):
+        return float, value, math.copysign(1.0, value)
+    return type(value), value
+
+
+# Source operator -> opcode, and back again for dumps and C++ emission
+BINARY_OPCODES = {
+    '+': Opcode.ADD,
+    '-': Opcode.SUB,
+    '*': Opcode.MUL,
+    '/': Opcode.DIV,
+    '%': Opcode.MOD,
+    '==': Opcode.EQ,
+    '!=': Opcode.NE,
+    '<': Opcode.LT,
+    '<=': Opcode.LE,
+    '>': Opcode.GT,
+    '>=': Opcode.GE,
+    'and': Opcode.AND,
+    'or': Opcode.OR,
+}
+OPERATOR_SYMBOLS = {opcode: symbol for symbol, opcode in BINARY_OPCODES.items()}
+
+BRANCH_OPCODES = frozenset((Opcode.GOTO, Opcode.IF, Opcode.IF_NOT))
+VALUE_KINDS = frozenset((OperandKind.VARIABLE, OperandKind.TEMP))
+
+# Marks an unused operand slot
+NO_OPERAND = -1
+
+
+class Instruction:
+    __slots__ = ('opcode', 'dest', 'a', 'b', 'label')
+
+    def __init__(self, opcode, dest=NO_OPERAND, a=NO_OPERAND, b=NO_OPERAND, label=NO_OPERAND):
+        self.opcode = opcode
+        self.dest = dest
+        self.a = a
+        self.b = b
+        self.label = label
+
+    def __repr__(self):
+        return f"Instruction({self.opcode.name}, dest={self.dest}, a={self.a}, b={self.b}, label={self.label})"
+
+
+class IRProgram:
+    """An instruction list plus the operand table its ids refer to."""
+
+    def __init__(self):
+        self.instructions = []
+        self.kinds = []  # OperandKind per operand id
+        self.values = []  # Name (variables, temps, labels) or Python value (constants) per operand id
+        self.types = []  # ValueType per operand id, filled in for variables and temps by TypeInference
+        self.variables = {}  # Variable name -> operand id
+        self.constants = {}  # constant_key(value) -> operand id
+        self.temp_count = 0
+        self.label_count = 0
+
+    def add_operand(self, kind, value, value_type=ValueType.UNKNOWN):
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.types.append(value_type)
+        return len(self.kinds) - 1
+
+    def variable(self, name):
+        operand = self.variables.get(name)
+        if operand is None:
+            operand = self.variables[name] = self.add_operand(OperandKind.VARIABLE, name)
+        return operand
+
+    def constant(self, value):
+        key = constant_key(value)
+        operand = self.constants.get(key)
+        if operand is None:
+            operand = self.constants[key] = self.add_operand(OperandKind.CONSTANT, value, constant_type(value))
+        return operand
+
+    def new_temp(self, value_type=ValueType.UNKNOWN):
+        self.temp_count += 1
+        return self.add_operand(OperandKind.TEMP, f"T{self.temp_count}", value_type)
+
+    def new_label(self):
+        self.label_count += 1
+        return self.add_operand(OperandKind.LABEL, f"L{self.label_count}")
+
+    def fresh_variable(self, base, value_type=ValueType.UNKNOWN):
+        """A new variable named after base that doesn't clash with any existing one."""
+        suffix = 2
+        while f"{base}_{suffix}" in self.variables:
+            suffix += 1
+        operand = self.variable(f"{base}_{suffix}")
+        self.types[operand] = value_type
+        return operand
+
+    def emit(self, opcode, dest=NO_OPERAND, a=NO_OPERAND, b=NO_OPERAND, label=NO_OPERAND):
+        self.instructions.append(Instruction(opcode, dest, a, b, label))
+
+    def compact(self):
+        """Drop operands no instruction refers to any more and renumber the rest."""
+        used = set()
+        for instruction in self.instructions:
+            used.update((instruction.dest, instruction.a, instruction.b, instruction.label))
+        used.discard(NO_OPERAND)
+        renumber = {NO_OPERAND: NO_OPERAND}
+        kinds, values, types = [], [], []
+        self.variables, self.constants = {}, {}
+        for operand in sorted(used):
+            kind, value = self.kinds[operand], self.values[operand]
+            renumber[operand] = len(kinds)
+            if kind == OperandKind.VARIABLE:
+                self.variables[value] = len(kinds)
+            elif kind == OperandKind.CONSTANT:
+                self.constants[constant_key(value)] = len(kinds)
+            kinds.append(kind)
+            values.append(value)
+            types.append(self.types[operand])
+        self.kinds, self.values, self.types = kinds, values, types
+        for instruction in self.instructions:
+            instruction.dest = renumber[instruction.dest]
+            instruction.a = renumber[instruction.a]
+            instruction.b = renumber[instruction.b]
+            instruction.label = renumber[instruction.label]
+
+    def operand_text(self, operand):
+        """Text form of an operand as used in the debug dump."""
+        value = self.values[operand]
+        if self.kinds[operand] == OperandKind.CONSTANT and isinstance(value, str):
+            return f'"{value}"'
+        return str(value)
+
+    def instruction_text(self, instruction):
+        name = self.operand_text
+        opcode = instruction.opcode
+        if opcode == Opcode.LABEL:
+            return f"{name(instruction.label)}:"
+        elif opcode == Opcode.GOTO:
+            return f"GOTO {name(instruction.label)}"
+        elif opcode == Opcode.IF:
+            return f"IF {name(instruction.a)} GOTO {name(instruction.label)}"
+        elif opcode == Opcode.IF_NOT:
+            return f"IF NOT {name(instruction.a)} GOTO {name(instruction.label)}"
+        elif opcode == Opcode.STORE:
+            return f"STORE {name(instruction.a)} {name(instruction.dest)}"
+        elif opcode == Opcode.PRINT:
+            return f"PRINT {name(instruction.a)}"
+        return f"{OPERATOR_SYMBOLS[opcode]} {name(instruction.a)} {name(instruction.b)} {name(instruction.dest)}"
+
+    def dump(self):
+        """Render the program in the line-based text form, for debugging only."""
+        return "\n".join(self.instruction_text(instruction) for instruction in self.instructions)
+
+    def __repr__(self):
+        return f"IRProgram({len(self.instructions)} instructions, {len(self.kinds)} operands)"
@@ -0,0 +1,378 @@
+# Compile-and-load: builds a snippet into a shared library and calls it in
+# this process through ctypes, so a hot snippet runs natively over and over
+# without recompiling it or starting an executable per run.
+#
+# The snippet's main() becomes a C entry point. Variables it reads without
+# ever assigning them are its parameters, numbers the caller passes on every
+# call; what it prints is collected in a buffer and returned as a string. Two
+# things that merely end a standalone program would take the host process
+# down with them, so the library is built differently:
+#  - integer division and remainder are checked, and a division by zero (or
+#    INT64_MIN / -1) abandons the call with a NativeError instead of SIGFPE;
+#  - nothing is parallelized with OpenMP, since that error can't leave a
+#    parallel region.
+#
+# Built libraries are kept in the g++ build cache like any other build, so
+# loading a snippet that was built before (by any process) costs generating
+# its C++ and a dlopen, and no compile at all. The library is copied out of
+# the cache into a scratch directory to be loaded and removed once it is.
+
+import argparse
+import ctypes
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from contextlib import redirect_stdout
+
+from CPPCompiler import (COMPILER_VERSION, CPP_TYPES, CompilerError, CppCodeGenerator, Parser, SemanticAnalyzer,
+                         add_optimization_arguments, generate_ir, optimization_options, prologue_lines, tokenize)
+from GccBuild import SHARED_SUFFIX, BuildError, GccBuilder, PROFILES
+from IntermediateCode import Opcode, OperandKind, ValueType
+from PrintRuntime import HEADERS as PRINT_HEADERS
+from TypeInference import TypeInferenceError
+
+PARAMETER_TYPES = {int: ValueType.INT, float: ValueType.FLOAT}
+# Options that don't apply to a library: its output is always captured, and it never uses OpenMP
+IGNORED_OPTIONS = ('parallel_loops', 'print_buffering')
+CHECKED_FUNCTIONS = {Opcode.DIV: 'divide', Opcode.MOD: 'remainder'}
+BENCH_REPEAT = 5
+
+# cppcompiler_run's status codes
+STATUS_MESSAGES = {
+    1: "Floating point exception (integer division overflow or by zero)",
+    2: "Unexpected C++ exception",
+}
+
+HELPERS = """\
+namespace cppcompiler {
+
+// Unwinds a call that divided by zero, which would otherwise kill the host process
+struct ArithmeticError {};
+
+inline std::int64_t divide(std::int64_t a, std::int64_t b) {
+    if (b == 0 || (b == -1 && a == std::numeric_limits<std::int64_t>::min())) throw ArithmeticError();
+    return a / b;
+}
+
+inline std::int64_t remainder(std::int64_t a, std::int64_t b) {
+    if (b == 0 || (b == -1 && a == std::numeric_limits<std::int64_t>::min())) throw ArithmeticError();
+    return a % b;
+}
+
+}  // namespace cppcompiler
+"""
+
+ENTRY_POINTS = """\
+// Runs the snippet once; the parameters are in ints and floats in declaration order. What it
+// printed is left in *text and *size until the next run.
+extern "C" int cppcompiler_run(const std::int64_t* ints, const double* floats, const char** text,
+                               std::size_t* size) {
+    cppcompiler::output.captured.clear();
+    int status = 0;
+    try {
+        run(ints, floats);
+    } catch (const cppcompiler::ArithmeticError&) {
+        status = 1;
+    } catch (...) {
+        status = 2;
+    }
+    cppcompiler::output.flush();
+    *text = cppcompiler::output.captured.data();
+    *size = cppcompiler::output.captured.size();
+    return status;
+}
+"""
+
+
+class NativeError(Exception):
+    """A call that failed at run time; output is what the snippet printed before it did."""
+
+    def __init__(self, message, output=""):
+        super().__init__(message)
+        self.message = message
+        self.output = output
+
+
+def parameter_types(parameters):
+    """[(name, ValueType)] for parameters, a mapping (or pairs) from name to int or float."""
+    pairs = parameters.items() if hasattr(parameters, 'items') else parameters
+    types = []
+    for name, python_type in pairs:
+        if python_type not in PARAMETER_TYPES:
+            raise ValueError(f"Parameter '{name}' must be an int or a float, not {python_type!r}")
+        types.append((name, PARAMETER_TYPES[python_type]))
+    return types
+
+
+def library_options(options):
+    return {key: value for key, value in (options or {}).items() if key not in IGNORED_OPTIONS}
+
+
+class LibraryCodeGenerator(CppCodeGenerator):
+    """C++ for a snippet as a shared library: main() becomes run(), called through the C entry points."""
+
+    def __init__(self, program, parameters, structured=True):
+        super().__init__(program, structured, print_buffering='capture')
+        self.parameters = parameters  # [(name, ValueType)], in the order the caller passes them
+        self.prints = True  # The entry points read the output buffer whether or not anything prints
+        self.headers.update(PRINT_HEADERS)
+        self.headers.update(("<limits>", "<string>"))
+
+    def generate(self):
+        statements, structurer = self.structure()
+        program = self.program
+        arrays = {ValueType.INT: self.fresh_name("ints"), ValueType.FLOAT: self.fresh_name("floats")}
+        self.cpp_code.append(f"static int run(const std::int64_t* {arrays[ValueType.INT]}, "
+                             f"const double* {arrays[ValueType.FLOAT]}) {{")
+        declared = set()
+        slots = {ValueType.INT: 0, ValueType.FLOAT: 0}
+        for name, value_type in self.parameters:
+            operand = program.variables.get(name)
+            if operand is not None and program.kinds[operand] == OperandKind.VARIABLE:
+                # Declared with its inferred type, which may be wider than the parameter's
+                cpp_type, _ = CPP_TYPES[program.types[operand]]
+                slot = f"{arrays[value_type]}[{slots[value_type]}]"
+                self.cpp_code.append(f"    {cpp_type} {self.names[operand]} = {slot};")
+                declared.add(operand)
+            slots[value_type] += 1
+        self.declare((OperandKind.VARIABLE, OperandKind.TEMP), structurer, declared)
+        self.emit_body(statements, structurer)
+        self.cpp_code.append("    return 0;")
+        self.cpp_code.append("}")
+        lines = prologue_lines(self.headers, True, 'capture') + HELPERS.split('\n') + self.cpp_code
+        return '\n'.join(lines + [""] + ENTRY_POINTS.rstrip('\n').split('\n'))
+
+    def expression_text(self, instruction):
+        function = CHECKED_FUNCTIONS.get(instruction.opcode)
+        types = self.program.types
+        if function is not None and types[instruction.a] == ValueType.INT and types[instruction.b] == ValueType.INT:
+            return f"cppcompiler::{function}({self.names[instruction.a]}, {self.names[instruction.b]})"
+        return super().expression_text(instruction)
+
+
+def generate_library(source, parameters=(), options=None):
+    """The C++ for source as a shared library; parameters are [(name, ValueType)]."""
+    options = library_options(options)
+    ast = Parser(tokenize(source)).parse()
+    analyzer = SemanticAnalyzer()
+    analyzer.variables = {name: 'number' for name, _ in parameters}
+    analyzer.analyze(ast)
+    program = generate_ir(ast, options, variable_types=dict(parameters))
+    return LibraryCodeGenerator(program, parameters, options.get('structured', True)).generate()
+
+
+class NativeFunction:
+    """A snippet loaded from its shared library; calling it runs the snippet and returns what it printed.
+
+    Arguments are bound like a Python function's, positionally or by name.
+    Calls reuse the same argument arrays and output buffer, so a NativeFunction
+    must not be called from two threads at once.
+    """
+
+    def __init__(self, path, parameters, cached=False):
+        self.path = path
+        self.parameters = parameters
+        self.cached = cached  # Whether the library was already built
+        library = ctypes.CDLL(os.path.abspath(path))
+        self.run = library.cppcompiler_run
+        self.run.argtypes = (ctypes.POINTER(ctypes.c_int64), ctypes.POINTER(ctypes.c_double),
+                             ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_size_t))
+        self.run.restype = ctypes.c_int
+        self.names = [name for name, _ in parameters]
+        counts = {ValueType.INT: 0, ValueType.FLOAT: 0}
+        for _, value_type in parameters:
+            counts[value_type] += 1
+        self.ints = (ctypes.c_int64 * max(counts[ValueType.INT], 1))()
+        self.floats = (ctypes.c_double * max(counts[ValueType.FLOAT], 1))()
+        # (array, index) for each parameter in order, and the arguments to cppcompiler_run, built once:
+        # the call overhead is mostly Python
+        self.slots = []
+        counts = {ValueType.INT: 0, ValueType.FLOAT: 0}
+        for _, value_type in parameters:
+            self.slots.append((self.ints if value_type == ValueType.INT else self.floats, counts[value_type]))
+            counts[value_type] += 1
+        self.text = ctypes.c_void_p()
+        self.size = ctypes.c_size_t()
+        self.arguments = (self.ints, self.floats, ctypes.byref(self.text), ctypes.byref(self.size))
+
+    def bind(self, args, kwargs):
+        """The arguments in parameter order, checked like a Python function's."""
+        names = self.names
+        if len(args) > len(names):
+            raise TypeError(f"Takes {len(names)} argument(s) but {len(args)} were given")
+        values = dict(zip(names, args))
+        for name, value in kwargs.items():
+            if name not in names:
+                raise TypeError(f"Unexpected argument '{name}'")
+            if name in values:
+                raise TypeError(f"Got multiple values for argument '{name}'")
+            values[name] = value
+        missing = [name for name in names if name not in values]
+        if missing:
+            raise TypeError(f"Missing argument(s): {', '.join(missing)}")
+        return [values[name] for name in names]
+
+    def __call__(self, *args, **kwargs):
+        if kwargs or len(args) != len(self.names):
+            args = self.bind(args, kwargs)
+        for (array, index), value in zip(self.slots, args):
+            array[index] = value
+        status = self.run(*self.arguments)
+        size = self.size.value
+        text = ctypes.string_at(self.text.value, size).decode('utf-8', errors='replace') if size else ""
+        if status:
+            raise NativeError(STATUS_MESSAGES.get(status, f"Exit status {status}"), text)
+        return text
+
+    def __repr__(self):
+        return f"NativeFunction({self.path!r}, {', '.join(self.names)})"
+
+
+_loaded = {}  # Snippet key -> NativeFunction, so loading a snippet again is a dictionary lookup
+
+
+def load_function(source, parameters=(), options=None, builder=None):
+    """Build source as a shared library, or reuse the cached one, and load it as a NativeFunction.
+
+    parameters maps the names of variables the snippet reads without assigning
+    to int or float, in the order a call passes them positionally. options are
+    compile_code's, except that the output is always captured and OpenMP is
+    never used. Raises BuildError if g++ fails, and the compiler's own errors
+    if the snippet doesn't compile.
+    """
+    parameters = parameter_types(parameters)
+    options = library_options(options)
+    builder = builder or GccBuilder('release', extra_flags=['-fPIC'])
+    # The builder's key covers the compiler and flags; the snippet stands in for the C++ it would generate
+    description = json.dumps([COMPILER_VERSION, [(name, int(value_type)) for name, value_type in parameters],
+                              options], sort_keys=True)
+    key = builder.key(description + "\0" + source, 'shared')
+    function = _loaded.get(key)
+    if function is not None:
+        return function
+    cpp_code = generate_library(source, parameters, options)
+    workdir = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(workdir, "snippet.cpp")
+        with open(source_path, 'w') as outfile:
+            outfile.write(cpp_code)
+        library_path = os.path.join(workdir, "snippet" + SHARED_SUFFIX)
+        result = builder.build(source_path, library_path, mode='shared')
+        if not result.ok:
+            raise BuildError("Building the snippet failed", result.error)
+        function = _loaded[key] = NativeFunction(library_path, parameters, result.cached)
+    finally:
+        # The loaded library stays mapped; Windows won't delete it, so it's left to the temp directory cleanup
+        shutil.rmtree(workdir, ignore_errors=True)
+    return function
+
+
+def python_runner(source, names):
+    """A function running source under CPython with names bound to its arguments, returning what it printed."""
+    code = compile(source, "<snippet>", 'exec')
+
+    def run(*args):
+        with redirect_stdout(io.StringIO()) as output:
+            exec(code, dict(zip(names, args)))
+        return output.getvalue()
+    return run
+
+
+def seconds_per_call(function, args, calls, repeat=BENCH_REPEAT):
+    """The fastest of repeat rounds of calls calls, per call."""
+    return min(timeit.repeat(lambda: function(*args), number=calls, repeat=repeat)) / calls
+
+
+def benchmark_calls(source, parameters, args, calls, options=None, builder=None):
+    """Seconds per call of the snippet in the library, of an empty snippet (the calling overhead alone),
+    and of CPython running the snippet, or None where the source isn't also valid Python."""
+    function = load_function(source, parameters, options, builder)
+    empty = load_function("", parameters, options, builder)
+    results = {
+        'native': seconds_per_call(function, args, calls),
+        'overhead': seconds_per_call(empty, args, calls),
+        'python': None,
+    }
+    try:
+        python = python_runner(source, function.names)
+    except SyntaxError:
+        return results
+    results['python'] = seconds_per_call(python, args, max(1, calls // 10))
+    return results
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1e6:10.2f} us/call"
+
+
+def parse_argument(text):
+    """NAME=VALUE -> (name, int or float value)."""
+    name, separator, value = text.partition('=')
+    if not separator or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got '{text}'")
+    try:
+        return name, int(value)
+    except ValueError:
+        pass
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a number") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a snippet as a shared library and call it in-process.")
+    parser.add_argument('source', help="source file of the snippet")
+    parser.add_argument('-a', '--arg', dest='arguments', metavar='NAME=VALUE', action='append', type=parse_argument,
+                        default=[], help="a parameter and the value to call with; an int or float literal "
+                                         "(may be repeated)")
+    parser.add_argument('--bench', metavar='CALLS', type=int, nargs='?', const=10000, default=None,
+                        help="time CALLS calls against the calling overhead and CPython (default: 10000)")
+    parser.add_argument('-p', '--profile', choices=sorted(PROFILES), default='release',
+                        help="g++ profile (default: release)")
+    add_optimization_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        with open(args.source, 'r') as infile:
+            source = infile.read()
+    except OSError as e:
+        print(f"Can't read {args.source}: {e.strerror}", file=sys.stderr)
+        return 1
+    parameters = [(name, type(value)) for name, value in args.arguments]
+    values = [value for _, value in args.arguments]
+    options = optimization_options(args)
+    builder = GccBuilder(args.profile, extra_flags=['-fPIC'])
+    try:
+        function = load_function(source, parameters, options, builder)
+        sys.stdout.write(function(*values))
+        if args.bench is not None:
+            results = benchmark_calls(source, parameters, values, args.bench, options, builder)
+    except (CompilerError, NameError, SyntaxError, TypeInferenceError) as e:
+        print(f"Compilation error: {e}", file=sys.stderr)
+        return 1
+    except NativeError as e:
+        sys.stdout.write(e.output)  # What the snippet printed before it failed, as run_program does
+        print(f"Runtime error: {e}", file=sys.stderr)
+        return 1
+    except BuildError as e:
+        print(f"Build error: {e}", file=sys.stderr)
+        return 1
+    if args.bench is not None:
+        print(f"library     {'cached' if function.cached else 'built'}")
+        print(f"native      {format_seconds(results['native'])}")
+        print(f"overhead    {format_seconds(results['overhead'])}  (an empty snippet)")
+        if results['python'] is None:
+            print("cpython     n/a (not valid Python)")
+        else:
+            print(f"cpython     {format_seconds(results['python'])}  "
+                  f"({results['python'] / results['native']:.1f}x the native call)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,939 @@
+# IR optimizer. The program is converted to SSA form over its control-flow
+# graph, the enabled passes are run until none of them changes anything, and
+# the result is converted back, coalescing SSA versions onto their original
+# variables wherever their live ranges allow. The loop passes work on the
+# natural loops of the graph, each of which is given a preheader: a block
+# that every entry into the loop passes through and nothing else jumps from.
+
+import math
+
+from ControlFlow import BasicBlock, ControlFlowGraph
+from IntermediateCode import NO_OPERAND, OPERATOR_SYMBOLS, Instruction, Opcode, OperandKind, ValueType
+
+# The C++ backend declares integers as std::int64_t
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+COMMUTATIVE_OPCODES = frozenset((Opcode.ADD, Opcode.MUL, Opcode.EQ, Opcode.NE, Opcode.AND, Opcode.OR))
+# 'not (a < b)' is 'a >= b' for the integers the loop passes reason about, and 'a < b' is 'b > a'
+NEGATED_COMPARISONS = {
+    Opcode.LT: Opcode.GE, Opcode.GE: Opcode.LT,
+    Opcode.LE: Opcode.GT, Opcode.GT: Opcode.LE,
+    Opcode.EQ: Opcode.NE, Opcode.NE: Opcode.EQ,
+}
+SWAPPED_COMPARISONS = {
+    Opcode.LT: Opcode.GT, Opcode.GT: Opcode.LT,
+    Opcode.LE: Opcode.GE, Opcode.GE: Opcode.LE,
+    Opcode.EQ: Opcode.EQ, Opcode.NE: Opcode.NE,
+}
+MAX_ITERATIONS = 16
+
+
+class Phi:
+    __slots__ = ('dest', 'origin', 'args')
+
+    def __init__(self, dest, origin):
+        self.dest = dest
+        self.origin = origin  # The variable or temp this phi merges versions of
+        self.args = {}  # Predecessor block -> operand
+
+    def __repr__(self):
+        return f"Phi({self.dest} <- {list(self.args.values())})"
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def fold_strings(opcode, left, right):
+    """std::string concatenation and comparison; both compare byte-wise, like Python for UTF-8."""
+    if opcode == Opcode.ADD:
+        return left + right
+    elif opcode == Opcode.EQ:
+        return int(left == right)
+    elif opcode == Opcode.NE:
+        return int(left != right)
+    elif opcode == Opcode.LT:
+        return int(left < right)
+    elif opcode == Opcode.LE:
+        return int(left <= right)
+    elif opcode == Opcode.GT:
+        return int(left > right)
+    elif opcode == Opcode.GE:
+        return int(left >= right)
+    return None
+
+
+def fold_constants(opcode, left, right):
+    """Evaluate left <op> right the way the generated C++ would, or return None if we can't."""
+    if isinstance(left, str) and isinstance(right, str):
+        return fold_strings(opcode, left, right)
+    if not (is_number(left) and is_number(right)):
+        return None
+    integers = isinstance(left, int) and isinstance(right, int)
+    if not integers and opcode in NEGATED_COMPARISONS:
+        # C++ compares an integer with a double as two doubles, which Python would compare exactly
+        left, right = float(left), float(right)
+    if opcode == Opcode.ADD:
+        result = left + right
+    elif opcode == Opcode.SUB:
+        result = left - right
+    elif opcode == Opcode.MUL:
+        result = left * right
+    elif opcode == Opcode.DIV or opcode == Opcode.MOD:
+        if right == 0:
+            return None
+        if not integers:
+            # The backend emits std::fmod for a double remainder
+            result = left / right if opcode == Opcode.DIV else math.fmod(left, right)
+        else:
+            # C++ truncates towards zero and the remainder takes the dividend's sign
+            quotient = abs(left) // abs(right)
+            if (left < 0) != (right < 0):
+                quotient = -quotient
+            result = quotient if opcode == Opcode.DIV else left - right * quotient
+    elif opcode == Opcode.EQ:
+        result = int(left == right)
+    elif opcode == Opcode.NE:
+        result = int(left != right)
+    elif opcode == Opcode.LT:
+        result = int(left < right)
+    elif opcode == Opcode.LE:
+        result = int(left <= right)
+    elif opcode == Opcode.GT:
+        result = int(left > right)
+    elif opcode == Opcode.GE:
+        result = int(left >= right)
+    elif opcode == Opcode.AND:
+        result = int(bool(left) and bool(right))
+    elif opcode == Opcode.OR:
+        result = int(bool(left) or bool(right))
+    else:
+        return None
+    if isinstance(result, int):
+        return result if INT_MIN <= result <= INT_MAX else None
+    return result if math.isfinite(result) else None
+
+
+def resolve(replacements, operand):
+    """Follow a chain of replacements to the operand that finally stands for operand."""
+    while operand in replacements:
+        operand = replacements[operand]
+    return operand
+
+
+class SSAForm:
+    """A program's control-flow graph in SSA form.
+
+    Every definition gets a fresh operand; origin maps it back to the variable
+    or temp it came from. The original operand itself stands for the value a
+    variable has on entry (zero, as declared by the C++ backend).
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.cfg = ControlFlowGraph(program)
+        self.cfg.remove_unreachable()
+        self.origin = {}
+        self.construct()
+
+    @property
+    def blocks(self):
+        return self.cfg.blocks
+
+    def is_constant(self, operand):
+        return operand != NO_OPERAND and self.program.kinds[operand] == OperandKind.CONSTANT
+
+    def convert(self, operand, value_type):
+        """operand as a value of value_type, the way a C++ assignment would convert it, or None."""
+        program = self.program
+        if program.types[operand] == value_type:
+            return operand
+        if not self.is_constant(operand):
+            return None  # Leave the conversion to the store
+        value = program.values[operand]
+        if value_type == ValueType.FLOAT and isinstance(value, int):
+            return program.constant(float(value))
+        if value_type == ValueType.INT and isinstance(value, float) and math.isfinite(value):
+            converted = int(value)  # Truncates towards zero, like the C++ conversion
+            if INT_MIN <= converted <= INT_MAX:
+                return program.constant(converted)
+        return None
+
+    def new_version(self, operand):
+        program = self.program
+        version = program.add_operand(program.kinds[operand], program.values[operand], program.types[operand])
+        self.origin[version] = operand
+        return version
+
+    def construct(self):
+        cfg = self.cfg
+        # Semi-pruned SSA: only operands read outside the block that defines them need phis
+        global_names = set()
+        def_blocks = {}
+        for block in cfg.blocks:
+            defined = set()
+            for instruction in block.instructions:
+                for operand in cfg.uses(instruction):
+                    if operand not in defined:
+                        global_names.add(operand)
+                if instruction.dest != NO_OPERAND:
+                    defined.add(instruction.dest)
+                    def_blocks.setdefault(instruction.dest, []).append(block)
+
+        idom = cfg.dominators()
+        frontiers = cfg.dominance_frontiers(idom)
+        for operand in global_names:
+            worklist = list(def_blocks.get(operand, ()))
+            has_phi = set()
+            while worklist:
+                block = worklist.pop()
+                for frontier in frontiers[id(block)]:
+                    if id(frontier) not in has_phi:
+                        has_phi.add(id(frontier))
+                        frontier.phis.append(Phi(operand, operand))
+                        worklist.append(frontier)
+
+        # Rename along the dominator tree with an explicit stack, so deep nesting can't hit the recursion limit
+        children = cfg.dominator_tree(idom)
+        stacks = {}
+        work = [(cfg.entry, None)]
+        while work:
+            block, pushed = work.pop()
+            if pushed is not None:
+                for operand in pushed:
+                    stacks[operand].pop()
+                continue
+            pushed = []
+            for phi in block.phis:
+                phi.dest = self.push_version(stacks, phi.origin, pushed)
+            for instruction in block.instructions:
+                stack = stacks.get(instruction.a)
+                if stack:
+                    instruction.a = stack[-1]
+                stack = stacks.get(instruction.b)
+                if stack:
+                    instruction.b = stack[-1]
+                if instruction.dest != NO_OPERAND:
+                    instruction.dest = self.push_version(stacks, instruction.dest, pushed)
+            for successor in block.successors:
+                for phi in successor.phis:
+                    stack = stacks.get(phi.origin)
+                    phi.args[block] = stack[-1] if stack else phi.origin
+            work.append((block, pushed))
+            work.extend((child, None) for child in children[id(block)])
+
+    def push_version(self, stacks, operand, pushed):
+        version = self.new_version(operand)
+        stacks.setdefault(operand, []).append(version)
+        pushed.append(operand)
+        return version
+
+    def definition_blocks(self):
+        """The block that defines each SSA value."""
+        defined_in = {}
+        for block in self.blocks:
+            for phi in block.phis:
+                defined_in[phi.dest] = block
+            for instruction in block.instructions:
+                if instruction.dest != NO_OPERAND:
+                    defined_in[instruction.dest] = block
+        return defined_in
+
+    def loops(self):
+        """Natural loops, innermost first, each with a preheader; empty if the graph is irreducible."""
+        cfg = self.cfg
+        found = cfg.natural_loops(cfg.dominators())
+        if found is None:
+            return []
+        inserted = [self.insert_preheader(loop) for loop in found[0].values()]
+        if any(inserted):
+            found = cfg.natural_loops(cfg.dominators())
+        return sorted(found[0].values(), key=lambda loop: len(loop.body))
+
+    @staticmethod
+    def preheader(loop):
+        return next(block for block in loop.header.predecessors if id(block) not in loop.body)
+
+    def insert_preheader(self, loop):
+        """Route every edge into loop from outside through one new block; returns False if one exists."""
+        cfg = self.cfg
+        header = loop.header
+        outside = [block for block in header.predecessors if id(block) not in loop.body]
+        if len(outside) == 1 and outside[0].successors == [header]:
+            return False
+        preheader = BasicBlock()
+        preheader.fallthrough = header
+        for block in outside:
+            block.replace_successor(header, preheader)
+        # Straight before the header, so whatever fell into the header now falls into the preheader
+        cfg.blocks.insert(cfg.blocks.index(header), preheader)
+        for phi in header.phis:
+            incoming = {block: phi.args.pop(block) for block in outside if block in phi.args}
+            if len(set(incoming.values())) == 1:
+                phi.args[preheader] = next(iter(incoming.values()))
+            else:
+                merged = Phi(self.new_version(phi.origin), phi.origin)
+                merged.args = incoming
+                preheader.phis.append(merged)
+                phi.args[preheader] = merged.dest
+        cfg.compute_predecessors()
+        return True
+
+    def replace_uses(self, replacements):
+        """Rewrite every read of a replaced operand, following replacement chains."""
+        if not replacements:
+            return
+        for block in self.blocks:
+            for phi in block.phis:
+                for predecessor, operand in phi.args.items():
+                    if operand in replacements:
+                        phi.args[predecessor] = resolve(replacements, operand)
+            for instruction in block.instructions:
+                if instruction.a in replacements:
+                    instruction.a = resolve(replacements, instruction.a)
+                if instruction.b in replacements:
+                    instruction.b = resolve(replacements, instruction.b)
+
+    def destruct(self):
+        """Leave SSA form: turn phis into copies, coalesce versions and write the program back."""
+        cfg = self.cfg
+        cfg.split_critical_edges()
+        for block in cfg.blocks:
+            if not block.phis:
+                continue
+            for predecessor in block.predecessors:
+                copies = [(phi.dest, phi.args.get(predecessor, phi.origin)) for phi in block.phis]
+                copy_instructions = [Instruction(Opcode.STORE, dest=dest, a=source)
+                                     for dest, source in self.sequentialize(copies)]
+                position = len(predecessor.instructions) - (predecessor.terminator is not None)
+                predecessor.instructions[position:position] = copy_instructions
+            block.phis = []
+        self.coalesce()
+        cfg.linearize()
+        self.program.compact()
+
+    def sequentialize(self, copies):
+        """Order a set of parallel copies so no source is overwritten before it is read."""
+        pending = [(dest, source) for dest, source in copies if dest != source]
+        ordered = []
+        while pending:
+            sources = {source for _, source in pending}
+            for position, (dest, source) in enumerate(pending):
+                if dest not in sources:
+                    ordered.append((dest, source))
+                    del pending[position]
+                    break
+            else:
+                # Every destination is still needed as a source: break the cycle with a temp
+                dest = pending[0][0]
+                temp = self.program.new_temp(self.program.types[dest])
+                ordered.append((temp, dest))
+                pending = [(other, temp if source == dest else source) for other, source in pending]
+        return ordered
+
+    def coalesce(self):
+        """Merge SSA versions back into as few operands as interference allows, then rename."""
+        cfg = self.cfg
+        program = self.program
+        kinds = program.kinds
+        types = program.types
+        origin = self.origin
+
+        operands = set()
+        copies = []
+        for block in cfg.blocks:
+            for instruction in block.instructions:
+                for operand in (instruction.dest, instruction.a, instruction.b):
+                    if cfg.value_operand(operand):
+                        operands.add(operand)
+                if instruction.opcode == Opcode.STORE and cfg.value_operand(instruction.a):
+                    copies.append(instruction)
+        versions = {}
+        for operand in sorted(operands):
+            versions.setdefault(origin.get(operand, operand), []).append(operand)
+
+        # Only operands that could share a name with another one need interference information
+        candidates = set()
+        for instruction in copies:
+            candidates.add(instruction.dest)
+            candidates.add(instruction.a)
+        for group in versions.values():
+            if len(group) > 1:
+                candidates.update(group)
+
+        # conflicts[x] holds the candidates live where x is defined (a copy doesn't conflict with its source)
+        conflicts = {operand: set() for operand in candidates}
+        _, live_out = cfg.liveness()
+        for block in cfg.blocks:
+            live = live_out[id(block)] & candidates
+            for instruction in reversed(block.instructions):
+                dest = instruction.dest
+                if dest != NO_OPERAND:
+                    live.discard(dest)
+                    if dest in candidates:
+                        if instruction.opcode == Opcode.STORE and instruction.a in live:
+                            live.discard(instruction.a)
+                            conflicts[dest] |= live
+                            live.add(instruction.a)
+                        else:
+                            conflicts[dest] |= live
+                for operand in cfg.uses(instruction):
+                    if operand in candidates:
+                        live.add(operand)
+
+        parent = {}
+        members = {operand: {operand} for operand in candidates}
+        is_variable = {operand: kinds[origin.get(operand, operand)] == OperandKind.VARIABLE for operand in candidates}
+
+        def find(operand):
+            root = operand
+            while root in parent:
+                root = parent[root]
+            while operand != root:
+                parent[operand], operand = root, parent[operand]
+            return root
+
+        def union(first, second):
+            first, second = find(first), find(second)
+            if first == second or types[first] != types[second]:
+                return
+            if conflicts[first] & members[second] or conflicts[second] & members[first]:
+                return
+            if len(members[first]) < len(members[second]):
+                first, second = second, first
+            parent[second] = first
+            members[first] |= members.pop(second)
+            conflicts[first] |= conflicts.pop(second)
+            is_variable[first] = is_variable[first] or is_variable.pop(second)
+
+        # Versions of the same variable or temp first, then copies, never merging two different variables
+        for group in versions.values():
+            for operand in group[1:]:
+                union(group[0], operand)
+        for instruction in copies:
+            dest, source = find(instruction.dest), find(instruction.a)
+            if not (is_variable[dest] and is_variable[source]):
+                union(dest, source)
+
+        groups = {}
+        for operand in sorted(operands):
+            groups.setdefault(find(operand), []).append(operand)
+        names = {}
+        claimed = set()
+        # A group that still uses a variable's original operand keeps that name
+        for root, group in groups.items():
+            for operand in group:
+                if operand not in origin and kinds[operand] == OperandKind.VARIABLE:
+                    names[root] = operand
+                    claimed.add(operand)
+                    break
+        # Everything else is named after its variable (or temp) if that's free, else gets a fresh name
+        for root, group in groups.items():
+            if root in names:
+                continue
+            owners = [origin.get(operand, operand) for operand in group]
+            variables = [owner for owner in owners if kinds[owner] == OperandKind.VARIABLE]
+            owner = variables[0] if variables else owners[0]
+            if owner not in claimed:
+                claimed.add(owner)
+                names[root] = owner
+            elif variables:
+                names[root] = program.fresh_variable(program.values[owner], types[owner])
+            else:
+                names[root] = program.new_temp(types[owner])
+
+        rename = {operand: names[find(operand)] for operand in operands}
+        for block in cfg.blocks:
+            kept = []
+            for instruction in block.instructions:
+                instruction.dest = rename.get(instruction.dest, instruction.dest)
+                instruction.a = rename.get(instruction.a, instruction.a)
+                instruction.b = rename.get(instruction.b, instruction.b)
+                if instruction.opcode == Opcode.STORE and instruction.dest == instruction.a:
+                    continue
+                kept.append(instruction)
+            block.instructions = kept
+
+
+def fold_constant_expressions(ssa):
+    """Constant folding; copy propagation then carries the results to their uses."""
+    program = ssa.program
+    values = program.values
+    replacements = {}
+    for block in ssa.cfg.reverse_postorder():
+        kept = []
+        for instruction in block.instructions:
+            if instruction.opcode in OPERATOR_SYMBOLS:
+                left = resolve(replacements, instruction.a)
+                right = resolve(replacements, instruction.b)
+                if ssa.is_constant(left) and ssa.is_constant(right):
+                    result = fold_constants(instruction.opcode, values[left], values[right])
+                    if result is not None:
+                        folded = ssa.convert(program.constant(result), program.types[instruction.dest])
+                        if folded is not None:
+                            replacements[instruction.dest] = folded
+                            continue
+            kept.append(instruction)
+        block.instructions = kept
+    ssa.replace_uses(replacements)
+    return bool(replacements)
+
+
+def fold_constant_branches(ssa):
+    """Turn branches on constant conditions into gotos and drop the blocks that become unreachable."""
+    changed = False
+    values = ssa.program.values
+    for block in ssa.blocks:
+        terminator = block.terminator
+        if terminator is None or terminator.opcode == Opcode.GOTO or not ssa.is_constant(terminator.a):
+            continue
+        condition = values[terminator.a]
+        if not is_number(condition):
+            continue  # Type inference rejects string conditions
+        taken = bool(condition) != (terminator.opcode == Opcode.IF_NOT)
+        if taken:
+            removed, kept = block.fallthrough, block.jump
+            block.instructions[-1] = Instruction(Opcode.GOTO, label=terminator.label)
+            block.fallthrough = None
+        else:
+            removed, kept = block.jump, block.fallthrough
+            block.instructions.pop()
+            block.jump = None
+        if removed is not kept:
+            for phi in removed.phis:
+                phi.args.pop(block, None)
+        changed = True
+    if changed:
+        ssa.cfg.compute_predecessors()
+        ssa.cfg.remove_unreachable()
+    return changed
+
+
+def propagate_copies(ssa):
+    """Replace uses of copies with their sources and drop phis whose inputs all agree."""
+    replacements = {}
+    for block in ssa.cfg.reverse_postorder():
+        kept_phis = []
+        for phi in block.phis:
+            inputs = {resolve(replacements, operand) for operand in phi.args.values()}
+            inputs.discard(phi.dest)
+            if len(inputs) == 1:
+                replacements[phi.dest] = inputs.pop()
+            else:
+                kept_phis.append(phi)
+        block.phis = kept_phis
+        kept = []
+        for instruction in block.instructions:
+            if instruction.opcode == Opcode.STORE:
+                # A store into a differently typed operand converts; only constants can be converted here
+                source = ssa.convert(resolve(replacements, instruction.a), ssa.program.types[instruction.dest])
+                if source is not None:
+                    replacements[instruction.dest] = source
+                    continue
+            kept.append(instruction)
+        block.instructions = kept
+    ssa.replace_uses(replacements)
+    return bool(replacements)
+
+
+def number_values(ssa):
+    """Dominator-based global value numbering: reuse an identical dominating computation."""
+    cfg = ssa.cfg
+    children = cfg.dominator_tree(cfg.dominators())
+    replacements = {}
+    available = {}
+    work = [(cfg.entry, None)]
+    while work:
+        block, added = work.pop()
+        if added is not None:
+            for key in added:
+                del available[key]
+            continue
+        added = []
+        kept = []
+        for instruction in block.instructions:
+            instruction.a = resolve(replacements, instruction.a)
+            instruction.b = resolve(replacements, instruction.b)
+            if instruction.opcode in OPERATOR_SYMBOLS:
+                left, right = instruction.a, instruction.b
+                if instruction.opcode in COMMUTATIVE_OPCODES and right < left:
+                    left, right = right, left
+                key = (instruction.opcode, left, right)
+                existing = available.get(key)
+                if existing is not None:
+                    replacements[instruction.dest] = existing
+                    continue
+                available[key] = instruction.dest
+                added.append(key)
+            kept.append(instruction)
+        block.instructions = kept
+        work.append((block, added))
+        work.extend((child, None) for child in children[id(block)])
+    ssa.replace_uses(replacements)
+    return bool(replacements)
+
+
+def eliminate_dead_code(ssa):
+    """Mark everything prints and branches depend on; delete every other definition."""
+    cfg = ssa.cfg
+    definitions = {}
+    worklist = []
+    for block in ssa.blocks:
+        for phi in block.phis:
+            definitions[phi.dest] = phi
+        for instruction in block.instructions:
+            if instruction.dest != NO_OPERAND:
+                definitions[instruction.dest] = instruction
+            elif instruction.opcode != Opcode.GOTO:
+                worklist.extend(cfg.uses(instruction))
+
+    live = set()
+    while worklist:
+        operand = worklist.pop()
+        if operand in live:
+            continue
+        live.add(operand)
+        definition = definitions.get(operand)
+        if isinstance(definition, Phi):
+            worklist.extend(value for value in definition.args.values() if cfg.value_operand(value))
+        elif definition is not None:
+            worklist.extend(cfg.uses(definition))
+
+    changed = False
+    for block in ssa.blocks:
+        phis = [phi for phi in block.phis if phi.dest in live]
+        instructions = [instruction for instruction in block.instructions
+                        if instruction.dest == NO_OPERAND or instruction.dest in live]
+        if len(phis) != len(block.phis) or len(instructions) != len(block.instructions):
+            block.phis, block.instructions = phis, instructions
+            changed = True
+    return changed
+
+
+def append_instructions(block, instructions):
+    """Add instructions to the end of block, before its terminator."""
+    position = len(block.instructions) - (block.terminator is not None)
+    block.instructions[position:position] = instructions
+
+
+def may_trap(ssa, instruction):
+    """Whether running instruction on a path that didn't run it before could crash the program."""
+    types = ssa.program.types
+    if instruction.opcode == Opcode.STORE:
+        # Converting a double that's out of range for std::int64_t is undefined
+        return types[instruction.dest] == ValueType.INT and types[instruction.a] == ValueType.FLOAT
+    if instruction.opcode in (Opcode.DIV, Opcode.MOD):
+        if types[instruction.a] != ValueType.INT or types[instruction.b] != ValueType.INT:
+            return False  # A double division doesn't trap
+        # Only a constant divisor other than 0 and -1 (INT_MIN / -1 overflows) is known to be safe
+        return not ssa.is_constant(instruction.b) or ssa.program.values[instruction.b] in (0, -1)
+    return False
+
+
+def is_invariant(ssa, loop, defined_in, operand):
+    """Whether operand has the same value on every iteration of loop."""
+    if ssa.is_constant(operand):
+        return True
+    block = defined_in.get(operand)
+    return block is None or id(block) not in loop.body
+
+
+class InductionVariable:
+    """A header phi that goes up or down by the same loop-invariant integer on every iteration."""
+    __slots__ = ('phi', 'initial', 'step', 'increment')
+
+    def __init__(self, phi, initial, step, increment):
+        self.phi = phi
+        self.initial = initial  # Value on entry to the loop
+        self.step = step  # Operand added (ADD) or subtracted (SUB) by increment
+        self.increment = increment  # The instruction computing the next iteration's value
+
+
+def induction_variables(ssa, loop, defined_in):
+    program = ssa.program
+    definitions = {}
+    for block in loop.blocks():
+        for instruction in block.instructions:
+            if instruction.dest != NO_OPERAND:
+                definitions[instruction.dest] = instruction
+    preheader = ssa.preheader(loop)
+    found = []
+    for phi in loop.header.phis:
+        if program.types[phi.dest] != ValueType.INT:
+            continue
+        updates = {phi.args.get(latch) for latch in loop.latches}
+        increment = definitions.get(updates.pop()) if len(updates) == 1 else None
+        if increment is None or increment.opcode not in (Opcode.ADD, Opcode.SUB):
+            continue
+        if increment.a == phi.dest:
+            step = increment.b
+        elif increment.b == phi.dest and increment.opcode == Opcode.ADD:
+            step = increment.a
+        else:
+            continue
+        if program.types[step] == ValueType.INT and is_invariant(ssa, loop, defined_in, step):
+            found.append(InductionVariable(phi, phi.args[preheader], step, increment))
+    return found
+
+
+def integer_constant(ssa, operand):
+    value = ssa.program.values[operand]
+    if ssa.is_constant(operand) and isinstance(value, int):
+        return value
+    return None
+
+
+def count_iterations(opcode, initial, step, bound):
+    """How often 'i <opcode> bound' holds for i = initial, initial + step, ... before it first fails.
+
+    None if it never fails (short of wrapping around, which the C++ leaves undefined).
+    """
+    if opcode == Opcode.LT:
+        if initial >= bound:
+            return 0
+        return -(-(bound - initial) // step) if step > 0 else None
+    elif opcode == Opcode.LE:
+        if initial > bound:
+            return 0
+        return (bound - initial) // step + 1 if step > 0 else None
+    elif opcode == Opcode.GT:
+        if initial <= bound:
+            return 0
+        return -(-(initial - bound) // -step) if step < 0 else None
+    elif opcode == Opcode.GE:
+        if initial < bound:
+            return 0
+        return (initial - bound) // -step + 1 if step < 0 else None
+    elif opcode == Opcode.NE:
+        if initial == bound:
+            return 0
+        distance = bound - initial
+        if step != 0 and distance % step == 0 and distance // step > 0:
+            return distance // step
+        return None
+    elif opcode == Opcode.EQ:
+        if initial != bound:
+            return 0
+        return 1 if step != 0 else None
+    return None
+
+
+def trip_count(ssa, loop, variables):
+    """How many times a counted loop's body runs, or None if that isn't known at compile time.
+
+    The loop must only be left from its header, on a comparison of one of its
+    induction variables (constant start and step) with an integer constant.
+    """
+    header = loop.header
+    terminator = header.terminator
+    if terminator is None or terminator.opcode == Opcode.GOTO:
+        return None
+    exits = loop.exits()
+    if len(exits) != 1 or exits[0][0] is not header:
+        return None
+    # The loop goes round again while the condition holds, or while it fails
+    holds = (id(header.jump) in loop.body) == (terminator.opcode == Opcode.IF)
+    condition = next((instruction for instruction in header.instructions if instruction.dest == terminator.a), None)
+    if condition is None or condition.opcode not in NEGATED_COMPARISONS:
+        return None
+    opcode = condition.opcode if holds else NEGATED_COMPARISONS[condition.opcode]
+    if condition.a in variables:
+        variable, bound = variables[condition.a], integer_constant(ssa, condition.b)
+    elif condition.b in variables:
+        variable, bound = variables[condition.b], integer_constant(ssa, condition.a)
+        opcode = SWAPPED_COMPARISONS[opcode]
+    else:
+        return None
+    initial, step = integer_constant(ssa, variable.initial), integer_constant(ssa, variable.step)
+    if bound is None or initial is None or step is None:
+        return None
+    if variable.increment.opcode == Opcode.SUB:
+        step = -step
+    count = count_iterations(opcode, initial, step, bound)
+    if count is None or not INT_MIN <= initial + count * step <= INT_MAX:
+        return None
+    return count
+
+
+def hoist_loop_invariants(ssa):
+    """Loop-invariant code motion: compute what doesn't change in a loop once, in its preheader."""
+    defined_in = ssa.definition_blocks()
+    changed = False
+    for loop in ssa.loops():
+        preheader = ssa.preheader(loop)
+        hoisted = []
+        # Dominators come first in reverse postorder, so an invariant's operands are hoisted before it
+        for block in sorted(loop.blocks(), key=lambda block: block.index):
+            kept = []
+            for instruction in block.instructions:
+                if ((instruction.opcode in OPERATOR_SYMBOLS or instruction.opcode == Opcode.STORE)
+                        and all(is_invariant(ssa, loop, defined_in, operand) for operand in ssa.cfg.uses(instruction))
+                        and not may_trap(ssa, instruction)):
+                    hoisted.append(instruction)
+                    defined_in[instruction.dest] = preheader
+                else:
+                    kept.append(instruction)
+            block.instructions = kept
+        if hoisted:
+            append_instructions(preheader, hoisted)
+            changed = True
+    return changed
+
+
+def reduce_strength(ssa):
+    """Strength reduction: turn i * k, for an induction variable i and invariant k, into an
+    induction variable of its own that steps by step * k, so the loop adds instead of multiplying."""
+    program = ssa.program
+    defined_in = ssa.definition_blocks()
+    replacements = {}
+    for loop in ssa.loops():
+        variables = {variable.phi.dest: variable for variable in induction_variables(ssa, loop, defined_in)}
+        products = []
+        for block in loop.blocks():
+            for instruction in block.instructions:
+                if instruction.opcode != Opcode.MUL or program.types[instruction.dest] != ValueType.INT:
+                    continue
+                for operand, factor in ((instruction.a, instruction.b), (instruction.b, instruction.a)):
+                    if (operand in variables and program.types[factor] == ValueType.INT
+                            and is_invariant(ssa, loop, defined_in, factor)):
+                        products.append((block, instruction, variables[operand], factor))
+                        break
+        if not products:
+            continue
+
+        preheader = ssa.preheader(loop)
+        scaled = {}
+        reduced = set()
+        for block, instruction, variable, factor in products:
+            key = (variable.phi.dest, factor)
+            if key not in scaled:
+                scaled[key] = scale_induction_variable(ssa, loop, preheader, variable, factor, defined_in)
+            replacements[instruction.dest] = scaled[key]
+            reduced.add(id(instruction))
+        for block in loop.blocks():
+            block.instructions = [instruction for instruction in block.instructions if id(instruction) not in reduced]
+    ssa.replace_uses(replacements)
+    return bool(replacements)
+
+
+def scale_induction_variable(ssa, loop, preheader, variable, factor, defined_in):
+    """A new induction variable that is always variable * factor; returns its header phi's operand."""
+    program = ssa.program
+    owner = program.new_temp(ValueType.INT)
+    initial = ssa.new_version(owner)
+    step = program.new_temp(ValueType.INT)
+    append_instructions(preheader, [Instruction(Opcode.MUL, dest=initial, a=variable.initial, b=factor),
+                                    Instruction(Opcode.MUL, dest=step, a=variable.step, b=factor)])
+    phi = Phi(ssa.new_version(owner), owner)
+    increment = Instruction(variable.increment.opcode, dest=ssa.new_version(owner), a=phi.dest, b=step)
+    phi.args[preheader] = initial
+    for latch in loop.latches:
+        phi.args[latch] = increment.dest
+    loop.header.phis.append(phi)
+    # Step it where the variable it scales is stepped, just before so that a for loop's update stays last
+    block = defined_in[variable.increment.dest]
+    block.instructions.insert(block.instructions.index(variable.increment), increment)
+    for operand in (initial, step):
+        defined_in[operand] = preheader
+    defined_in[phi.dest] = loop.header
+    defined_in[increment.dest] = block
+    return phi.dest
+
+
+def simplify_counted_loops(ssa):
+    """Use trip counts: give induction variables their final value after the loop, and delete
+    innermost loops whose trip count is known once nothing after them reads what they compute."""
+    program = ssa.program
+    cfg = ssa.cfg
+    defined_in = ssa.definition_blocks()
+    loops = ssa.loops()
+    changed = False
+    deletable = []
+    for loop in loops:
+        variables = {variable.phi.dest: variable for variable in induction_variables(ssa, loop, defined_in)}
+        count = trip_count(ssa, loop, variables)
+        if count is None:
+            continue
+        preheader = ssa.preheader(loop)
+        if count == 0:
+            final = {phi.dest: phi.args[preheader] for phi in loop.header.phis}
+        else:
+            final = {}
+            for operand, variable in variables.items():
+                initial, step = integer_constant(ssa, variable.initial), integer_constant(ssa, variable.step)
+                if initial is None or step is None:
+                    continue
+                value = initial + count * (-step if variable.increment.opcode == Opcode.SUB else step)
+                if INT_MIN <= value <= INT_MAX:
+                    final[operand] = program.constant(value)
+
+        outside = [block for block in cfg.blocks if id(block) not in loop.body]
+        defined = set(operand for operand, block in defined_in.items() if id(block) in loop.body)
+        observed = False
+        for block in outside:
+            for phi in block.phis:
+                for predecessor, operand in phi.args.items():
+                    if operand in final:
+                        phi.args[predecessor] = final[operand]
+                        changed = True
+                    observed = observed or phi.args[predecessor] in defined
+            for instruction in block.instructions:
+                if instruction.a in final:
+                    instruction.a = final[instruction.a]
+                    changed = True
+                if instruction.b in final:
+                    instruction.b = final[instruction.b]
+                    changed = True
+                observed = observed or instruction.a in defined or instruction.b in defined
+
+        # A loop is only deleted once any loop inside it is gone, so it can't hide an endless one
+        nested = any(other is not loop and id(other.header) in loop.body for other in loops)
+        blocks = loop.blocks() if count else [loop.header]
+        prints = any(instruction.opcode == Opcode.PRINT for block in blocks for instruction in block.instructions)
+        if not (observed or nested or prints):
+            deletable.append((loop, preheader))
+
+    for loop, preheader in deletable:
+        exit_block = loop.exits()[0][1]
+        preheader.replace_successor(loop.header, exit_block)
+        for phi in exit_block.phis:
+            phi.args[preheader] = phi.args.pop(loop.header)
+    if deletable:
+        cfg.compute_predecessors()
+        cfg.remove_unreachable()
+    return changed or bool(deletable)
+
+
+PASSES = {
+    'constants': fold_constant_expressions,
+    'branches': fold_constant_branches,
+    'copies': propagate_copies,
+    'gvn': number_values,
+    'licm': hoist_loop_invariants,
+    'strength': reduce_strength,
+    'loops': simplify_counted_loops,
+    'dce': eliminate_dead_code,
+}
+
+OPTIMIZATION_LEVELS = {
+    0: [],
+    1: ['constants', 'branches', 'copies', 'dce'],
+    2: ['constants', 'branches', 'copies', 'gvn', 'licm', 'strength', 'loops', 'dce'],
+}
+
+
+def optimize(program, level=1, disabled_passes=(), extra_passes=()):
+    """Optimize program in place with the passes for level, minus disabled_passes."""
+    passes = [name for name in OPTIMIZATION_LEVELS[level] + list(extra_passes) if name not in disabled_passes]
+    if not passes:
+        return program
+    ssa = SSAForm(program)
+    for _ in range(MAX_ITERATIONS):
+        changed = False
+        for name in passes:
+            changed = PASSES[name](ssa) or changed
+        if not changed:
+            break
+    ssa.destruct()
+    return program
@@ -0,0 +1,152 @@
+# Output stage after CppCodeGenerator: writes generated files only when their
+# content changed, so an unchanged rebuild leaves timestamps alone and
+# make/ninja have nothing to redo downstream. Each write goes to a temp file
+# in the same directory that is renamed over the target, so readers never see
+# a partial file.
+#
+# Next to each generated .cpp goes a make-style .d file naming the sources it
+# was generated from, and a JSON manifest records for every generated file its
+# sources, the compiler options and version, and the hash of its content.
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+MANIFEST_NAME = "cppcompiler_deps.json"
+HASH_CHUNK = 1 << 20
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    """Hash of the file at path, or None if it can't be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+_umask = None
+
+
+def current_umask():
+    """The process umask; reading it means setting it, so that's done once."""
+    global _umask
+    if _umask is None:
+        _umask = os.umask(0o022)
+        os.umask(_umask)
+    return _umask
+
+
+def file_mode(path, executable=False):
+    """The mode a rewrite of path gets: the existing file's (plus execute wherever it's readable, for an
+    executable), else what creating it would give under the umask."""
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return (0o777 if executable else 0o666) & ~current_umask()
+    return mode | (mode & 0o444) >> 2 if executable else mode
+
+
+def write_if_changed(path, data, executable=False):
+    """Atomically replace path with data (str or bytes) unless it already holds exactly that.
+
+    Returns True if the file was written, False if it was left untouched.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    try:
+        unchanged = os.path.getsize(path) == len(data) and file_hash(path) == content_hash(data)
+    except OSError:
+        unchanged = False
+    if unchanged and (not executable or os.access(path, os.X_OK)):
+        return False
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    mode = file_mode(path, executable)
+    fd, temp_path = tempfile.mkstemp(dir=directory or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, mode)  # mkstemp creates it 0600
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def dependency_path_for(output_path):
+    return os.path.splitext(output_path)[0] + ".d"
+
+
+def make_escape(path):
+    return path.replace('\\', '\\\\').replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+
+def dependency_rule(target, sources):
+    """A make rule saying target depends on sources, plus an empty rule per source
+    so a deleted source doesn't break the build (like gcc -MP)."""
+    lines = [f"{make_escape(target)}: {' '.join(make_escape(source) for source in sources)}".rstrip()]
+    for source in sources:
+        lines.append(f"\n{make_escape(source)}:")
+    return "\n".join(lines) + "\n"
+
+
+class Manifest:
+    """JSON map from each generated file to what it was generated from."""
+
+    def __init__(self, path=MANIFEST_NAME):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, 'r') as file:
+                self.entries = json.load(file).get('outputs', {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def record(self, output_path, sources, options, compiler_version, digest):
+        self.entries[output_path] = {
+            'sources': list(sources),
+            'options': options,
+            'compiler_version': compiler_version,
+            'sha256': digest,
+        }
+
+    def save(self):
+        """Write the manifest, again only if it changed; returns whether it did."""
+        text = json.dumps({'outputs': self.entries}, indent=2, sort_keys=True)
+        return write_if_changed(self.path, text + "\n")
+
+
+class OutputResult:
+    def __init__(self, output_path, changed, digest):
+        self.output_path = output_path
+        self.changed = changed
+        self.digest = digest
+
+    def __repr__(self):
+        return f"OutputResult({self.output_path!r}, changed={self.changed})"
+
+
+def write_generated(output_path, cpp_code, sources=(), options=None, compiler_version=None, manifest=None):
+    """Write a generated .cpp and its .d file if they changed, and record it in manifest."""
+    data = cpp_code.encode()
+    changed = write_if_changed(output_path, data)
+    write_if_changed(dependency_path_for(output_path), dependency_rule(output_path, sources))
+    digest = content_hash(data)
+    if manifest is not None:
+        manifest.record(output_path, sources, options or {}, compiler_version, digest)
+    return OutputResult(output_path, changed, digest)
@@ -0,0 +1,188 @@
+# Dependence analysis for OpenMP parallel for loops in the C++ backend.
+# A structured for loop is run under '#pragma omp parallel for' when its
+# iterations can't see each other's work:
+#  - it is in OpenMP's canonical form: an integer variable stepped by a
+#    constant and compared with a bound the loop doesn't change;
+#  - its body is straight-line code that neither prints (the output would
+#    interleave) nor jumps;
+#  - everything else the body writes is either written before it is read in
+#    every iteration, so each iteration can have its own copy (the variables
+#    keep the last iteration's value, as when run in order), or an integer sum
+#    or product that is only ever read to add to or multiply it, which OpenMP
+#    combines with a reduction. Floating-point sums aren't parallelized: adding
+#    them up in a different order changes the rounding.
+# Starting threads only pays for long loops, so the backend also wants a
+# minimum trip count, checked at compile time when the bounds are constants
+# and by the pragma's if clause otherwise.
+
+from IntermediateCode import Opcode, OperandKind, ValueType
+from Optimizer import COMMUTATIVE_OPCODES, NEGATED_COMPARISONS, SWAPPED_COMPARISONS, count_iterations
+from Structuring import BlockLabel
+
+DEFAULT_MIN_TRIPS = 1000
+# How a reduction variable may be updated, and the OpenMP operator that combines the partial results
+REDUCTION_OPERATORS = {Opcode.ADD: '+', Opcode.SUB: '+', Opcode.MUL: '*'}
+STEPPED_OPCODES = (Opcode.ADD, Opcode.SUB)
+# Which way the counter has to move for the loop to end
+ASCENDING = {Opcode.LT: True, Opcode.LE: True, Opcode.GT: False, Opcode.GE: False}
+
+
+class ParallelLoop:
+    """How to run one for loop in parallel: the canonical loop and the data-sharing clauses."""
+    __slots__ = ('counter', 'opcode', 'bound', 'step', 'private', 'lastprivate', 'reductions', 'initial', 'trips')
+
+    def __init__(self, counter, opcode, bound, step, private, lastprivate, reductions, initial, trips):
+        self.counter = counter  # Variable operand stepped by the update
+        self.opcode = opcode  # Loop while 'counter <opcode> bound'
+        self.bound = bound
+        self.step = step  # Signed
+        self.private = private  # Temps the body writes
+        self.lastprivate = lastprivate  # Variables the body writes, the counter included
+        self.reductions = reductions  # Operand -> OpenMP reduction operator
+        self.initial = initial  # The counter's value on entry, if known at compile time
+        self.trips = trips  # Iterations, if known at compile time
+
+    def __repr__(self):
+        return f"ParallelLoop({self.counter}, step={self.step}, trips={self.trips})"
+
+
+def counted_update(program, update):
+    """(counter, step) if the update is 'counter = counter +/- constant', else None."""
+    kinds, values = program.kinds, program.values
+    last = update[-1]
+    if len(update) == 2 and last.opcode == Opcode.STORE and kinds[update[0].dest] == OperandKind.TEMP \
+            and update[0].dest == last.a:
+        counter, step_instruction = last.dest, update[0]
+    elif len(update) == 1 and last.opcode in STEPPED_OPCODES:
+        counter, step_instruction = last.dest, last
+    else:
+        return None
+    if kinds[counter] != OperandKind.VARIABLE or program.types[counter] != ValueType.INT \
+            or step_instruction.opcode not in STEPPED_OPCODES:
+        return None
+    if step_instruction.a == counter:
+        amount = step_instruction.b
+    elif step_instruction.b == counter and step_instruction.opcode == Opcode.ADD:
+        amount = step_instruction.a
+    else:
+        return None
+    if kinds[amount] != OperandKind.CONSTANT or program.types[amount] != ValueType.INT or not values[amount]:
+        return None
+    step = values[amount]
+    return counter, -step if step_instruction.opcode == Opcode.SUB else step
+
+
+def find_reductions(program, body):
+    """Operand -> (operator, indices of the instructions that read it, indices that write it)
+    for each variable the body only ever updates as 'v = v op x'."""
+    kinds, types = program.kinds, program.types
+    found = {}
+    rejected = set()
+    for index, instruction in enumerate(body):
+        operator = REDUCTION_OPERATORS.get(instruction.opcode)
+        if operator is None or instruction.a == instruction.b:
+            continue
+        # v - x is a reduction but x - v isn't
+        candidates = (instruction.a, instruction.b) if instruction.opcode in COMMUTATIVE_OPCODES else (instruction.a,)
+        for variable in candidates:
+            if kinds[variable] != OperandKind.VARIABLE or types[variable] != ValueType.INT:
+                continue
+            if instruction.dest == variable:
+                write = index
+            elif (kinds[instruction.dest] == OperandKind.TEMP and index + 1 < len(body)
+                  and body[index + 1].opcode == Opcode.STORE and body[index + 1].dest == variable
+                  and body[index + 1].a == instruction.dest
+                  and not reads_before_write(body, index + 2, instruction.dest)):
+                write = index + 1
+            else:
+                continue
+            entry = found.setdefault(variable, (operator, set(), set()))
+            if entry[0] != operator:
+                rejected.add(variable)
+            entry[1].add(index)
+            entry[2].add(write)
+            break
+    return {variable: entry for variable, entry in found.items() if variable not in rejected}
+
+
+def reads_before_write(body, start, operand):
+    """Whether body[start:] reads operand before writing it again."""
+    for instruction in body[start:]:
+        if instruction.a == operand or instruction.b == operand:
+            return True
+        if instruction.dest == operand:
+            return False
+    return False
+
+
+def analyze_loop(program, loop, goto_targets=(), previous=None):
+    """A ParallelLoop for a structured LoopStatement whose iterations are independent, else None.
+
+    previous is the instruction the loop directly follows, if any; when it
+    sets the counter to a constant the trip count may be known.
+    """
+    condition = loop.condition
+    if loop.update is None or condition is None or condition.expression is None:
+        return None
+    body = []
+    for statement in loop.body:
+        if isinstance(statement, BlockLabel):
+            if id(statement.block) in goto_targets:
+                return None  # Something jumps into the middle of the body
+        elif getattr(statement, 'opcode', None) is None or statement.opcode == Opcode.PRINT:
+            return None  # Control flow (if, loop or jump) or output
+        else:
+            body.append(statement)
+    stepped = counted_update(program, loop.update)
+    if stepped is None:
+        return None
+    counter, step = stepped
+
+    expression = condition.expression
+    opcode = NEGATED_COMPARISONS.get(expression.opcode) if condition.negated else expression.opcode
+    if expression.a == counter:
+        bound = expression.b
+    elif expression.b == counter:
+        bound, opcode = expression.a, SWAPPED_COMPARISONS.get(opcode)
+    else:
+        return None
+    if opcode not in ASCENDING or ASCENDING[opcode] != (step > 0) or program.types[bound] != ValueType.INT:
+        return None
+
+    kinds = program.kinds
+    written = {instruction.dest for instruction in body}
+    if counter in written or bound in written:
+        return None
+    reductions = find_reductions(program, body)
+    for variable, (_, reads, writes) in list(reductions.items()):
+        for index, instruction in enumerate(body):
+            read = instruction.a == variable or instruction.b == variable
+            if (read and index not in reads) or (instruction.dest == variable and index not in writes):
+                del reductions[variable]
+                break
+    # Anything else must be written before it is read, or it carries a value from one iteration to the next
+    assigned = set()
+    for instruction in body:
+        for operand in (instruction.a, instruction.b):
+            if operand in written and operand not in assigned and operand not in reductions:
+                return None
+        assigned.add(instruction.dest)
+
+    trips = None
+    initial = initial_value(program, previous, counter)
+    if initial is not None and kinds[bound] == OperandKind.CONSTANT:
+        trips = count_iterations(opcode, initial, step, program.values[bound])
+    private = sorted(operand for operand in written if kinds[operand] == OperandKind.TEMP)
+    lastprivate = [counter] + sorted(operand for operand in written
+                                     if kinds[operand] == OperandKind.VARIABLE and operand not in reductions)
+    return ParallelLoop(counter, opcode, bound, step, private, lastprivate,
+                        {variable: entry[0] for variable, entry in sorted(reductions.items())}, initial, trips)
+
+
+def initial_value(program, statement, counter):
+    """The constant statement (an instruction before a loop) sets counter to, if it does."""
+    if (statement is not None and statement.opcode == Opcode.STORE and statement.dest == counter
+            and program.kinds[statement.a] == OperandKind.CONSTANT and program.types[statement.a] == ValueType.INT):
+        return program.values[statement.a]
+    return None
+
@@ -0,0 +1,198 @@
+# Profile-guided optimization for generated programs. g++ -O2 can't tell
+# which branches of the generated if/while code are hot, so the program is
+# built instrumented with -fprofile-generate, run once on a training input,
+# and rebuilt with -fprofile-use on the .gcda profile that run wrote.
+#
+# Generated programs read no input of their own, so the training run is the
+# program itself; a training input file, if given, is what it sees on stdin.
+# Profiles are kept next to the generated C++, in <name>.pgo/, keyed by a
+# hash of the C++ text, the compiler and its flags and the training input,
+# so rebuilding an unchanged program skips the instrumented build and the
+# training run; profiles for an older version of the C++ are removed. The
+# optimized executable is cached like any other build.
+#
+# g++ looks for an object's profile next to the object, under the same name,
+# so both builds compile to program.o in a scratch directory the profile is
+# copied into and out of.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from CompileCache import CompileCache
+from GccBuild import DEFAULT_BUILD_CACHE_DIR, PROFILES, BuildError, GccBuilder, best_run, executable_path_for
+from OutputStage import content_hash, file_hash, write_if_changed
+
+PROFILE_DIR_SUFFIX = ".pgo"
+GENERATE_FLAGS = ['-fprofile-generate']
+# -fprofile-correction tolerates the counter races of an OpenMP training run
+USE_FLAGS = ['-fprofile-use', '-fprofile-correction']
+TRAINING_TIMEOUT = 600  # Seconds
+DEFAULT_REPEAT = 3
+
+
+def profile_dir_for(source_path):
+    return os.path.splitext(source_path)[0] + PROFILE_DIR_SUFFIX
+
+
+class PgoResult:
+    def __init__(self, source_path, output_path, profile_path, trained, cached):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.profile_path = profile_path
+        self.trained = trained  # Whether this build ran the training input, rather than reusing its profile
+        self.cached = cached  # Whether the optimized executable came from the build cache
+        self.plain_seconds = None  # Set by measure()
+        self.pgo_seconds = None
+
+    @property
+    def speedup(self):
+        return self.plain_seconds / self.pgo_seconds if self.pgo_seconds else None
+
+    def __repr__(self):
+        return f"PgoResult({self.source_path!r}, trained={self.trained}, speedup={self.speedup})"
+
+
+def timed_run(executable, input_path, repeat):
+    """best_run on executable; a failed run raises RunError, a BuildError."""
+    # A bare relative name would be looked up on PATH
+    return best_run([os.path.abspath(executable)], repeat, input_path, TRAINING_TIMEOUT)
+
+
+class PgoBuilder:
+    """Builds executables the way GccBuilder does, plus a training run in between."""
+
+    def __init__(self, profile='release', compiler='g++', cache_dir=DEFAULT_BUILD_CACHE_DIR, extra_flags=()):
+        extra_flags = list(extra_flags)
+        self.plain = GccBuilder(profile, compiler, cache_dir, extra_flags)
+        self.instrumented = GccBuilder(profile, compiler, cache_dir, extra_flags + GENERATE_FLAGS)
+        self.optimized = GccBuilder(profile, compiler, cache_dir, extra_flags + USE_FLAGS)
+
+    def profile_path(self, source_path, cpp_code, training_input):
+        """Where the profile for cpp_code trained on training_input is kept: <C++ key>-<input hash>.gcda."""
+        training = file_hash(training_input) if training_input else "none"
+        if training is None:
+            raise BuildError(f"Can't read the training input {training_input}")
+        key = self.instrumented.key(cpp_code, 'executable')
+        return os.path.join(profile_dir_for(source_path), f"{key[:16]}-{training[:8]}.gcda")
+
+    def build(self, source_path, output_path=None, training_input=None):
+        """Build source_path with PGO, training it on training_input unless a profile for it is kept.
+
+        Raises BuildError if a build fails or the training run doesn't exit cleanly.
+        """
+        output_path = output_path or executable_path_for(source_path)
+        with open(source_path, 'r') as file:
+            cpp_code = file.read()
+        profile_path = self.profile_path(source_path, cpp_code, training_input)
+        trained = not os.path.exists(profile_path)
+        workdir = tempfile.mkdtemp()
+        try:
+            if trained:
+                self.train(source_path, training_input, workdir)
+                with open(os.path.join(workdir, "program.gcda"), 'rb') as file:
+                    profile = file.read()
+                self.prune(profile_path)
+                write_if_changed(profile_path, profile)
+            else:
+                with open(profile_path, 'rb') as file:
+                    profile = file.read()
+                with open(os.path.join(workdir, "program.gcda"), 'wb') as file:
+                    file.write(profile)
+
+            # The executable depends on the profile as much as on the C++
+            cache = self.optimized.cache
+            key = self.optimized.key(cpp_code + "\0" + content_hash(profile), 'executable')
+            data = cache.get(key) if cache else None
+            cached = data is not None
+            if not cached:
+                with open(self.compile(self.optimized, source_path, workdir, "program"), 'rb') as file:
+                    data = file.read()
+                if cache:
+                    cache.put(key, data)
+            write_if_changed(output_path, data, executable=True)
+        except OSError as e:
+            raise BuildError(str(e)) from None
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return PgoResult(source_path, output_path, profile_path, trained, cached)
+
+    def compile(self, builder, source_path, workdir, name):
+        """Compile to program.o in workdir, where g++ reads or writes the profile, and link it as name there;
+        returns the executable's path."""
+        arguments = []
+        header = builder.ensure_pch()
+        if header:
+            arguments += ['-include', header, '-Winvalid-pch']
+        object_path = os.path.join(workdir, "program.o")
+        builder.run_compiler(arguments + ['-c', source_path, '-o', object_path])
+        executable = os.path.join(workdir, name)
+        builder.run_compiler([object_path, '-o', executable])
+        return executable
+
+    def train(self, source_path, training_input, workdir):
+        """Build instrumented and run it on training_input, leaving program.gcda in workdir."""
+        timed_run(self.compile(self.instrumented, source_path, workdir, "instrumented"), training_input, 1)
+        if not os.path.exists(os.path.join(workdir, "program.gcda")):
+            raise BuildError(f"The training run of {source_path} wrote no profile")
+
+    @staticmethod
+    def prune(profile_path):
+        """Remove the profiles kept for other versions of the source; those for other inputs stay."""
+        directory, name = os.path.split(profile_path)
+        prefix = name.split('-')[0] + '-'
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".gcda") and not name.startswith(prefix):
+                    CompileCache.remove(os.path.join(directory, name))
+
+    def measure(self, result, training_input=None, repeat=DEFAULT_REPEAT):
+        """Time result's executable against the plain build on training_input; their output must match."""
+        plain_path = os.path.splitext(result.output_path)[0] + ".plain" + (".exe" if os.name == 'nt' else "")
+        plain = self.plain.build(result.source_path, plain_path)
+        if not plain.ok:
+            raise BuildError(plain.error)
+        try:
+            result.plain_seconds, plain_output = timed_run(plain.output_path, training_input, repeat)
+            result.pgo_seconds, pgo_output = timed_run(result.output_path, training_input, repeat)
+        finally:
+            CompileCache.remove(plain.output_path)
+        if plain_output != pgo_output:
+            raise BuildError(f"The PGO build of {result.source_path} printed something different from the plain build")
+        return result
+
+
+def format_speedup(result):
+    return (f"PGO speedup {result.speedup:.2f}x "
+            f"({result.plain_seconds:.3f}s plain, {result.pgo_seconds:.3f}s with the profile)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build generated C++ with profile-guided optimization.")
+    parser.add_argument('source', help="generated .cpp file")
+    parser.add_argument('-o', '--output', default=None, help="executable (default: the source without .cpp)")
+    parser.add_argument('-i', '--input', default=None, help="training input, fed to the training run on stdin")
+    parser.add_argument('-p', '--profile', default='release', choices=sorted(PROFILES))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f"runs per timing; the fastest counts (default: {DEFAULT_REPEAT})")
+    parser.add_argument('--no-measure', action='store_true', help="don't time the result against a plain build")
+    parser.add_argument('--openmp', action='store_true', help="the C++ was generated with --openmp")
+    args = parser.parse_args()
+
+    builder = PgoBuilder(args.profile, extra_flags=['-fopenmp'] if args.openmp else [])
+    try:
+        result = builder.build(args.source, args.output, args.input)
+        print(f"Built {result.output_path} ({'trained' if result.trained else 'profile reused'}"
+              f"{', cached' if result.cached else ''})")
+        if not args.no_measure:
+            print(format_speedup(builder.measure(result, args.input, args.repeat)))
+    except (BuildError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
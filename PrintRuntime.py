@@ -0,0 +1,175 @@
+# Output runtime for generated programs. Printing with std::cout and
+# std::endl flushed the stream after every line, one write system call each.
+# Instead, the generated code formats each printed value with std::to_chars
+# straight into a large buffer, which is written out when it fills and when
+# the program exits. Doubles are formatted as %g with six significant digits,
+# exactly as cout printed them, so the output is unchanged (the bytecode VM's
+# format_double renders the same way).
+#
+# Buffering modes:
+#  - 'auto' flushes after every line when stdout is a terminal, so an
+#    interactive run still shows each line as it is printed, and buffers
+#    fully otherwise;
+#  - 'full' always buffers;
+#  - 'line' always flushes after every line.
+# An integer division by zero kills the program with SIGFPE, or with SIGILL
+# where g++ saw it coming and emitted a trap instead. The runtime catches
+# both to write out what was printed before, then dies of the signal anyway.
+#
+# A snippet built as a shared library (NativeLibrary) runs inside another
+# process, so it gets the capture variant of the runtime: output collects in
+# a string the host reads back instead of going to stdout, and the host's
+# signal handlers and stdio are left alone. The two variants are marked with
+# #ifdef CAPTURE_OUTPUT in RUNTIME and resolved here, so a program's C++
+# only holds its own.
+
+from IntermediateCode import ValueType
+
+BUFFERING_MODES = ('auto', 'full', 'line')
+BUFFER_SIZE = 1 << 16
+HEADERS = frozenset(("<charconv>", "<csignal>", "<cstdint>", "<cstdio>", "<cstring>", "<string_view>"))
+PRINT_FUNCTIONS = {
+    ValueType.INT: 'print_int',
+    ValueType.FLOAT: 'print_double',
+    ValueType.STRING: 'print_string',
+}
+LINE_BUFFERED = {'auto': "is_terminal()", 'full': "false", 'line': "true", 'capture': "false"}
+CAPTURE_MACRO = "CAPTURE_OUTPUT"
+
+RUNTIME = """\
+#ifdef _WIN32
+#include <io.h>
+#else
+#include <unistd.h>
+#endif
+
+namespace cppcompiler {
+
+inline bool is_terminal() {
+#ifdef _WIN32
+    return _isatty(_fileno(stdout));
+#else
+    return isatty(1);
+#endif
+}
+
+// Printed lines collect here and are written out when the buffer fills and at exit
+class Output {
+public:
+#ifdef CAPTURE_OUTPUT
+    Output() : line_buffered_(@LINE_BUFFERED@) {}
+#else
+    Output() : line_buffered_(@LINE_BUFFERED@) {
+        std::setvbuf(stdout, nullptr, _IONBF, 0);  // Buffered here already
+        std::signal(SIGFPE, flush_and_die);
+        std::signal(SIGILL, flush_and_die);
+    }
+#endif
+    ~Output() { flush(); }
+
+    // Where the next size bytes can go
+    char* reserve(std::size_t size) {
+        if (size > sizeof(buffer_) - used_) flush();
+        return buffer_ + used_;
+    }
+    void write(const char* data, std::size_t size) {
+        if (size > sizeof(buffer_) - used_) {
+            flush();
+            if (size > sizeof(buffer_)) {
+                emit(data, size);
+                return;
+            }
+        }
+        std::memcpy(buffer_ + used_, data, size);
+        used_ += size;
+    }
+    // Finish a line whose text was written up to end
+    void end_line(char* end) {
+        *end++ = '\\n';
+        used_ = end - buffer_;
+        if (line_buffered_) flush();
+    }
+    void flush() {
+        if (used_) emit(buffer_, used_);
+        used_ = 0;
+    }
+#ifdef CAPTURE_OUTPUT
+    std::string captured;  // Everything flushed since the host last cleared it
+#endif
+
+private:
+#ifdef CAPTURE_OUTPUT
+    void emit(const char* data, std::size_t size) { captured.append(data, size); }
+#else
+    void emit(const char* data, std::size_t size) { std::fwrite(data, 1, size, stdout); }
+    static void flush_and_die(int signal);
+#endif
+
+    char buffer_[@BUFFER_SIZE@];
+    std::size_t used_ = 0;
+    bool line_buffered_;
+};
+
+static Output output;
+
+#ifndef CAPTURE_OUTPUT
+// Not async-signal-safe, but the program is dying anyway and stdout is unbuffered
+inline void Output::flush_and_die(int signal) {
+    output.flush();
+    std::signal(signal, SIG_DFL);
+    std::raise(signal);
+}
+#endif
+
+inline void print_int(std::int64_t value) {
+    char* first = output.reserve(21);  // -9223372036854775808 and the newline
+    output.end_line(std::to_chars(first, first + 20, value).ptr);
+}
+
+inline void print_double(double value) {
+    char* first = output.reserve(32);
+    output.end_line(std::to_chars(first, first + 31, value, std::chars_format::general, 6).ptr);
+}
+
+inline void print_string(std::string_view text) {
+    output.write(text.data(), text.size());
+    output.end_line(output.reserve(1));
+}
+
+}  // namespace cppcompiler
+"""
+
+
+def select_variant(lines, capture):
+    """lines with the #ifdef/#ifndef CAPTURE_MACRO sections resolved; other conditionals are kept as they are."""
+    kept = []
+    branches = []  # For each open conditional: whether its current branch is kept, or None if it isn't ours
+    for line in lines:
+        directive = line.strip()
+        if directive in (f"#ifdef {CAPTURE_MACRO}", f"#ifndef {CAPTURE_MACRO}"):
+            branches.append(capture == directive.startswith("#ifdef"))
+            continue
+        if directive.startswith("#if"):
+            branches.append(None)
+        elif directive == "#else" and branches[-1] is not None:
+            branches[-1] = not branches[-1]
+            continue
+        elif directive == "#endif" and branches[-1] is not None:
+            branches.pop()
+            continue
+        elif directive == "#endif":
+            branches.pop()
+        if False not in branches:
+            kept.append(line)
+    return kept
+
+
+def runtime_lines(buffering='auto'):
+    """The runtime's C++, to go between the #includes and main(); 'capture' is NativeLibrary's buffering."""
+    text = RUNTIME.replace("@LINE_BUFFERED@", LINE_BUFFERED[buffering]).replace("@BUFFER_SIZE@", str(BUFFER_SIZE))
+    return [""] + select_variant(text.rstrip('\n').split('\n'), buffering == 'capture') + [""]
+
+
+def print_statement(value_type, value):
+    """The C++ statement printing value, of value_type, on a line of its own."""
+    return f"cppcompiler::{PRINT_FUNCTIONS[value_type]}({value});"
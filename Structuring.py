@@ -0,0 +1,306 @@
+# Control-flow structuring for the C++ backend. The IR only has labels and
+# jumps; this rebuilds while, for and if/else statements from the program's
+# control-flow graph so the emitted C++ presents natural loops to GCC.
+# Loops are the natural loops of back edges (found with dominators), if/else
+# merge points come from postdominators, and an edge that doesn't fit the
+# nesting becomes a break, a continue or, as a last resort, a goto.
+# Irreducible graphs aren't structured at all: structure() returns None and
+# the backend falls back to one goto per jump.
+
+from ControlFlow import ControlFlowGraph
+from IntermediateCode import NO_OPERAND, OPERATOR_SYMBOLS, Opcode, OperandKind
+
+
+class Condition:
+    __slots__ = ('operand', 'negated', 'expression')
+
+    def __init__(self, operand, negated, expression=None):
+        self.operand = operand
+        self.negated = negated
+        self.expression = expression  # The binary instruction computing operand, when it is folded into the test
+
+    def inverted(self):
+        return Condition(self.operand, not self.negated, self.expression)
+
+    def __repr__(self):
+        return f"Condition({'not ' if self.negated else ''}{self.operand})"
+
+
+class IfStatement:
+    __slots__ = ('condition', 'then_body', 'else_body')
+
+    def __init__(self, condition, then_body, else_body):
+        self.condition = condition
+        self.then_body = then_body
+        self.else_body = else_body
+
+    def __repr__(self):
+        return f"IfStatement({self.condition}, {len(self.then_body)} then, {len(self.else_body)} else)"
+
+
+class LoopStatement:
+    __slots__ = ('condition', 'body', 'update')
+
+    def __init__(self, condition, body, update=None):
+        self.condition = condition  # None for while (true)
+        self.body = body
+        self.update = update  # Instructions run after every iteration; makes this a for loop
+
+    def __repr__(self):
+        return f"LoopStatement({self.condition}, {len(self.body)} statements)"
+
+
+class JumpStatement:
+    __slots__ = ('keyword', 'target')
+
+    def __init__(self, keyword, target=None):
+        self.keyword = keyword  # 'break', 'continue', 'goto' or 'return'
+        self.target = target  # The block a goto goes to
+
+    def __repr__(self):
+        return f"JumpStatement({self.keyword})"
+
+
+class BlockLabel:
+    """Marks where a block starts; rendered as a label only if some goto targets it."""
+    __slots__ = ('block',)
+
+    def __init__(self, block):
+        self.block = block
+
+
+class Structurer:
+    def __init__(self, program):
+        self.program = program
+        self.cfg = ControlFlowGraph(program)
+        self.cfg.remove_unreachable()
+        self.loops = {}  # id(header) -> NaturalLoop
+        self.innermost = {}  # id(block) -> innermost NaturalLoop containing it
+        self.continue_targets = {}  # id(loop) -> the block jumps continue to
+        self.emitted = set()
+        self.goto_targets = set()  # ids of the blocks some goto jumps to
+        self.inlined = set()  # Temps whose only use is a condition they were folded into
+        self.use_counts = {}
+        self.definition_counts = {}
+        for instruction in program.instructions:
+            for operand in (instruction.a, instruction.b):
+                self.use_counts[operand] = self.use_counts.get(operand, 0) + 1
+            self.definition_counts[instruction.dest] = self.definition_counts.get(instruction.dest, 0) + 1
+
+    def structure(self):
+        """The program as a list of statements, or None if its control flow is irreducible."""
+        cfg = self.cfg
+        self.idom = cfg.dominators()
+        found = cfg.natural_loops(self.idom)
+        if found is None:
+            return None
+        self.loops, self.innermost = found
+        self.ipdom = cfg.postdominators()
+        statements = self.sequence(cfg.entry, None, None)
+        # Whatever didn't fit the nesting follows the normal end of the program, reached only by goto
+        leftovers = [block for block in cfg.blocks if id(block) not in self.emitted]
+        if leftovers:
+            statements.append(JumpStatement('return'))
+            for block in leftovers:
+                self.emit_unstructured(block, statements)
+        return statements
+
+    def dominates(self, dominator, block):
+        return ControlFlowGraph.dominates(self.idom, dominator, block)
+
+    def region(self, block):
+        return ControlFlowGraph.loop_region(self.innermost, block)
+
+    def ready(self, block, loop):
+        """True if block can be laid out next inside loop without a jump."""
+        if id(block) in self.emitted or self.region(block) is not loop:
+            return False
+        parent = self.idom[id(block)]
+        return parent is block or id(parent) in self.emitted
+
+    def jump(self, target, loop):
+        if loop is not None:
+            if target is self.continue_targets.get(id(loop)):
+                return JumpStatement('continue')
+            if target is loop.follow:
+                return JumpStatement('break')
+        self.goto_targets.add(id(target))
+        return JumpStatement('goto', target)
+
+    def split_block(self, block):
+        """A block's instructions without its branch, and the branch's condition (if it has one).
+
+        A temp computed right before the branch and used nowhere else is folded
+        into the condition instead of being stored.
+        """
+        terminator = block.terminator
+        instructions = block.instructions[:-1] if terminator is not None else block.instructions
+        if terminator is None or terminator.opcode == Opcode.GOTO:
+            return list(instructions), None
+        condition = Condition(terminator.a, terminator.opcode == Opcode.IF_NOT)
+        operand = terminator.a
+        if (instructions and instructions[-1].dest == operand and instructions[-1].opcode in OPERATOR_SYMBOLS
+                and self.program.kinds[operand] == OperandKind.TEMP
+                and self.use_counts.get(operand) == 1 and self.definition_counts.get(operand) == 1):
+            condition.expression = instructions[-1]
+            instructions = instructions[:-1]
+        return list(instructions), condition
+
+    def use_condition(self, condition):
+        if condition.expression is not None:
+            self.inlined.add(condition.operand)
+        return condition
+
+    def sequence(self, block, stop, loop):
+        """Lay out blocks from block until control reaches stop, which follows the statements."""
+        statements = []
+        while block is not None and block is not stop:
+            if not self.ready(block, loop):
+                statements.append(self.jump(block, loop))
+                break
+            if id(block) in self.loops:
+                block = self.emit_loop(self.loops[id(block)], statements)
+            else:
+                block = self.emit_block(block, stop, loop, statements)
+        return statements
+
+    def emit_block(self, block, stop, loop, statements):
+        """Append a block (and any if statement its branch starts); returns where control continues."""
+        self.emitted.add(id(block))
+        statements.append(BlockLabel(block))
+        instructions, condition = self.split_block(block)
+        statements.extend(instructions)
+        if condition is None:
+            successors = block.successors
+            return successors[0] if successors else None
+        condition = self.use_condition(condition)
+        merge = self.merge_point(block, stop, loop)
+        branches = [(condition, block.jump), (condition.inverted(), block.fallthrough)]
+        roles = []
+        for _, target in branches:
+            if target is merge:
+                roles.append('merge')
+            elif self.ready(target, loop) and self.idom[id(target)] is block:
+                roles.append('place')
+            else:
+                roles.append('jump')
+
+        # A branch that has to jump anyway needs no else: `if (c) break;` and carry on with the other
+        for index, role in enumerate(roles):
+            if role == 'jump':
+                branch_condition, target = branches[index]
+                statements.append(IfStatement(branch_condition, [self.jump(target, loop)], []))
+                return branches[1 - index][1]
+        if 'merge' in roles:
+            branch_condition, target = branches[roles.index('place')]
+            statements.append(IfStatement(branch_condition, self.sequence(target, merge, loop), []))
+            return merge
+        then_body = self.sequence(block.jump, merge, loop)
+        else_body = self.sequence(block.fallthrough, merge, loop)
+        if not then_body:
+            condition, then_body, else_body = condition.inverted(), else_body, then_body
+        if then_body:
+            statements.append(IfStatement(condition, then_body, else_body))
+        return merge
+
+    def merge_point(self, block, stop, loop):
+        """Where the two arms of block's branch meet again, or stop if they only meet after it."""
+        candidate = self.ipdom.get(id(block))
+        if candidate is None or candidate is stop:
+            return stop
+        if (id(candidate) not in self.emitted and self.region(candidate) is loop
+                and self.dominates(block, candidate)):
+            return candidate
+        return stop
+
+    def loop_condition(self, loop):
+        """(condition, first block of the body) if the header does nothing but test whether to stay."""
+        header = loop.header
+        instructions, condition = self.split_block(header)
+        if condition is None or instructions or loop.follow is None:
+            return None
+        if id(header.jump) in loop.body and header.fallthrough is loop.follow:
+            return condition, header.jump
+        if id(header.fallthrough) in loop.body and header.jump is loop.follow:
+            return condition.inverted(), header.fallthrough
+        return None
+
+    def loop_update(self, loop, condition):
+        """(latch, leading instructions, update instructions) if the loop can be written as a for loop.
+
+        The update is the assignment at the end of the single block that jumps
+        back to the header, when it assigns a variable the condition tests,
+        together with the temps computed just before it for that assignment.
+        """
+        if len(loop.latches) != 1:
+            return None
+        latch = loop.latches[0]
+        if latch is loop.header or latch.successors != [loop.header]:
+            return None
+        instructions, _ = self.split_block(latch)
+        if not instructions:
+            return None
+        kinds = self.program.kinds
+        tested = {condition.operand}
+        if condition.expression is not None:
+            tested.update((condition.expression.a, condition.expression.b))
+        last = instructions[-1]
+        if last.opcode == Opcode.PRINT or kinds[last.dest] != OperandKind.VARIABLE or last.dest not in tested:
+            return None
+        split = len(instructions) - 1
+        needed = set()
+        instruction = last
+        while True:
+            needed.update(operand for operand in (instruction.a, instruction.b)
+                          if operand != NO_OPERAND and kinds[operand] == OperandKind.TEMP)
+            previous = instructions[split - 1] if split else None
+            if previous is None or previous.opcode == Opcode.PRINT or previous.dest not in needed:
+                break
+            split -= 1
+            instruction = instructions[split]
+        return latch, instructions[:split], instructions[split:]
+
+    def emit_loop(self, loop, statements):
+        header = loop.header
+        tested = self.loop_condition(loop)
+        if tested is None:
+            self.continue_targets[id(loop)] = header
+            body = []
+            after = self.emit_block(header, header, loop, body)
+            body.extend(self.sequence(after, header, loop))
+            statements.append(LoopStatement(None, body))
+            return loop.follow
+
+        condition, first = tested
+        self.emitted.add(id(header))
+        statements.append(BlockLabel(header))
+        update = self.loop_update(loop, condition)
+        if update is None:
+            self.continue_targets[id(loop)] = header
+            body = self.sequence(first, header, loop)
+            statements.append(LoopStatement(self.use_condition(condition), body))
+            return loop.follow
+
+        latch, leading, instructions = update
+        # continue skips straight to the update, so it can only stand for a jump to the latch if nothing precedes it
+        self.continue_targets[id(loop)] = None if leading else latch
+        body = self.sequence(first, latch, loop)
+        self.emitted.add(id(latch))
+        body.append(BlockLabel(latch))
+        body.extend(leading)
+        statements.append(LoopStatement(self.use_condition(condition), body, instructions))
+        return loop.follow
+
+    def emit_unstructured(self, block, statements):
+        self.emitted.add(id(block))
+        statements.append(BlockLabel(block))
+        instructions, condition = self.split_block(block)
+        statements.extend(instructions)
+        if condition is not None:
+            statements.append(IfStatement(self.use_condition(condition), [self.jump(block.jump, None)], []))
+            statements.append(self.jump(block.fallthrough, None))
+        elif block.successors:
+            statements.append(self.jump(block.successors[0], None))
+        else:
+            statements.append(JumpStatement('return'))
+
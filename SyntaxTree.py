@@ -0,0 +1,370 @@
+# The AST, in one of two forms. The object form is a tree of node classes
+# (with __slots__, so a node is just its fields). The flat form is a NodeTable:
+# every node is a row in a few parallel arrays (its kind and up to four
+# columns of child rows or pool indexes), statement lists are runs in one
+# shared array of rows, and identifiers, operators and literals are interned
+# into pools. A NodeTable hands out views that subclass the node classes, so
+# the visitors over the AST run unchanged on either form.
+#
+# The parser builds nodes through a builder: NodeBuilder makes the object
+# form, FlatNodeBuilder the flat one.
+
+from array import array
+from enum import IntEnum
+
+from Visitor import NodeVisitor
+
+
+class NumberNode:
+    __slots__ = ('value',)
+    fields = ()  # Attributes holding child nodes, in evaluation order
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"NumberNode({self.value})"
+
+
+class WhileNode:
+    __slots__ = ('condition', 'body')
+    fields = ('condition', 'body')
+
+    def __init__(self, condition, body):
+        self.condition = condition
+        self.body = body
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class ForNode:
+    __slots__ = ('init', 'condition', 'update', 'body')
+    fields = ('init', 'condition', 'update', 'body')
+
+    def __init__(self, init, condition, update, body):
+        self.init = init
+        self.condition = condition
+        self.update = update
+        self.body = body
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class PrintNode:
+    __slots__ = ('expression',)
+    fields = ('expression',)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class VariableNode:
+    __slots__ = ('name',)
+    fields = ()
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"VariableNode({self.name})"
+
+
+class StringNode:
+    __slots__ = ('value',)
+    fields = ()
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"StringNode({self.value})"
+
+
+class BinOpNode:
+    __slots__ = ('left', 'op', 'right')
+    fields = ('left', 'right')
+
+    def __init__(self, left, op, right):
+        self.left = left
+        self.op = op
+        self.right = right
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class UnaryOpNode:
+    __slots__ = ('op', 'operand')
+    fields = ('operand',)
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class IfNode:
+    __slots__ = ('condition', 'true_branch', 'false_branch')
+    fields = ('condition', 'true_branch', 'false_branch')
+
+    def __init__(self, condition, true_branch, false_branch):
+        self.condition = condition
+        self.true_branch = true_branch
+        self.false_branch = false_branch
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class AssignmentNode:
+    __slots__ = ('variable', 'value')
+    fields = ('value',)
+
+    def __init__(self, variable, value):
+        self.variable = variable  # The variable's name
+        self.value = value
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class ProgramNode:
+    __slots__ = ('statements',)
+    fields = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __repr__(self):
+        return format_node(self)
+
+
+class NodeFormatter(NodeVisitor):
+    """Formats a node the way its __repr__ shows it; walk()ed, so any nesting depth prints."""
+    method_prefix = 'format_'
+
+    def format_list(self, nodes):
+        parts = []
+        for node in nodes:
+            parts.append((yield node))
+        return f"[{', '.join(parts)}]"
+
+    def generic_visit(self, node):
+        node_class = next(klass for klass in type(node).__mro__ if klass in NODE_LAYOUTS)
+        parts = []
+        for attribute in node_class.__slots__:
+            value = getattr(node, attribute)
+            if attribute in node_class.fields and value is not None:
+                value = yield value
+            parts.append(f"{value}")
+        return f"{node_class.__name__}({', '.join(parts)})"
+
+
+def format_node(node):
+    return NodeFormatter().walk(node)
+
+
+class NodeKind(IntEnum):
+    LIST = 0
+    NUMBER = 1
+    STRING = 2
+    VARIABLE = 3
+    BINOP = 4
+    ASSIGNMENT = 5
+    PRINT = 6
+    IF = 7
+    WHILE = 8
+    FOR = 9
+    PROGRAM = 10
+    UNARYOP = 11
+
+
+# Each node class's constructor arguments in order, with how the flat form stores
+# them: 'node' is a child's row (NO_NODE for None), 'name' an index into the name
+# pool and 'constant' an index into the constant pool
+NODE_LAYOUTS = {
+    NumberNode: (NodeKind.NUMBER, (('value', 'constant'),)),
+    StringNode: (NodeKind.STRING, (('value', 'constant'),)),
+    VariableNode: (NodeKind.VARIABLE, (('name', 'name'),)),
+    BinOpNode: (NodeKind.BINOP, (('left', 'node'), ('op', 'name'), ('right', 'node'))),
+    UnaryOpNode: (NodeKind.UNARYOP, (('op', 'name'), ('operand', 'node'))),
+    AssignmentNode: (NodeKind.ASSIGNMENT, (('variable', 'name'), ('value', 'node'))),
+    PrintNode: (NodeKind.PRINT, (('expression', 'node'),)),
+    IfNode: (NodeKind.IF, (('condition', 'node'), ('true_branch', 'node'), ('false_branch', 'node'))),
+    WhileNode: (NodeKind.WHILE, (('condition', 'node'), ('body', 'node'))),
+    ForNode: (NodeKind.FOR, (('init', 'node'), ('condition', 'node'), ('update', 'node'), ('body', 'node'))),
+    ProgramNode: (NodeKind.PROGRAM, (('statements', 'node'),)),
+}
+
+COLUMN_COUNT = 4
+NO_NODE = -1
+
+
+class NodeBuilder:
+    """Builds the object form: nodes are instances of the node classes, statement lists are lists."""
+
+    def node(self, node_class, *args):
+        return node_class(*args)
+
+    def list(self, nodes):
+        return nodes
+
+    def tree(self, statements):
+        return statements
+
+
+class NodeTable:
+    """The flat form of a program's AST; visited and iterated over, it stands for its top-level statements."""
+    node_name = 'list'
+
+    def __init__(self):
+        self.kinds = array('B')
+        # A list row keeps the start and length of its run in items; other rows follow NODE_LAYOUTS
+        self.columns = tuple(array('i') for _ in range(COLUMN_COUNT))
+        self.items = array('i')
+        self.names = []  # Interned identifiers and operators
+        self.constants = []  # Interned number and string literals
+        self.root = NO_NODE  # The list row of the top-level statements
+
+    def node(self, row):
+        """A view of row; None for NO_NODE."""
+        if row == NO_NODE:
+            return None
+        kind = self.kinds[row]
+        if kind == NodeKind.LIST:
+            return NodeList(self, self.columns[0][row], self.columns[1][row])
+        return VIEW_CLASSES[kind](self, row)
+
+    def statements(self):
+        return self.node(self.root)
+
+    def __iter__(self):
+        return iter(self.statements())
+
+    def __len__(self):
+        return len(self.statements())
+
+    def nbytes(self):
+        """Bytes held by the node arrays, not counting the pools."""
+        arrays = (self.kinds, self.items) + self.columns
+        return sum(len(column) * column.itemsize for column in arrays)
+
+    def __repr__(self):
+        return f"NodeTable({len(self.kinds)} nodes, {len(self.names)} names, {len(self.constants)} constants)"
+
+
+class FlatNodeBuilder:
+    """Builds a NodeTable; nodes and statement lists are row numbers until tree() returns the table."""
+
+    def __init__(self):
+        self.table = NodeTable()
+        self.name_ids = {}
+        self.constant_ids = {}
+
+    def add_row(self, kind, values):
+        table = self.table
+        row = len(table.kinds)
+        table.kinds.append(kind)
+        columns = table.columns
+        for column, value in zip(columns, values):
+            column.append(value)
+        for column in columns[len(values):]:
+            column.append(NO_NODE)
+        return row
+
+    def intern(self, pool, ids, value):
+        key = (type(value), value)  # Keeps 1 and 1.0 apart
+        index = ids.get(key)
+        if index is None:
+            index = ids[key] = len(pool)
+            pool.append(value)
+        return index
+
+    def node(self, node_class, *args):
+        kind, layout = NODE_LAYOUTS[node_class]
+        values = []
+        for (_, storage), value in zip(layout, args):
+            if storage == 'node':
+                values.append(NO_NODE if value is None else value)
+            elif storage == 'name':
+                values.append(self.intern(self.table.names, self.name_ids, value))
+            else:
+                values.append(self.intern(self.table.constants, self.constant_ids, value))
+        return self.add_row(kind, values)
+
+    def list(self, rows):
+        items = self.table.items
+        start = len(items)
+        items.extend(rows)
+        return self.add_row(NodeKind.LIST, (start, len(rows)))
+
+    def tree(self, statements):
+        self.table.root = self.list(statements)
+        return self.table
+
+
+class NodeList:
+    """View of a statement list in a NodeTable; visitors treat it as a list."""
+    __slots__ = ('table', 'start', 'count')
+    node_name = 'list'
+
+    def __init__(self, table, start, count):
+        self.table = table
+        self.start = start
+        self.count = count
+
+    def __iter__(self):
+        node = self.table.node
+        items = self.table.items
+        for index in range(self.start, self.start + self.count):
+            yield node(items[index])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("statement index out of range")
+        return self.table.node(self.table.items[self.start + index])
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def view_field(column, storage):
+    """Property reading a view's attribute out of its row's column."""
+    if storage == 'node':
+        def get(self):
+            return self.table.node(self.table.columns[column][self.row])
+    elif storage == 'name':
+        def get(self):
+            return self.table.names[self.table.columns[column][self.row]]
+    else:
+        def get(self):
+            return self.table.constants[self.table.columns[column][self.row]]
+    return property(get)
+
+
+def view_init(self, table, row):
+    self.table = table
+    self.row = row
+
+
+def view_class(node_class, layout):
+    """Subclass of node_class whose fields are read from a NodeTable row."""
+    namespace = {'__slots__': ('table', 'row'), '__init__': view_init}
+    for column, (attribute, storage) in enumerate(layout):
+        namespace[attribute] = view_field(column, storage)
+    return type(node_class.__name__, (node_class,), namespace)
+
+
+VIEW_CLASSES = {kind: view_class(node_class, layout) for node_class, (kind, layout) in NODE_LAYOUTS.items()}
@@ -0,0 +1,100 @@
+# Temp slot reuse. Every binary operation gets its own T<n> from the IR
+# generator, and each of them becomes a separate C++ local. After liveness
+# analysis over the control-flow graph, a linear scan over the program hands a
+# temp the slot of one whose live range has already ended, so the number of
+# temps ends up bounded by how many are live at once rather than by the
+# number of expressions. Slots are only shared between temps of one type.
+
+import heapq
+
+from ControlFlow import ControlFlowGraph
+from IntermediateCode import BRANCH_OPCODES, NO_OPERAND, OperandKind
+
+
+class TempAllocator:
+    def __init__(self, program):
+        self.program = program
+        self.cfg = ControlFlowGraph(program)
+
+    def live_ranges(self):
+        """temp -> [start, end] over the instructions in layout order.
+
+        Instruction n reads its operands at 2n and writes its result at 2n + 1,
+        so a temp can take over the slot of one its own instruction last reads.
+        A range covers every block the temp is live through, which makes it
+        the hull of the real live range; that's all linear scan needs.
+        """
+        cfg = self.cfg
+        kinds = self.program.kinds
+        live_in, live_out = cfg.liveness()
+        ranges = {}
+
+        def extend(operand, point):
+            if kinds[operand] != OperandKind.TEMP:
+                return
+            bounds = ranges.get(operand)
+            if bounds is None:
+                ranges[operand] = [point, point]
+            elif point < bounds[0]:
+                bounds[0] = point
+            elif point > bounds[1]:
+                bounds[1] = point
+
+        position = 0
+        for block in cfg.blocks:
+            for operand in live_in[id(block)]:
+                extend(operand, 2 * position)
+            for instruction in block.instructions:
+                for operand in cfg.uses(instruction):
+                    extend(operand, 2 * position)
+                if instruction.dest != NO_OPERAND:
+                    extend(instruction.dest, 2 * position + 1)
+                position += 1
+            for operand in live_out[id(block)]:
+                extend(operand, 2 * position)
+        return ranges
+
+    def pinned(self):
+        """Temps that keep their own operand: branch conditions, which the backend inlines
+        into the if or loop when they have a single definition and use."""
+        return {instruction.a for block in self.cfg.blocks for instruction in block.instructions
+                if instruction.opcode in BRANCH_OPCODES and instruction.a != NO_OPERAND}
+
+    def run(self):
+        """Rename temps onto shared slots; returns how many temps were folded into another."""
+        program = self.program
+        cfg = self.cfg
+        types = program.types
+        ranges = self.live_ranges()
+        pinned = self.pinned()
+
+        slots = {}
+        free = {}  # ValueType -> slots nothing live is using
+        active = []  # heap of (end, slot) for the ranges being scanned over
+        for temp, (start, end) in sorted(ranges.items(), key=lambda item: item[1][0]):
+            while active and active[0][0] < start:
+                _, slot = heapq.heappop(active)
+                free.setdefault(types[slot], []).append(slot)
+            if temp in pinned:
+                continue
+            pool = free.get(types[temp])
+            slot = pool.pop() if pool else temp
+            slots[temp] = slot
+            heapq.heappush(active, (end, slot))
+
+        renamed = {temp: slot for temp, slot in slots.items() if temp != slot}
+        if not renamed:
+            return 0
+        for block in cfg.blocks:
+            for instruction in block.instructions:
+                instruction.dest = renamed.get(instruction.dest, instruction.dest)
+                instruction.a = renamed.get(instruction.a, instruction.a)
+                instruction.b = renamed.get(instruction.b, instruction.b)
+        cfg.linearize()
+        program.compact()
+        return len(renamed)
+
+
+def reuse_temps(program):
+    """Share temps whose live ranges don't overlap, in place; returns how many were folded away."""
+    return TempAllocator(program).run()
@@ -5,7 +5,17 @@
 
 import re
 import argparse
-
+import io
+import locale
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Each rule turns a call python(args) into C++. By default that's the cpp text,
+# the arguments joined by ' << ' and a ';'. A rule with a 'template' is
+# formatted instead, with the arguments as {0}, {1}, ... and all of them
+# comma-separated as {args}.
 conversion_tokens = [
     {
         'python': 'print',
@@ -13,46 +23,207 @@ conversion_tokens = [
     }
 ]
 
+# A string literal (to the end of the line if unterminated), which nothing inside is converted in
+STRING = r'''"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?'''
+# One scan finds the next string literal, which is skipped, or the next call;
+# a call's name then picks its rule out of a dict, so the cost per line doesn't
+# grow with the number of rules
+SCANNER = re.compile(rf'''({STRING})|(?<![\w.])([A-Za-z_][\w.]*)\s*\(''')
+DELIMITER = re.compile(rf'''{STRING}|[()\[\]{{}},]''')
+OPENERS = {'(': ')', '[': ']', '{': '}'}
+CLOSERS = {')', ']', '}'}
+
+
+def split_arguments(line, start):
+    """Split the arguments of a call whose '(' ends just before start.
+
+    Commas only separate arguments outside brackets and string literals.
+    Returns (arguments, index just past the closing ')'), or None if the
+    parentheses don't balance on this line.
+    """
+    arguments = []
+    expected = [')']
+    argument_start = start
+    for match in DELIMITER.finditer(line, start):
+        char = match.group()
+        if char in OPENERS:
+            expected.append(OPENERS[char])
+        elif char in CLOSERS:
+            if char != expected.pop():
+                return None
+            if not expected:
+                arguments.append(line[argument_start:match.start()].strip())
+                if arguments == ['']:
+                    arguments = []
+                return arguments, match.end()
+        elif char == ',' and len(expected) == 1:
+            arguments.append(line[argument_start:match.start()].strip())
+            argument_start = match.end()
+    return None
+
+
+class RuleEngine:
+    """The conversion rules, applied to a line in one left-to-right pass."""
+
+    def __init__(self, tokens):
+        self.rules = {token['python']: token for token in tokens}
+
+    def convert(self, line):
+        match = SCANNER.search(line)
+        if match is None:
+            return line
+        rules = self.rules
+        pieces = []
+        copied = 0  # line[:copied] is in pieces already
+        while match:
+            position = match.end()
+            rule = rules.get(match.group(2)) if match.group(1) is None else None
+            parsed = split_arguments(line, position) if rule is not None else None
+            # A string is skipped whole; past a name that isn't a rule's, the scan goes on into its arguments
+            if parsed is not None:
+                arguments, position = parsed
+                arguments = [self.convert(argument) if '(' in argument else argument for argument in arguments]
+                pieces.append(line[copied:match.start()])
+                pieces.append(self.apply(rule, arguments))
+                copied = position
+            match = SCANNER.search(line, position)
+        if not pieces:
+            return line
+        pieces.append(line[copied:])
+        return ''.join(pieces)
+
+    def apply(self, rule, arguments):
+        template = rule.get('template')
+        if template is not None:
+            return template.format(*arguments, args=', '.join(arguments))
+        cpp_content = ' << '.join(arguments)
+        return f"{rule['cpp']} {cpp_content};"
 
-def CppConvert(line, tokens):
-    for token in tokens:
-        python_token = token['python']
-        cpp_token = token['cpp']
-
-        pattern = re.compile(rf'{python_token}\((.*?)\)')
-
-        def replace_token(match):
-            content = match.group(1)
-
-            parts = content.split(',')
-            cpp_parts = [part.strip() for part in parts]
-
-            cpp_content = ' << '.join(cpp_parts)
-            return f'{cpp_token} {cpp_content};'
 
-        line = pattern.sub(replace_token, line)
-
-    return line
-
-
-def convert_file(input_file, output_file, tokens):
-    with open(input_file, 'r') as infile:
-        lines = infile.readlines()
-        cpp_lines = [CppConvert(line.strip(), tokens) for line in lines]
-
-    with open(output_file, 'w') as outfile:
-        outfile.write("#include <iostream>\nusing namespace std;\n\nint main() {\n")
-        outfile.write('\n'.join(f"    {line}" for line in cpp_lines))
-        outfile.write('\n    return 0;\n}\n')
+def CppConvert(line, tokens):
+    """Convert one line; tokens is a rule list or, to avoid rebuilding it per line, a RuleEngine."""
+    engine = tokens if isinstance(tokens, RuleEngine) else RuleEngine(tokens)
+    return engine.convert(line)
+
+
+HEADER = "#include <iostream>\nusing namespace std;\n\nint main() {\n"
+FOOTER = "    return 0;\n}\n"
+BUFFER_SIZE = 1 << 20
+SHARDS_PER_JOB = 4  # More shards than workers, so one slow shard doesn't leave the others idle
+MIN_SHARD_BYTES = 1 << 20
+
+
+def convert_lines(lines, engine, outfile):
+    """Write the converted body line for each of lines; returns how many there were."""
+    count = 0
+    for line in lines:
+        outfile.write(f"    {engine.convert(line.strip())}\n")
+        count += 1
+    return count
+
+
+def shard_ranges(input_file, shards):
+    """Split input_file into about shards byte ranges that each start and end on a line boundary."""
+    size = os.path.getsize(input_file)
+    ranges = []
+    with open(input_file, 'rb') as infile:
+        start = 0
+        for shard in range(1, shards + 1):
+            if start >= size:
+                break
+            end = size * shard // shards
+            if end > start and end < size:
+                infile.seek(end - 1)
+                infile.readline()  # Run on to the end of the line the boundary falls in
+                end = infile.tell()
+            end = max(end, start)
+            if end > start:
+                ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class ShardReader(io.RawIOBase):
+    """Raw reads from a file object, stopping after limit bytes."""
+
+    def __init__(self, infile, limit):
+        self.infile = infile
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.infile.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def convert_shard(input_file, start, end, tokens, encoding, shard_path):
+    """Convert the lines in bytes [start, end) of input_file into shard_path; runs in a worker process."""
+    engine = RuleEngine(tokens)
+    with open(input_file, 'rb') as infile, open(shard_path, 'w', encoding=encoding, buffering=BUFFER_SIZE) as outfile:
+        infile.seek(start)
+        reader = io.TextIOWrapper(io.BufferedReader(ShardReader(infile, end - start), BUFFER_SIZE), encoding=encoding)
+        return convert_lines(reader, engine, outfile)
+
+
+def convert_file(input_file, output_file, tokens, jobs=1, encoding=None):
+    """Convert input_file line by line, streaming, so memory doesn't grow with the file.
+
+    With jobs > 1 the file is cut into line-aligned shards that worker
+    processes convert into temporary files, which are appended to the output
+    in order.
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    with open(output_file, 'w', encoding=encoding, buffering=BUFFER_SIZE) as outfile:
+        outfile.write(HEADER)
+        if jobs > 1:
+            count = convert_sharded(input_file, outfile, tokens, jobs, encoding)
+        else:
+            with open(input_file, 'r', encoding=encoding, buffering=BUFFER_SIZE) as infile:
+                count = convert_lines(infile, RuleEngine(tokens), outfile)
+        if not count:
+            outfile.write("\n")  # An empty input still gets its (empty) body line
+        outfile.write(FOOTER)
+
+
+def convert_sharded(input_file, outfile, tokens, jobs, encoding):
+    size = os.path.getsize(input_file)
+    shards = max(1, min(jobs * SHARDS_PER_JOB, size // MIN_SHARD_BYTES))
+    ranges = shard_ranges(input_file, shards)
+    shard_dir = tempfile.mkdtemp(prefix="convert_", dir=os.path.dirname(os.path.abspath(outfile.name)))
+    shard_paths = [os.path.join(shard_dir, f"{index}.cpp") for index in range(len(ranges))]
+    count = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(convert_shard, input_file, start, end, tokens, encoding, shard_path)
+                       for (start, end), shard_path in zip(ranges, shard_paths)]
+            # Stitch each shard in as soon as it and every shard before it are done
+            outfile.flush()
+            for future, shard_path in zip(futures, shard_paths):
+                count += future.result()
+                with open(shard_path, 'r', encoding=encoding) as shard:
+                    shutil.copyfileobj(shard, outfile, BUFFER_SIZE)
+                os.remove(shard_path)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return count
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input_file', type=str)
     parser.add_argument('output_file', type=str)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="worker processes converting shards of the file")
+    parser.add_argument('--encoding', default=None, help="encoding of both files (default: the locale's)")
     args = parser.parse_args()
 
-    convert_file(args.input_file, args.output_file, conversion_tokens)
+    convert_file(args.input_file, args.output_file, conversion_tokens, args.jobs, args.encoding)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+# Debug tracing and per-phase profiling for the compiler.
+# Hot paths guard every debug message with `if tracer.enabled:`, so when
+# tracing is off the only cost is one attribute check and the message is
+# never built. At info, only a summary of each phase is logged.
+# logging and tracemalloc are only imported once tracing or memory profiling
+# is switched on.
+
+import sys
+import time
+from contextlib import contextmanager
+
+# logging's numeric levels; 'off' is above CRITICAL
+LOG_LEVELS = {
+    'debug': 10,
+    'info': 20,
+    'off': 51,
+}
+
+
+class Tracer:
+    __slots__ = ('enabled', 'info_enabled', 'name', 'logger')
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = None  # Set up by configure_tracing
+        self.enabled = False  # Debug messages, for every token, node and statement
+        self.info_enabled = False  # Phase summaries
+
+    def debug(self, message):
+        if self.logger is not None:
+            self.logger.debug(message)
+
+    def info(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+
+tracer = Tracer("cppcompiler")
+
+
+def configure_tracing(level='debug', stream=None):
+    """Send compiler trace messages at or above level to stream (stderr by default)."""
+    import logging
+
+    level = LOG_LEVELS[level] if isinstance(level, str) else level
+    logger = tracer.logger = logging.getLogger(tracer.name)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        logger.addHandler(handler)
+    tracer.enabled = logger.isEnabledFor(logging.DEBUG)
+    tracer.info_enabled = logger.isEnabledFor(logging.INFO)
+
+
+class Profiler:
+    """Records wall time, peak traced memory and item counts for each compiler phase."""
+
+    enabled = True
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = []
+        self.started = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        record = {'name': name}
+        tracing_memory = self.trace_memory
+        if tracing_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if tracing_memory:
+                record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+            self.phases.append(record)
+
+    def report(self, **extra):
+        report = {'timestamp': self.started, 'total_seconds': sum(phase['seconds'] for phase in self.phases)}
+        report.update(extra)
+        report['phases'] = self.phases
+        return report
+
+    def trace_summary(self):
+        """Log each phase's time and counts, then the total, at info."""
+        for phase in self.phases:
+            counts = ", ".join(f"{key}={value}" for key, value in phase.items() if key not in ('name', 'seconds'))
+            tracer.info(f"{phase['name']}: {phase['seconds'] * 1000:.1f} ms" + (f" ({counts})" if counts else ""))
+        tracer.info(f"total: {sum(phase['seconds'] for phase in self.phases) * 1000:.1f} ms")
+
+    def to_json(self, **extra):
+        import json
+        return json.dumps(self.report(**extra), indent=2)
+
+    def stop(self):
+        if not self.trace_memory:
+            return
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off; phase() does no timing at all."""
+
+    enabled = False
+
+    @contextmanager
+    def phase(self, name):
+        yield {}
+
+
+NULL_PROFILER = NullProfiler()
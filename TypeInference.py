@@ -0,0 +1,159 @@
+# Type inference over the IR. Every variable and temp gets the one C++ type it
+# is declared with: std::int64_t, double or std::string. A variable's type is
+# the join of everything stored into it (an int that is ever assigned a double
+# is a double), so the inference is flow-insensitive and runs as a worklist
+# over the instructions that read each operand until nothing changes.
+
+from IntermediateCode import NO_OPERAND, OPERATOR_SYMBOLS, VALUE_KINDS, Opcode, OperandKind, ValueType
+
+# Opcodes whose result is always a 0/1 integer
+BOOLEAN_OPCODES = frozenset((Opcode.EQ, Opcode.NE, Opcode.LT, Opcode.LE, Opcode.GT, Opcode.GE,
+                             Opcode.AND, Opcode.OR))
+COMPARISON_OPCODES = BOOLEAN_OPCODES - {Opcode.AND, Opcode.OR}
+
+TYPE_NAMES = {
+    ValueType.UNKNOWN: 'unknown',
+    ValueType.INT: 'int',
+    ValueType.FLOAT: 'float',
+    ValueType.STRING: 'string',
+}
+
+
+class TypeInferenceError(Exception):
+    pass
+
+
+def join_types(first, second):
+    """The narrowest type that can hold values of both types."""
+    if first == second or second == ValueType.UNKNOWN:
+        return first
+    if first == ValueType.UNKNOWN:
+        return second
+    if ValueType.STRING in (first, second):
+        return None
+    return ValueType.FLOAT
+
+
+class TypeInference:
+    def __init__(self, program):
+        self.program = program
+        self.types = list(program.types)
+
+    def describe(self, instruction):
+        return f"'{self.program.instruction_text(instruction)}'"
+
+    def mismatch(self, instruction, left, right):
+        return TypeInferenceError(f"Type mismatch in {self.describe(instruction)}: "
+                                  f"{TYPE_NAMES[left]} and {TYPE_NAMES[right]}")
+
+    def result_type(self, instruction):
+        """Type of the value instruction stores, given what is known about its operands so far."""
+        types = self.types
+        opcode = instruction.opcode
+        if opcode == Opcode.STORE:
+            return types[instruction.a]
+        if opcode in BOOLEAN_OPCODES:
+            return ValueType.INT
+        left, right = types[instruction.a], types[instruction.b]
+        if opcode == Opcode.ADD and ValueType.STRING in (left, right):
+            return ValueType.STRING  # Concatenation; check() rejects a string added to a number
+        return join_types(left, right) if ValueType.STRING not in (left, right) else ValueType.UNKNOWN
+
+    def store_error(self, instruction, stored_type):
+        dest = instruction.dest
+        return TypeInferenceError(f"Cannot store a {TYPE_NAMES[self.result_type(instruction)]} in "
+                                  f"{TYPE_NAMES[stored_type]} '{self.program.values[dest]}' "
+                                  f"({self.describe(instruction)})")
+
+    def propagate(self, instructions):
+        """Join each instruction's result type into its dest until nothing changes."""
+        program = self.program
+        types = self.types
+        readers = {}
+        worklist = []
+        for instruction in instructions:
+            for operand in (instruction.a, instruction.b):
+                if operand != NO_OPERAND and program.kinds[operand] in VALUE_KINDS:
+                    readers.setdefault(operand, []).append(instruction)
+            worklist.append(instruction)
+
+        while worklist:
+            instruction = worklist.pop()
+            dest = instruction.dest
+            joined = join_types(types[dest], self.result_type(instruction))
+            if joined is None:
+                raise self.store_error(instruction, types[dest])
+            if joined != types[dest]:
+                types[dest] = joined
+                worklist.extend(readers.get(dest, ()))
+
+    def finish(self):
+        """Default what is still unknown, check every instruction and store the types in the program."""
+        program = self.program
+        types = self.types
+        # Something only ever read (or only copied from itself) keeps its zero initialiser
+        for operand, kind in enumerate(program.kinds):
+            if kind in VALUE_KINDS and types[operand] == ValueType.UNKNOWN:
+                types[operand] = ValueType.INT
+
+        for instruction in program.instructions:
+            self.check(instruction)
+        program.types = types
+        return types
+
+    def run(self):
+        # Branches and prints read values but define nothing to infer
+        self.propagate([instruction for instruction in self.program.instructions if instruction.dest != NO_OPERAND])
+        return self.finish()
+
+    # Watch mode infers one top-level statement at a time: variables are shared
+    # between statements, so their types are joined program-wide by the caller,
+    # and a statement's temps are inferred from the variables' types so far.
+
+    def infer_temps(self, variable_types):
+        program = self.program
+        for name, operand in program.variables.items():
+            self.types[operand] = variable_types.get(name, ValueType.UNKNOWN)
+        kinds = program.kinds
+        self.propagate([instruction for instruction in program.instructions
+                        if instruction.dest != NO_OPERAND and kinds[instruction.dest] == OperandKind.TEMP])
+
+    def stored_types(self, variable_types):
+        """Variable name -> join of the types stored into it, reading variables as variable_types."""
+        self.infer_temps(variable_types)
+        program = self.program
+        kinds = program.kinds
+        stored = {}
+        for instruction in program.instructions:
+            dest = instruction.dest
+            if dest != NO_OPERAND and kinds[dest] == OperandKind.VARIABLE:
+                name = program.values[dest]
+                previous = stored.get(name, ValueType.UNKNOWN)
+                joined = join_types(previous, self.result_type(instruction))
+                if joined is None:
+                    raise self.store_error(instruction, previous)
+                stored[name] = joined
+        return stored
+
+    def run_with_variables(self, variable_types):
+        """Like run(), with every variable's type given (name -> ValueType) rather than inferred."""
+        self.infer_temps(variable_types)
+        return self.finish()
+
+    def check(self, instruction):
+        """Reject operations the C++ backend has no meaning for."""
+        types = self.types
+        opcode = instruction.opcode
+        if opcode in (Opcode.IF, Opcode.IF_NOT):
+            if types[instruction.a] == ValueType.STRING:
+                raise TypeInferenceError(f"A string can't be used as a condition ({self.describe(instruction)})")
+        elif opcode in OPERATOR_SYMBOLS:
+            left, right = types[instruction.a], types[instruction.b]
+            strings = (left == ValueType.STRING) + (right == ValueType.STRING)
+            if strings == 1 or (strings == 2 and opcode != Opcode.ADD and opcode not in COMPARISON_OPCODES):
+                raise self.mismatch(instruction, left, right)
+
+
+def infer_types(program):
+    """Fill in program.types for every variable and temp; raises TypeInferenceError on a conflict."""
+    return TypeInference(program).run()
@@ -0,0 +1,101 @@
+# Visitor framework for the passes over the AST. A visitor names its handlers
+# <method_prefix><node>, where <node> is the node class's name without the
+# "Node" suffix, lowercased (AssignmentNode -> assignment, lists -> list), or
+# the class's own node_name if it sets one (SyntaxTree's flat lists). The
+# handler for each node class is looked up once per visitor class and cached
+# in a table, so visiting a node is one dict lookup instead of an isinstance
+# chain.
+#
+# A handler that needs its children's results is written as a generator: it
+# yields a child and gets the child's result back from the yield, and its
+# return value is its own result. That lets one handler run either way:
+# visit() recurses through Python frames, walk() keeps suspended handlers on
+# an explicit stack, so nesting depth is only limited by memory.
+
+from types import GeneratorType
+
+
+class NodeVisitor:
+    method_prefix = 'visit_'
+    dispatch_table = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch_table = {}  # Node class -> handler function, filled in on first use
+
+    @classmethod
+    def handler_for(cls, node_class):
+        table = cls.dispatch_table
+        handler = table.get(node_class)
+        if handler is None:
+            handler = cls.generic_visit
+            for klass in node_class.__mro__:
+                name = klass.__dict__.get('node_name') or klass.__name__
+                if name.endswith('Node'):
+                    name = name[:-4]
+                method = getattr(cls, cls.method_prefix + name.lower(), None)
+                if method is not None:
+                    handler = method
+                    break
+            table[node_class] = handler
+        return handler
+
+    def dispatch(self, node):
+        """Call node's handler; returns its result, or a generator still to be driven."""
+        handler = self.dispatch_table.get(type(node)) or self.handler_for(type(node))
+        return handler(self, node)
+
+    def visit(self, node):
+        """Visit node recursively and return its handler's result."""
+        handler = self.dispatch_table.get(type(node)) or self.handler_for(type(node))
+        result = handler(self, node)
+        if type(result) is not GeneratorType:
+            return result
+        send = result.send
+        visit = self.visit
+        try:
+            child = send(None)
+            while True:
+                child = send(visit(child))
+        except StopIteration as stop:
+            return stop.value
+
+    def walk(self, node):
+        """visit() without recursion: suspended handlers wait on an explicit stack."""
+        table = self.dispatch_table
+        handler_for = self.handler_for
+        stack = []  # .send of each handler waiting for a child's result, innermost last
+        push, pop = stack.append, stack.pop
+        handler = table.get(type(node)) or handler_for(type(node))
+        result = handler(self, node)
+        while True:
+            if type(result) is GeneratorType:
+                push(result.send)
+                value = None
+            elif not stack:
+                return result
+            else:
+                value = result
+            # Resume the innermost waiting handler with the result it asked for
+            while True:
+                try:
+                    child = stack[-1](value)
+                except StopIteration as stop:
+                    pop()
+                    if not stack:
+                        return stop.value
+                    value = stop.value
+                else:
+                    handler = table.get(type(child)) or handler_for(type(child))
+                    result = handler(self, child)
+                    break
+
+    def visit_children(self, node):
+        """Handler body that visits node's children in order; yield from it in a handler."""
+        for field in node.fields:
+            child = getattr(node, field)
+            if child is not None:
+                yield child
+
+    def generic_visit(self, node):
+        raise Exception(f"Unknown node type: {type(node)}")
@@ -0,0 +1,478 @@
+# Watch mode: a long-lived compiler that keeps its modules and its last build
+# warm and recompiles source files as they are saved.
+#
+# A rebuild only redoes what an edit touched. The source is compared with the
+# last version to find the changed span; top-level statements that end before
+# it keep their AST, and lexing and parsing resume at the first one that
+# doesn't. As soon as the parser reaches a statement boundary in the
+# unchanged tail where the old parse also had one, the rest of the old
+# statements are reused as they are. The semantic analyzer restarts from a
+# snapshot of its variable table and stops once its state matches the last
+# run's again.
+#
+# At -O0 each top-level statement is also compiled on its own into an IR
+# fragment with its own temps and labels, numbered so they never clash, and
+# its C++ is kept until the types of the variables it uses change. Only the
+# variables' types are program-wide: each is the join of what the fragments
+# store into it, and is solved again from scratch only when an edit may have
+# narrowed one. The -O1/-O2 passes optimize across statements, so there the
+# back end runs over the whole (reused) AST.
+#
+# Files are watched by polling their size and modification time. Directories
+# and globs are expanded again on every poll, so a file created in or renamed
+# into one is picked up, and one deleted or renamed away is forgotten.
+
+import argparse
+import bisect
+import os
+import sys
+import time
+from collections import deque
+
+from BatchCompile import expand_inputs, output_path_for
+from CPPCompiler import (COMPILER_VERSION, CPP_TYPES, TOKEN_REGEX, CompilerError, CppCodeGenerator,
+                         IntermediateCodeGenerator, Parser, SemanticAnalyzer, add_optimization_arguments, generate_cpp,
+                         iter_tokens, optimization_options, prologue_lines)
+from IntermediateCode import ValueType
+from OutputStage import MANIFEST_NAME, Manifest, write_generated
+from TempAllocation import reuse_temps
+from TypeInference import TYPE_NAMES, TypeInference, TypeInferenceError, join_types
+
+DEFAULT_INTERVAL = 0.05  # Seconds between polls
+COMPARE_CHUNK = 4096
+STORES_CACHE_SIZE = 16  # Per fragment
+
+
+def common_prefix_length(first, second):
+    """Length of the longest common prefix, comparing whole chunks at C speed."""
+    limit = min(len(first), len(second))
+    start, size = 0, COMPARE_CHUNK
+    while size and start < limit:
+        end = min(start + size, limit)
+        if first[start:end] == second[start:end]:
+            start = end
+        else:
+            size //= 2
+    return start
+
+
+def common_suffix_length(first, second, limit):
+    """Length of the longest common suffix, at most limit."""
+    first_end, second_end = len(first), len(second)
+    length, size = 0, COMPARE_CHUNK
+    while size and length < limit:
+        step = min(size, limit - length)
+        first_start, second_start = first_end - length - step, second_end - length - step
+        if first[first_start:first_end - length] == second[second_start:second_end - length]:
+            length += step
+        else:
+            size //= 2
+    return length
+
+
+class TopLevelStatement:
+    __slots__ = ('node', 'variables', 'fragment')
+
+    def __init__(self, node):
+        self.node = node  # None for a stray ':' or 'else' the parser skipped
+        self.variables = None  # The analyzer's variable table before this statement, once analyzed
+        self.fragment = None  # Its Fragment, once the -O0 back end has compiled it
+
+
+class Fragment:
+    """One top-level statement's share of the -O0 back end."""
+    __slots__ = ('node', 'ir', 'temp_base', 'label_base', 'variables', 'independent', 'stores_cache', 'stores',
+                 'types_key', 'declarations', 'body', 'headers', 'prints')
+
+    def __init__(self, node, temp_base, label_base):
+        self.node = node
+        self.temp_base = temp_base
+        self.label_base = label_base
+        self.ir = self.generate_ir()
+        self.variables = tuple(self.ir.variables)
+        self.independent = TypeInference(self.ir).stored_types({})  # What it stores whatever the others hold
+        self.stores_cache = {}
+        self.stores = None  # The last stored_types() result
+        self.types_key = None
+        self.declarations = ""
+        self.body = ""
+        self.headers = frozenset()
+        self.prints = False
+
+    def generate_ir(self):
+        """The fragment's IR; its temps and labels are numbered on from temp_base and label_base."""
+        generator = IntermediateCodeGenerator()
+        program = generator.program
+        program.temp_count, program.label_count = self.temp_base, self.label_base
+        if self.node is not None:
+            generator.generate(self.node)
+        return program
+
+    def stored_types(self, variable_types):
+        """What the fragment stores into each variable, given the variables' types; cached on their types."""
+        key = tuple(variable_types.get(name, ValueType.UNKNOWN) for name in self.variables)
+        stores = self.stores_cache.get(key)
+        if stores is None:
+            # Solving again from nothing passes through the same few states each time
+            if len(self.stores_cache) >= STORES_CACHE_SIZE:
+                self.stores_cache.clear()
+            stores = self.stores_cache[key] = TypeInference(self.ir).stored_types(variable_types)
+        self.stores = stores
+        return stores
+
+    def render(self, variable_types, structured, reuse, parallel_loops=None, print_buffering='auto'):
+        """Generate the C++ for the variables' final types, unless it's already for them."""
+        types_key = tuple(variable_types.get(name, ValueType.INT) for name in self.variables)
+        if types_key == self.types_key:
+            return False
+        # From fresh IR: temp reuse picks slots by type, so it can't be undone when the types change
+        program = self.generate_ir()
+        TypeInference(program).run_with_variables(dict(zip(self.variables, types_key)))
+        if reuse:
+            reuse_temps(program)
+        generator = CppCodeGenerator(program, structured, parallel_loops, print_buffering)
+        declarations, body = generator.generate_fragment()
+        self.declarations = '\n'.join(declarations)
+        self.body = '\n'.join(body)
+        self.headers = frozenset(generator.headers)
+        self.prints = generator.prints
+        self.types_key = types_key
+        return True
+
+
+class IncrementalCompiler:
+    def __init__(self, options=None):
+        self.options = options or {}
+        self.source = ""
+        # Per top-level statement, in order: where its first token starts, where the token after
+        # it (which its parse looked at) ends, and the rest of what is known about it
+        self.starts = []
+        self.stops = []
+        self.statements = []
+        self.checked = 0  # How many leading statements the analyzer has passed
+        self.final_variables = {}  # The analyzer's variable table after the last statement, once checked
+        # The -O0 back end's state
+        self.temp_count = 0
+        self.label_count = 0
+        self.unbuilt = {}  # id -> TopLevelStatement still without a fragment, in order
+        self.removed = []  # Fragments of statements gone since the last build
+        self.unrendered = set()  # Fragments whose C++ is missing or out of date
+        self.readers = {}  # Variable name -> fragments using it
+        self.supports = {}  # Variable name -> {type: count of fragments storing it whatever the others hold}
+        self.variable_types = {}  # Variable name -> join of what the fragments store into it
+        self.stale_types = False  # An exception left variable_types half solved
+        self.stats = {}
+
+    @property
+    def optimizing(self):
+        return bool(self.options.get('opt_level') or self.options.get('enabled_passes'))
+
+    def update(self, source):
+        """Recompile after the source changed to source; returns the C++. Raises like compile_code."""
+        first, added, entry = self.parse(source)
+        self.analyze(first, added, entry)
+        if self.optimizing:
+            return generate_cpp([statement.node for statement in self.statements if statement.node is not None],
+                                self.options)[1]
+        return self.generate()
+
+    def parse(self, source):
+        """Re-parse the statements the edit touched.
+
+        Returns (index of the first new statement, how many there are, the
+        analyzer's variable table before them as of the last run).
+        """
+        old = self.source
+        prefix = common_prefix_length(old, source)
+        suffix = common_suffix_length(old, source, min(len(old), len(source)) - prefix)
+        old_changed_end, changed_end = len(old) - suffix, len(source) - suffix
+        delta = len(source) - len(old)
+        starts, stops = self.starts, self.stops
+
+        # A statement is kept only if even the token after it ends before the change: one
+        # ending right at it might run on into the new text
+        first = bisect.bisect_left(stops, prefix)
+        if first == 0:
+            resume = 0
+        elif first < len(starts):
+            resume = min(stops[first - 1], starts[first])
+        else:
+            resume = stops[first - 1]
+
+        parser = Parser(iter_tokens(source, resume))
+        if resume:
+            self.skip_newlines(parser)
+        new_starts, new_stops, added = [], [], []
+        tail = len(starts)  # The first old statement that is reused after the new ones
+        # Parser.program's loop, stopping once the rest of the old parse can be reused
+        while parser.current_token:
+            position = parser.current_token.position
+            if position >= changed_end:
+                index = bisect.bisect_left(starts, position - delta, first)
+                if index < len(starts) and starts[index] == position - delta and starts[index] >= old_changed_end:
+                    tail = index
+                    break
+            node = parser.statement()
+            lookahead = parser.current_token
+            new_starts.append(position)
+            new_stops.append(TOKEN_REGEX.match(source, lookahead.position).end() if lookahead else len(source))
+            added.append(TopLevelStatement(node))
+            self.skip_newlines(parser)
+
+        statements = self.statements
+        entry = statements[first].variables if first < len(statements) else self.final_variables
+        if not self.optimizing:
+            for statement in statements[first:tail]:
+                if statement.fragment is not None:
+                    self.removed.append(statement.fragment)
+                self.unbuilt.pop(id(statement), None)
+            self.unbuilt.update((id(statement), statement) for statement in added)
+        self.starts = starts[:first] + new_starts + [start + delta for start in starts[tail:]]
+        self.stops = stops[:first] + new_stops + [stop + delta for stop in stops[tail:]]
+        statements[first:tail] = added
+        self.checked = min(self.checked, first)
+        self.source = source
+        self.stats = {'statements': len(statements), 'reparsed': len(added)}
+        return first, len(added), entry
+
+    @staticmethod
+    def skip_newlines(parser):
+        while parser.current_token and parser.current_token.type == 'NEWLINE':
+            parser.advance()
+
+    def analyze(self, first, count, entry):
+        """Run the semantic analyzer from the first new statement until its state is what it was last time."""
+        statements = self.statements
+        start = min(first, self.checked)
+        if start < first:
+            entry = statements[start].variables
+        resumable = self.final_variables is not None  # Only then did the last run pass what follows
+        analyzer = SemanticAnalyzer()
+        analyzer.variables = dict(entry)
+        snapshot = entry
+        analyzed = 0
+        for index in range(start, len(statements)):
+            statement = statements[index]
+            if index >= first + count and resumable and statement.variables == analyzer.variables:
+                break  # From here on the analyzer would redo exactly what it did last time
+            if analyzer.variables != snapshot:
+                snapshot = dict(analyzer.variables)
+            statement.variables = snapshot  # Statements share the table until it changes
+            if statement.node is not None:
+                try:
+                    analyzer.analyze(statement.node)
+                except Exception:
+                    for later in statements[index + 1:]:
+                        later.variables = None
+                    self.checked = index
+                    self.final_variables = None
+                    raise
+            analyzed += 1
+        else:
+            self.final_variables = dict(analyzer.variables)
+        self.checked = len(statements)
+        self.stats['analyzed'] = analyzed
+
+    def generate(self):
+        """Bring the fragments up to date and put the C++ together."""
+        readers, supports = self.readers, self.supports
+        added = []
+        for statement in self.unbuilt.values():
+            fragment = statement.fragment = Fragment(statement.node, self.temp_count, self.label_count)
+            self.temp_count, self.label_count = fragment.ir.temp_count, fragment.ir.label_count
+            added.append(fragment)
+        self.unbuilt = {}
+        for fragment in added:
+            for name in fragment.variables:
+                readers.setdefault(name, set()).add(fragment)
+            for name, stored in fragment.independent.items():
+                counts = supports.setdefault(name, {})
+                counts[stored] = counts.get(stored, 0) + 1
+            self.unrendered.add(fragment)
+        removed, self.removed = self.removed, []
+        for fragment in removed:
+            for name in fragment.variables:
+                users = readers[name]
+                users.discard(fragment)
+                if not users:
+                    del readers[name]
+            for name, stored in fragment.independent.items():
+                supports[name][stored] -= 1
+            self.unrendered.discard(fragment)
+
+        # Added stores can only widen types, which solving on from the current ones handles. A
+        # removed store may have been what held a type up, unless something else stores that type
+        # whatever the other variables hold; otherwise solve again from nothing.
+        old_types = self.variable_types
+        narrowed = self.stale_types or any(
+            stored != ValueType.UNKNOWN and stored == old_types.get(name) and not supports.get(name, {}).get(stored)
+            for fragment in removed for name, stored in (fragment.stores or {}).items())
+        if narrowed:
+            variable_types = {}
+            worklist = [statement.fragment for statement in self.statements]
+        else:
+            variable_types = dict(old_types)
+            worklist = added
+        self.stale_types = True
+        self.solve(variable_types, worklist)
+        self.variable_types = variable_types
+        self.stale_types = False
+        for name in set(old_types) | set(variable_types):
+            if old_types.get(name) != variable_types.get(name) and name in readers:
+                self.unrendered.update(readers[name])
+
+        structured = self.options.get('structured', True)
+        reuse = self.options.get('reuse_temps', True)
+        parallel_loops = self.options.get('parallel_loops')
+        print_buffering = self.options.get('print_buffering', 'auto')
+        rendered = 0
+        for fragment in list(self.unrendered):
+            rendered += fragment.render(variable_types, structured, reuse, parallel_loops, print_buffering)
+            self.unrendered.discard(fragment)
+        self.stats['rendered'] = rendered
+        return self.assemble()
+
+    def solve(self, variable_types, worklist):
+        """Join the fragments' stores into variable_types until nothing changes."""
+        readers = self.readers
+        worklist = deque(worklist)
+        queued = set(worklist)  # A fragment waits in the worklist at most once
+        while worklist:
+            fragment = worklist.popleft()
+            queued.discard(fragment)
+            for name, stored in fragment.stored_types(variable_types).items():
+                current = variable_types.get(name, ValueType.UNKNOWN)
+                joined = join_types(current, stored)
+                if joined is None:
+                    raise TypeInferenceError(f"Cannot store a {TYPE_NAMES[stored]} in "
+                                             f"{TYPE_NAMES[current]} '{name}'")
+                if joined != current:
+                    variable_types[name] = joined
+                    for reader in readers[name]:
+                        if reader not in queued:
+                            queued.add(reader)
+                            worklist.append(reader)
+
+    def assemble(self):
+        fragments = [statement.fragment for statement in self.statements]
+        headers = set().union(*(fragment.headers for fragment in fragments))
+        declarations = []
+        for name in sorted(self.readers):
+            value_type = self.variable_types.get(name, ValueType.INT)
+            if value_type == ValueType.STRING:
+                headers.add("<string>")
+            cpp_type, initialiser = CPP_TYPES[value_type]
+            declarations.append(f"    {cpp_type} {name}{initialiser};")
+        headers.update(("<iostream>", "<cstdint>"))
+        prints = any(fragment.prints for fragment in fragments)
+        return '\n'.join(prologue_lines(headers, prints, self.options.get('print_buffering', 'auto'))
+                         + ["int main() {"] + declarations
+                         + [fragment.declarations for fragment in fragments if fragment.declarations]
+                         + [fragment.body for fragment in fragments if fragment.body]
+                         + ["    return 0;", "}"])
+
+
+class Watcher:
+    """Polls source files and rebuilds each one's C++ through its own IncrementalCompiler.
+
+    inputs are files, directories or glob patterns, as expand_inputs takes them.
+    """
+
+    def __init__(self, inputs, output_dir=None, options=None, interval=DEFAULT_INTERVAL, output=sys.stdout):
+        self.inputs = inputs
+        self.output_dir = output_dir
+        self.options = options or {}
+        self.interval = interval
+        self.output = output
+        self.paths = []
+        self.compilers = {}  # path -> its IncrementalCompiler
+        self.signatures = {}  # path -> (size, mtime) when last read
+        self.written = {}  # path -> the C++ last written for it
+        self.manifest = Manifest(os.path.join(output_dir or "", MANIFEST_NAME))
+
+    def refresh(self):
+        """Expand the inputs again, starting on new files and forgetting ones that are gone."""
+        paths = expand_inputs(self.inputs)
+        if paths == self.paths:
+            return
+        for path in set(self.paths).difference(paths):
+            del self.compilers[path]
+            self.signatures.pop(path, None)
+            self.written.pop(path, None)
+        for path in paths:
+            if path not in self.compilers:
+                self.compilers[path] = IncrementalCompiler(self.options)
+        self.paths = paths
+
+    def poll(self):
+        """Rebuild every file that changed since the last poll; returns how many did."""
+        self.refresh()
+        rebuilt = 0
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Mid-save or deleted; look again next time
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.signatures.get(path) != signature:
+                self.signatures[path] = signature
+                self.rebuild(path)
+                rebuilt += 1
+        return rebuilt
+
+    def rebuild(self, path):
+        try:
+            with open(path, 'r') as infile:
+                source = infile.read()
+        except OSError:
+            del self.signatures[path]  # Gone between the stat and the read; try again next poll
+            return
+        compiler = self.compilers[path]
+        start = time.perf_counter()
+        try:
+            cpp_code = compiler.update(source)
+        except (CompilerError, TypeInferenceError) as e:
+            print(f"{path}: Compilation error: {e}", file=self.output)
+            return
+        except Exception as e:
+            print(f"{path}: Unexpected error: {e}", file=self.output)
+            return
+        elapsed = time.perf_counter() - start
+        output_path = output_path_for(path, self.output_dir)
+        if self.written.get(path) != cpp_code:
+            write_generated(output_path, cpp_code, [path], self.options, COMPILER_VERSION, self.manifest)
+            self.manifest.save()
+            self.written[path] = cpp_code
+        stats = compiler.stats
+        print(f"{path} -> {output_path} in {elapsed * 1000:.1f} ms "
+              f"({stats['reparsed']}/{stats['statements']} statements reparsed)", file=self.output)
+        self.output.flush()
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompile source files to C++ whenever they change.")
+    parser.add_argument('inputs', nargs='+', help="source files, directories or glob patterns")
+    parser.add_argument('-o', '--output-dir', default=None, help="directory for the generated .cpp files")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f"seconds between checks for changes (default: {DEFAULT_INTERVAL})")
+    add_optimization_arguments(parser)
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("no input files matched")
+    watcher = Watcher(args.inputs, args.output_dir, optimization_options(args), args.interval)
+    print(f"Watching {len(paths)} file(s); Ctrl-C to stop")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
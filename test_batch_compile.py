@@ -0,0 +1,75 @@
+# Tests for batch compilation over directories of sources.
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import BatchCompile
+from BatchCompile import expand_inputs
+from GccBuild import executable_path_for
+from OutputStage import MANIFEST_NAME
+
+SOURCES = {
+    "a.src": "x = 1\nprint(x)\n",
+    "b.txt": "print(2 * 3)\n",
+    os.path.join("nested", "c.src"): "y = 2.5\nprint(y)\n",
+}
+
+
+class BatchCompileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        for name, code in SOURCES.items():
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(code)
+
+    def run_batch(self, *arguments):
+        """(exit status, stdout) of a batch run over the test directory."""
+        argv = ['cppcompiler-batch', self.directory, '-j', '1', '--no-cache',
+                '--manifest', os.path.join(self.directory, MANIFEST_NAME)] + list(arguments)
+        stdout = io.StringIO()
+        with mock.patch.object(sys, 'argv', argv), contextlib.redirect_stdout(stdout):
+            status = BatchCompile.main()
+        return status, stdout.getvalue()
+
+    def sources(self):
+        return sorted(os.path.join(self.directory, name) for name in SOURCES)
+
+    def test_second_run_skips_outputs(self):
+        status, stdout = self.run_batch()
+        self.assertEqual(status, 0, stdout)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "a.cpp")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "a.d")))
+        status, stdout = self.run_batch()
+        self.assertEqual(status, 0, stdout)
+        self.assertIn("3 compiled, 0 failed", stdout)
+        self.assertEqual(expand_inputs([self.directory]), self.sources())
+
+    @unittest.skipUnless(shutil.which('g++'), "g++ is not installed")
+    def test_second_build_skips_executables(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        for _ in range(2):
+            status, stdout = self.run_batch('--build', 'debug', '--cache-dir', cache_dir)
+            self.assertEqual(status, 0, stdout)
+        self.assertTrue(os.path.exists(executable_path_for(os.path.join(self.directory, "a.cpp"))))
+        self.assertEqual(expand_inputs([self.directory]), self.sources())
+
+    def test_named_files_are_kept(self):
+        cpp_path = os.path.join(self.directory, "a.cpp")
+        open(cpp_path, 'w').close()
+        self.assertEqual(expand_inputs([cpp_path]), [cpp_path])
+        self.assertEqual(expand_inputs([os.path.join(self.directory, "*")]),
+                         [os.path.join(self.directory, name) for name in ("a.src", "b.txt")])
+
+
+if __name__ == '__main__':
+    unittest.main()
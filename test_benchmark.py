@@ -0,0 +1,41 @@
+# Tests for the benchmark suite runner.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Benchmark import run_suite
+from GccBuild import GccBuilder
+
+
+class RunSuiteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.scratch = os.path.join(self.directory, "tmp")
+        os.mkdir(self.scratch)
+
+    def run_suite(self, builder=None):
+        with mock.patch.object(tempfile, 'tempdir', self.scratch):
+            return run_suite([('straight', 20), ('prints', 1)], {}, repeat=1, builder=builder, output=io.StringIO())
+
+    def test_measures_each_program(self):
+        results, failures = self.run_suite()
+        self.assertEqual(failures, [])
+        self.assertEqual(sorted(results), ['prints-1', 'straight-20'])
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    @unittest.skipUnless(shutil.which('g++'), "g++ is not installed")
+    def test_removes_native_builds(self):
+        builder = GccBuilder('debug', cache_dir=os.path.join(self.directory, "gcc"))
+        results, failures = self.run_suite(builder)
+        self.assertEqual(failures, [])
+        self.assertIn('native', results['straight-20'])
+        self.assertEqual(os.listdir(self.scratch), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Tests for the CPPCompiler command line, run through main() the way the
+# cppcompiler console script runs it.
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import CPPCompiler
+import GccBuild
+from GccBuild import GccBuilder, executable_path_for
+from Tracing import tracer
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def run_main(self, code, *arguments, output_name="program.cpp"):
+        """(exit status, stdout, stderr) of main() compiling code with arguments."""
+        source_path = os.path.join(self.directory, "program.src")
+        with open(source_path, 'w') as file:
+            file.write(code)
+        self.output_path = os.path.join(self.directory, output_name)
+        argv = ['cppcompiler', source_path, '-o', self.output_path, '--no-cache'] + list(arguments)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(GccBuild, 'GccBuilder', self.make_builder), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = CPPCompiler.main()
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def make_builder(self, profile='release', compiler='g++', cache_dir=None, extra_flags=()):
+        # Builds go to a scratch cache, never the user's
+        return GccBuilder(profile, compiler, os.path.join(self.directory, "gcc"), extra_flags)
+
+    def test_compiles(self):
+        status, _, stderr = self.run_main("x = 1\nprint(x)\n")
+        self.assertEqual(status, 0, stderr)
+        self.assertTrue(os.path.exists(self.output_path))
+
+    def test_syntax_error_fails(self):
+        status, _, stderr = self.run_main("x = (1\n")
+        self.assertEqual(status, 1)
+        self.assertIn("error", stderr.lower())
+
+    @unittest.skipUnless(shutil.which('g++'), "g++ is not installed")
+    def test_builds_executable_next_to_output(self):
+        os.mkdir(os.path.join(self.directory, "out"))
+        status, _, stderr = self.run_main("print(1)\n", '--build', 'debug', output_name=os.path.join("out", "o1.cpp"))
+        self.assertEqual(status, 0, stderr)
+        self.assertTrue(os.path.exists(executable_path_for(self.output_path)))
+        self.assertFalse(os.path.exists(executable_path_for(os.path.join(self.directory, "program.src"))))
+
+    def test_info_logs_phase_summary(self):
+        import logging
+
+        # configure_tracing keeps the first handler it adds, bound to whatever stderr was then
+        logger = logging.getLogger(tracer.name)
+        logger.handlers.clear()
+        self.addCleanup(logger.handlers.clear)
+        status, _, stderr = self.run_main("x = 1\nprint(x)\n", '--log-level', 'info')
+        self.assertEqual(status, 0, stderr)
+        self.assertIn("INFO parse:", stderr)
+        self.assertIn("INFO total:", stderr)
+        self.assertNotIn("DEBUG", stderr)
+
+    def test_dumps_deeply_nested_expression(self):
+        code = "x = " + "1 + (" * 3000 + "1" + ")" * 3000 + "\nprint(x)\n"
+        status, stdout, stderr = self.run_main(code, '--dump')
+        self.assertEqual(status, 0, stderr)
+        self.assertIn("BinOpNode(NumberNode(1), +, " * 3000 + "NumberNode(1)" + ")" * 3000, stdout)
+        self.assertTrue(os.path.exists(self.output_path))
+
+    def test_dumps_long_operator_chain(self):
+        code = "x = 1\ny = " + " + ".join(["x"] * 5000) + "\nprint(y)\n"
+        status, stdout, stderr = self.run_main(code, '--dump')
+        self.assertEqual(status, 0, stderr)
+        self.assertIn("BinOpNode(" * 4999 + "VariableNode(x), +, VariableNode(x))", stdout)
+        self.assertTrue(os.path.exists(self.output_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# Tests for the on-disk artifact cache.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import CompileCache as compile_cache
+from CompileCache import EVICT_TO, SIZE_FILE, CompileCache
+
+
+class CompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        cache = CompileCache(self.directory)
+        self.assertIsNone(cache.get("ab12"))
+        self.assertTrue(cache.put("ab12", {'cpp': "int main() {}"}))
+        self.assertEqual(cache.get("ab12"), {'cpp': "int main() {}"})
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), "entries are only checked on POSIX")
+    def test_ignores_entries_others_can_write(self):
+        cache = CompileCache(self.directory)
+        cache.put("ab12", [1, 2])
+        os.chmod(cache.path("ab12"), 0o666)
+        self.assertIsNone(cache.get("ab12"))
+
+    def test_unreadable_entry_is_a_miss(self):
+        cache = CompileCache(self.directory)
+        os.makedirs(cache.path("ab12"))
+        self.assertIsNone(cache.get("ab12"))
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_drops_entries_from_newer_pickle_protocols(self):
+        cache = CompileCache(self.directory)
+        cache.put("ab12", [1, 2])
+        with open(cache.path("ab12"), 'wb') as file:
+            file.write(bytes([0x80, pickle.HIGHEST_PROTOCOL + 1]) + b".")
+        self.assertIsNone(cache.get("ab12"))
+        self.assertFalse(os.path.exists(cache.path("ab12")))
+
+    def test_tracks_size_without_listing_entries(self):
+        cache = CompileCache(self.directory)
+        cache.put("ab12", b"x" * 100)
+        with mock.patch.object(CompileCache, 'entries', side_effect=AssertionError("listed the cache")):
+            cache.put("cd34", b"y" * 100)
+        with open(os.path.join(self.directory, SIZE_FILE)) as file:
+            self.assertEqual(int(file.read()), cache.size())
+
+    def test_evicts_least_recently_used(self):
+        cache = CompileCache(self.directory, max_bytes=1000)
+        for index, key in enumerate(["aa01", "bb02", "cc03", "dd04"]):
+            cache.put(key, b"z" * 300)
+            os.utime(cache.path(key), (index, index))
+        # Four entries of just over 300 bytes go over budget; freeing down to 900 bytes takes the oldest two
+        self.assertEqual([cache.get(key) is not None for key in ["aa01", "bb02", "cc03", "dd04"]],
+                         [False, False, True, True])
+        self.assertLessEqual(cache.size(), 1000 * EVICT_TO)
+        self.assertEqual(cache.stats['evictions'], 2)
+
+    def test_user_cache_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': "/tmp/xdg", 'LOCALAPPDATA': "/tmp/xdg"}):
+            self.assertEqual(compile_cache.user_cache_dir(), os.path.join("/tmp/xdg", "cppcompiler"))
+
+
+if __name__ == '__main__':
+    unittest.main()
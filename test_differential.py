@@ -0,0 +1,191 @@
+# Differential tests: random programs from a fixed seed corpus must print
+# the same thing however they are compiled and run. The unoptimized program
+# run in the VM is the reference; every optimization level and code
+# generation option is checked against it in the VM, and a sample of the
+# corpus is also built with g++ and run natively at -O0 and -O2.
+
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+
+from BytecodeVM import DIVISION_FAULT, VMError, native_available, run_native, run_vm
+from CPPCompiler import CompilerError, compile_code
+
+SEEDS = range(120)
+NATIVE_SEEDS = range(0, 120, 20)
+JUMP_BUDGET = 200_000
+
+# Options each program is compiled with besides the reference -O0
+VARIANTS = {
+    'O1': {'opt_level': 1},
+    'O2': {'opt_level': 2},
+    'O2 unstructured': {'opt_level': 2, 'structured': False},
+    'O2 no temp reuse': {'opt_level': 2, 'reuse_temps': False},
+    'O2 flat AST': {'opt_level': 2, 'flat_ast': True},
+}
+
+
+class ProgramGenerator:
+    """Random programs over ints, doubles and strings: straight-line code, counted while loops and if/else.
+
+    Loop bodies only hold simple statements, since a block runs to the next keyword.
+    Divisors are non-zero constants, so a program can only fail by running too long.
+    """
+
+    OPERATORS = ['+', '-', '+', '*', '<', '>', '==', '!=', '<=', '>=', 'and', 'or', '/', '%']
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.variables = []
+        self.strings = []
+        self.loop_count = 0
+
+    def atom(self):
+        roll = self.random.random()
+        if self.variables and roll < 0.6:
+            atom = self.random.choice(self.variables)
+        elif roll < 0.7:
+            atom = str(round(self.random.uniform(0, 9), 2))
+        else:
+            atom = str(self.random.randint(0, 9))
+        return "-" + atom if self.random.random() < 0.1 else atom
+
+    def expression(self, depth=0):
+        if depth > 2 or self.random.random() < 0.4:
+            return self.atom()
+        op = self.random.choice(self.OPERATORS)
+        left = self.expression(depth + 1)
+        if op in ('/', '%'):
+            return f"{left} {op} {self.random.randint(1, 5)}"
+        if op == '*':
+            return f"{left} * {self.random.randint(0, 3)}"
+        text = f"{left} {op} {self.expression(depth + 1)}"
+        roll = self.random.random()
+        if roll < 0.15:
+            return f"not {text}"
+        if roll < 0.35:
+            return f"({text})"
+        return text
+
+    def string_statement(self, indent):
+        name = self.random.choice(['s1', 's2', 's3'])
+        literal = '"' + self.random.choice(['ab', 'b', 'a c', '', 'zz']) + '"'
+        roll = self.random.random()
+        if not self.strings or roll < 0.3:
+            value = literal
+        elif roll < 0.6:
+            other = self.random.choice(self.strings)
+            value = f"{other} + {self.random.choice([literal, other])}"
+        else:
+            other = self.random.choice(self.strings)
+            operator = self.random.choice(['==', '<', '!=', '>='])
+            return [f"{indent}print({other} {operator} {self.random.choice([literal, other])})"]
+        if name not in self.strings:
+            self.strings.append(name)
+        return [f"{indent}{name} = {value}"]
+
+    def simple(self, indent, protected=()):
+        if self.random.random() < 0.25:
+            return self.string_statement(indent)
+        if not self.variables or self.random.random() < 0.5:
+            name = self.random.choice([name for name in 'abcdefgh' if name not in protected])
+            line = f"{indent}{name} = {self.expression()}"
+            if name not in self.variables:
+                self.variables.append(name)
+            return [line]
+        return [f"{indent}print({self.expression()})"]
+
+    def statement(self):
+        roll = self.random.random()
+        if roll < 0.15:
+            self.loop_count += 1
+            counter = f"i{self.loop_count}"
+            lines = [f"{counter} = 0", f"while {counter} < {self.random.randint(0, 6)}:"]
+            self.variables.append(counter)
+            for _ in range(self.random.randint(1, 4)):
+                lines += self.simple('    ', protected=(counter,))
+            return lines + [f"    {counter} = {counter} + 1"]
+        if roll < 0.3:
+            lines = [f"if {self.expression()}:"]
+            for _ in range(self.random.randint(1, 3)):
+                lines += self.simple('    ')
+            if self.random.random() < 0.5:
+                lines.append("else:")
+                for _ in range(self.random.randint(1, 3)):
+                    lines += self.simple('    ')
+            return lines
+        return self.simple('')
+
+    def program(self, statements=12):
+        lines = []
+        for _ in range(statements):
+            lines += self.statement()
+        return "\n".join(lines + ["print(1)"]) + "\n"
+
+
+def corpus(seeds):
+    """(seed, source, -O0 result, its VM output) for each seed whose program compiles and finishes in the VM."""
+    for seed in seeds:
+        code = ProgramGenerator(seed).program()
+        try:
+            reference = compile_code(code)
+        except CompilerError:
+            continue
+        output = vm_output(reference.ir)
+        if output is not None:
+            yield seed, code, reference, output
+
+
+def vm_output(program):
+    """What program prints in the VM; None if it outlasts JUMP_BUDGET."""
+    output = io.StringIO()
+    try:
+        finished = run_vm(program, output, JUMP_BUDGET)
+    except VMError as e:
+        return f"{output.getvalue()}error: {e}"
+    return output.getvalue() if finished else None
+
+
+class DifferentialTest(unittest.TestCase):
+    def test_corpus_is_not_empty(self):
+        self.assertGreater(len(list(corpus(SEEDS))), len(SEEDS) // 2)
+
+    def test_optimization_levels_match_reference(self):
+        for seed, code, _, expected in corpus(SEEDS):
+            for name, options in VARIANTS.items():
+                with self.subTest(seed=seed, variant=name):
+                    self.assertEqual(vm_output(compile_code(code, options).ir), expected)
+
+    def native_builder(self):
+        from GccBuild import GccBuilder
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        return GccBuilder('release', cache_dir=os.path.join(cache_dir, "build"))
+
+    @unittest.skipUnless(native_available(), "g++ is not installed")
+    def test_native_matches_vm(self):
+        builder = self.native_builder()
+        for seed, code, reference, expected in corpus(NATIVE_SEEDS):
+            for level, result in ((0, reference), (2, compile_code(code, {'opt_level': 2}))):
+                with self.subTest(seed=seed, level=level):
+                    output = io.StringIO()
+                    run_native(result.cpp, output, builder)
+                    self.assertEqual(output.getvalue(), expected)
+
+    @unittest.skipUnless(native_available(), "g++ is not installed")
+    def test_native_fails_like_vm(self):
+        result = compile_code("x = 5\nprint(x)\ny = 0\nprint(x / y)\n")
+        self.assertEqual(vm_output(result.ir), f"5\nerror: {DIVISION_FAULT}")
+        output = io.StringIO()
+        with self.assertRaisesRegex(VMError, re.escape(DIVISION_FAULT)):
+            run_native(result.cpp, output, self.native_builder())
+        self.assertEqual(output.getvalue(), "5\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# Tests for snippets built as shared libraries and called through ctypes.
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import NativeLibrary
+from GccBuild import GccBuilder
+from NativeLibrary import NativeError, load_function
+
+LOOP = "i = 0\ns = 0\nwhile i < n:\n    s = s + i\n    i = i + 1\nprint(s)\n"
+
+
+@unittest.skipUnless(shutil.which('g++'), "g++ is not installed")
+class NativeLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.builder = GccBuilder('release', cache_dir=os.path.join(self.directory, "gcc"), extra_flags=['-fPIC'])
+
+    def test_calls_with_parameters(self):
+        function = load_function("print(n * x)\n", {'n': int, 'x': float}, builder=self.builder)
+        self.assertEqual(function(3, 0.5), "1.5\n")
+        self.assertEqual(function(x=2.0, n=4), "8\n")
+        self.assertIs(load_function("print(n * x)\n", {'n': int, 'x': float}, builder=self.builder), function)
+
+    def test_reuses_cached_build(self):
+        load_function(LOOP, {'n': int}, builder=self.builder)
+        # A fresh process only has the build cache to go on
+        with mock.patch.dict(NativeLibrary._loaded, clear=True):
+            function = load_function(LOOP, {'n': int}, builder=self.builder)
+        self.assertTrue(function.cached)
+        self.assertEqual(function(5), "0\n1\n3\n6\n10\n")
+
+    def test_division_by_zero_keeps_output(self):
+        function = load_function("print(n)\ny = n / 0\nprint(y)\n", {'n': int}, builder=self.builder)
+        with self.assertRaises(NativeError) as raised:
+            function(7)
+        self.assertEqual(raised.exception.output, "7\n")
+
+    def test_main_prints_output_before_error(self):
+        source_path = os.path.join(self.directory, "snippet.src")
+        with open(source_path, 'w') as file:
+            file.write("print(n)\ny = n / 0\n")
+        stdout, stderr = io.StringIO(), io.StringIO()
+        argv = ['cppcompiler-native', source_path, '-a', 'n=7']
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(NativeLibrary, 'GccBuilder', self.make_builder), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = NativeLibrary.main()
+        self.assertEqual(status, 1)
+        self.assertEqual(stdout.getvalue(), "7\n")
+        self.assertIn("Floating point exception", stderr.getvalue())
+
+    def make_builder(self, profile, extra_flags=()):
+        return GccBuilder(profile, cache_dir=os.path.join(self.directory, "gcc"), extra_flags=extra_flags)
+
+
+class NativeLibraryCliTest(unittest.TestCase):
+    def test_syntax_error_is_reported(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        source_path = os.path.join(directory, "snippet.src")
+        with open(source_path, 'w') as file:
+            file.write("x = $\n")
+        stderr = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['cppcompiler-native', source_path]), contextlib.redirect_stderr(stderr):
+            status = NativeLibrary.main()
+        self.assertEqual(status, 1)
+        self.assertIn("Compilation error: Unexpected character", stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Unit tests for the optimizer passes. Each test runs one pass (plus the
+# passes it relies on to expose its pattern) over a small program, checks
+# the shape of the IR it leaves, and checks the VM still prints what the
+# unoptimized program prints.
+
+import io
+import unittest
+
+from BytecodeVM import run_vm
+from CPPCompiler import compile_code
+
+
+def compile_ir(code, passes=()):
+    return compile_code(code, {'opt_level': 0, 'enabled_passes': list(passes)}).ir
+
+
+def vm_output(program):
+    output = io.StringIO()
+    run_vm(program, output)
+    return output.getvalue()
+
+
+COUNTED_LOOP = """
+i = 0
+while i < 3:
+    print(i * 10)
+    i = i + 1
+"""
+
+
+class PassTest(unittest.TestCase):
+    def optimize(self, code, passes):
+        """The IR text of code after passes; fails if the program's output changed."""
+        program = compile_ir(code, passes)
+        self.assertEqual(vm_output(program), vm_output(compile_ir(code)))
+        return program.dump().splitlines()
+
+    def assertNoOperator(self, lines, symbol):
+        self.assertFalse([line for line in lines if line.startswith(symbol + " ")], lines)
+
+    def test_constants_folds_arithmetic(self):
+        lines = self.optimize("x = 2 * 3\nprint(x + 1)\n", ['constants'])
+        self.assertIn("STORE 6 x", lines)
+        self.assertNoOperator(lines, "*")
+
+    def test_constants_folds_strings(self):
+        lines = self.optimize('s = "ab" + "cd"\nprint(s)\n', ['constants'])
+        self.assertIn('STORE "abcd" s', lines)
+
+    def test_branches_removes_constant_if(self):
+        lines = self.optimize("if 1 < 2:\n    print(1)\nelse:\n    print(2)\n", ['constants', 'branches'])
+        self.assertEqual(lines, ["PRINT 1"])
+
+    def test_copies_propagates_constants(self):
+        lines = self.optimize("a = 4\nb = a\nprint(b)\n", ['copies'])
+        self.assertEqual(lines, ["PRINT 4"])
+
+    def test_gvn_reuses_equal_expressions(self):
+        code = "i = 0\nwhile i < 3:\n    a = i * 7\n    b = i * 7\n    print(a + b)\n    i = i + 1\n"
+        lines = self.optimize(code, ['gvn'])
+        self.assertEqual(len([line for line in lines if line.startswith("* i 7 ")]), 1, lines)
+
+    def test_licm_hoists_invariant_expression(self):
+        code = "x = 5\ni = 0\nwhile i < 3:\n    print(x * 4)\n    i = i + 1\n"
+        lines = self.optimize(code, ['licm'])
+        product = next(index for index, line in enumerate(lines) if line.startswith("* x 4 "))
+        self.assertLess(product, lines.index("L1:"), lines)
+
+    def test_licm_keeps_division_that_may_trap(self):
+        code = "x = 0\ni = 0\nwhile i < 0:\n    print(5 / x)\n    i = i + 1\nprint(1)\n"
+        lines = self.optimize(code, ['licm'])
+        division = next(index for index, line in enumerate(lines) if line.startswith("/ 5 x "))
+        self.assertGreater(division, lines.index("L1:"), lines)
+
+    def test_strength_replaces_multiplication_in_loop(self):
+        lines = self.optimize(COUNTED_LOOP, ['copies', 'strength'])
+        loop = lines[lines.index("L1:"):]
+        self.assertNoOperator(loop, "*")
+
+    def test_loops_computes_final_value(self):
+        code = "i = 0\nwhile i < 10:\n    i = i + 1\nif i > 0:\n    print(i)\n"
+        lines = self.optimize(code, ['copies', 'loops'])
+        self.assertNotIn("L1:", lines)
+        self.assertIn("PRINT 10", lines)
+
+    def test_dce_removes_unused_computation(self):
+        lines = self.optimize("a = 4 * 5\nprint(1)\n", ['dce'])
+        self.assertEqual(lines, ["PRINT 1"])
+
+    def test_dce_keeps_printed_values(self):
+        lines = self.optimize(COUNTED_LOOP, ['dce'])
+        self.assertIn("* i 10 T2", lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+# Tests for the OpenMP loop analysis and the pragmas the C++ backend emits for it.
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import CPPCompiler
+import GccBuild
+from CPPCompiler import compile_code
+from GccBuild import GccBuilder
+from IntermediateCode import Instruction
+from ParallelLoops import analyze_loop
+from Structuring import BlockLabel, LoopStatement, Structurer
+
+# A block runs until the next keyword, so this ends a loop body before the prints
+AFTER = "if 1:\n    print(s)\n"
+
+
+def plan(code, **options):
+    """(analyze_loop's plan for the first top-level loop, the IR it is in)."""
+    program = compile_code(code, options).ir
+    structurer = Structurer(program)
+    previous = None
+    for statement in structurer.structure():
+        if isinstance(statement, BlockLabel):
+            continue  # Labels nothing jumps to aren't emitted, so the code generator looks past them
+        if isinstance(statement, LoopStatement):
+            return analyze_loop(program, statement, structurer.goto_targets, previous), program
+        previous = statement if isinstance(statement, Instruction) else None
+    raise AssertionError("no loop")
+
+
+def pragmas(code, min_trips=1000, **options):
+    cpp = compile_code(code, dict(options, parallel_loops=min_trips)).cpp
+    return [line.strip() for line in cpp.splitlines() if line.strip().startswith("#pragma omp")]
+
+
+class AnalyzeLoopTest(unittest.TestCase):
+    def names(self, program, operands):
+        return [program.values[operand] for operand in operands]
+
+    def test_sum_is_a_reduction(self):
+        loop, program = plan("s = 0\nfor (i = 0; i < 2000; i = i + 1):\n    s = s + i\n" + AFTER)
+        self.assertEqual(program.values[loop.counter], 'i')
+        self.assertEqual((loop.step, loop.initial, loop.trips), (1, 0, 2000))
+        self.assertEqual({program.values[operand]: operator for operand, operator in loop.reductions.items()},
+                         {'s': '+'})
+        self.assertEqual(self.names(program, loop.lastprivate), ['i'])
+
+    def test_product_and_difference_are_reductions(self):
+        loop, program = plan("p = 1\nd = 0\nfor (i = 1; i < 2000; i = i + 1):\n    p = p * 3\n    d = d - i\n"
+                             + "if 1:\n    print(p)\n")
+        self.assertEqual({program.values[operand]: operator for operand, operator in loop.reductions.items()},
+                         {'p': '*', 'd': '+'})
+
+    def test_written_before_read_is_lastprivate(self):
+        loop, program = plan("s = 0\nt = 0\nfor (i = 0; i < 2000; i = i + 1):\n    t = i * 3\n    s = s + t\n"
+                             + AFTER)
+        self.assertEqual(self.names(program, loop.lastprivate), ['i', 't'])
+        self.assertTrue(loop.private)
+
+    def test_strides_and_descending_loops(self):
+        loop, _ = plan("s = 0\nfor (i = 0; i < 2000; i = i + 3):\n    s = s + i\n" + AFTER)
+        self.assertEqual((loop.step, loop.trips), (3, 667))
+        loop, _ = plan("s = 0\nfor (i = 2000; i > 0; i = i - 2):\n    s = s + i\n" + AFTER)
+        self.assertEqual((loop.step, loop.trips), (-2, 1000))
+
+    def test_unknown_bound_leaves_trips_open(self):
+        loop, program = plan("s = 0\nn = 5000\nfor (i = 0; i < n; i = i + 1):\n    s = s + i\n" + AFTER)
+        self.assertEqual(program.values[loop.bound], 'n')
+        self.assertEqual((loop.initial, loop.trips), (0, None))
+
+    def test_refuses_dependent_iterations(self):
+        refused = {
+            'carried': "s = 1\nfor (i = 0; i < 2000; i = i + 1):\n    s = s * 2 + i\n",
+            'read outside the update': "s = 0\nx = 0\nfor (i = 0; i < 2000; i = i + 1):\n    x = s\n"
+                                       "    s = s + i\n",
+            'read before written': "s = 0\nt = 0\nfor (i = 0; i < 2000; i = i + 1):\n    s = t\n    t = i\n",
+            'mixed operators': "s = 1\nfor (i = 0; i < 2000; i = i + 1):\n    s = s + i\n    s = s * 2\n",
+            'floating-point sum': "s = 0.0\nfor (i = 0; i < 2000; i = i + 1):\n    s = s + i\n",
+            'counter written': "s = 0\nfor (i = 0; i < 2000; i = i + 1):\n    i = i + s\n",
+            'bound written': "s = 0\nn = 10\nfor (i = 0; i < n; i = i + 1):\n    n = n + 1\n",
+        }
+        for name, code in refused.items():
+            with self.subTest(name):
+                self.assertIsNone(plan(code + AFTER)[0])
+
+    def test_refuses_output(self):
+        code = "s = 0\nfor (i = 0; i < 2000; i = i + 1):\n    s = s + i\n    print(i)\n"
+        self.assertIsNone(plan(code + AFTER)[0])
+
+    def test_refuses_carried_induction_variable(self):
+        # Strength reduction steps a temp along with i, so each iteration needs the last one's
+        code = "s = 0\nfor (i = 0; i < 2000; i = i + 1):\n    t = i * 7\n    s = s + t\n"
+        self.assertIsNotNone(plan(code + AFTER)[0])
+        self.assertIsNone(plan(code + AFTER, opt_level=2)[0])
+
+    def test_refuses_steps_that_are_not_constant(self):
+        refused = {
+            'variable step': "s = 0\nk = 2\nfor (i = 0; i < 2000; i = i + k):\n    s = s + i\n",
+            'zero step': "s = 0\nfor (i = 0; i < 2000; i = i + 0):\n    s = s + i\n",
+            'scaled counter': "s = 0\nfor (i = 1; i < 2000; i = i * 2):\n    s = s + i\n",
+            'away from the bound': "s = 0\nfor (i = 0; i < 2000; i = i - 1):\n    s = s + i\n",
+        }
+        for name, code in refused.items():
+            with self.subTest(name):
+                self.assertIsNone(plan(code + AFTER)[0])
+
+
+class PragmaTest(unittest.TestCase):
+    def test_clauses(self):
+        code = "s = 0\nt = 0\nfor (i = 0; i < 2000; i = i + 1):\n    t = i * 3\n    s = s + t\n" + AFTER
+        self.assertEqual(pragmas(code), ["#pragma omp parallel for private(T2) lastprivate(i, t) reduction(+: s)"])
+        self.assertEqual(pragmas(code, reuse_temps=False),
+                         ["#pragma omp parallel for private(T2, T3) lastprivate(i, t) reduction(+: s)"])
+
+    def test_groups_reductions_by_operator(self):
+        code = "p = 1\nd = 0\ns = 0\nfor (i = 1; i < 2000; i = i + 1):\n    p = p * 3\n    d = d - i\n    s = s + i\n"
+        self.assertIn("lastprivate(i) reduction(*: p) reduction(+: d, s)", pragmas(code + AFTER)[0])
+
+    def test_minimum_trip_count(self):
+        code = "s = 0\nfor (i = 0; i < 10; i = i + 1):\n    s = s + i\n" + AFTER
+        self.assertEqual(pragmas(code), [])
+        self.assertEqual(len(pragmas(code, min_trips=10)), 1)
+        self.assertEqual(pragmas(code, min_trips=0), pragmas(code, min_trips=1))
+
+    def test_runtime_bound_checks_trips(self):
+        code = "s = 0\nn = 5000\nfor (i = 0; i < n; i = i + 1):\n    s = s + i\n" + AFTER
+        self.assertEqual(pragmas(code), ["#pragma omp parallel for if(n - i_start > 999) private(T2) lastprivate(i) "
+                                         "reduction(+: s)"])
+        self.assertEqual(pragmas(code, min_trips=1),
+                         ["#pragma omp parallel for private(T2) lastprivate(i) reduction(+: s)"])
+        cpp = compile_code(code, {'parallel_loops': 1000}).cpp
+        self.assertIn("if (i < n) {", cpp)
+        self.assertIn("for (i = i_start; i < n; i += 1) {", cpp)
+
+    def test_refused_loops_stay_serial(self):
+        code = "s = 1\nfor (i = 0; i < 2000; i = i + 1):\n    s = s * 2 + i\n" + AFTER
+        self.assertEqual(pragmas(code), [])
+        self.assertEqual(compile_code(code, {'parallel_loops': 1000}).cpp, compile_code(code).cpp)
+
+    def test_optimized_loops(self):
+        code = "s = 0\nfor (i = 0; i < 2000; i = i + 1):\n    s = s + i\n" + AFTER
+        self.assertEqual(pragmas(code, opt_level=2), ["#pragma omp parallel for lastprivate(i) reduction(+: s)"])
+
+
+# Loops of every kind the analysis accepts, and one it refuses, printed once they finish
+OPENMP_PROGRAM = """s = 0
+t = 0
+n = 30000
+for (i = 0; i < n; i = i + 1):
+    t = i * 7 % 1000
+    s = s + t
+for (j = 50000; j > 0; j = j - 3):
+    s = s - j
+for (k = 0; k < 20000; k = k + 1):
+    s = s * 3 % 1000003
+if 1:
+    print(s)
+    print(t)
+    print(i)
+    print(j)
+    print(k)
+"""
+
+
+@unittest.skipUnless(shutil.which('g++'), "g++ is not installed")
+class OpenmpCliTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.source_path = os.path.join(self.directory, "program.src")
+        with open(self.source_path, 'w') as file:
+            file.write(OPENMP_PROGRAM)
+
+    def make_builder(self, profile='release', compiler='g++', cache_dir=None, extra_flags=()):
+        return GccBuilder(profile, compiler, os.path.join(self.directory, "gcc"), extra_flags)
+
+    def run_native(self, name, *arguments):
+        """(C++, what the native build printed) for the program compiled with arguments."""
+        output_path = os.path.join(self.directory, name)
+        argv = ['cppcompiler', self.source_path, '-o', output_path, '--no-cache', '--run', 'native'] + list(arguments)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(GccBuild, 'GccBuilder', self.make_builder), \
+                mock.patch.dict(os.environ, {'OMP_NUM_THREADS': "4"}), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = CPPCompiler.main()
+        self.assertEqual(status, 0, stderr.getvalue())
+        with open(output_path) as file:
+            cpp = file.read()
+        return cpp, stdout.getvalue().split("\n", 1)[1]
+
+    def test_matches_serial_build(self):
+        serial_cpp, serial = self.run_native("serial.cpp")
+        self.assertNotIn("#pragma omp", serial_cpp)
+        # At -O2 strength reduction leaves the first loop with a carried temp
+        for arguments, loops in ((['--openmp'], 2), (['--openmp', '0'], 2), (['--openmp', '-O2'], 1)):
+            with self.subTest(arguments=arguments):
+                cpp, output = self.run_native("parallel.cpp", *arguments)
+                self.assertEqual(cpp.count("#pragma omp parallel for"), loops)
+                self.assertEqual(output, serial)
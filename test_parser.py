@@ -0,0 +1,62 @@
+# Tests for the expression grammar: precedence, grouping and prefix operators.
+
+import io
+import unittest
+
+from BytecodeVM import run_vm
+from CPPCompiler import CompilerError, compile_code
+
+
+def parse(code):
+    return [repr(statement) for statement in compile_code(code).ast]
+
+
+def vm_output(code, opt_level=0):
+    output = io.StringIO()
+    run_vm(compile_code(code, {'opt_level': opt_level}).ir, output)
+    return output.getvalue().split()
+
+
+class ExpressionTest(unittest.TestCase):
+    def test_multiplication_binds_tighter(self):
+        self.assertEqual(parse("x = 1 + 2 * 3\n"),
+                         ["AssignmentNode(x, BinOpNode(NumberNode(1), +, BinOpNode(NumberNode(2), *, NumberNode(3))))"])
+
+    def test_equal_precedence_groups_left(self):
+        self.assertEqual(vm_output("print(10 - 4 - 3)\nprint(24 / 4 / 2)\n"), ["3", "3"])
+
+    def test_not_binds_looser_than_comparison(self):
+        self.assertEqual(parse("x = not 1 == 2\n"),
+                         ["AssignmentNode(x, UnaryOpNode(not, BinOpNode(NumberNode(1), ==, NumberNode(2))))"])
+
+
+class UnaryMinusTest(unittest.TestCase):
+    def test_negative_literal(self):
+        self.assertEqual(parse("x = -5\n"), ["AssignmentNode(x, UnaryOpNode(-, NumberNode(5)))"])
+
+    def test_binds_tighter_than_multiplication(self):
+        self.assertEqual(parse("y = 1\nx = -y * 2\n")[1],
+                         "AssignmentNode(x, BinOpNode(UnaryOpNode(-, VariableNode(y)), *, NumberNode(2)))")
+
+    def test_after_binary_operator(self):
+        self.assertEqual(parse("x = 3 - -2\n"),
+                         ["AssignmentNode(x, BinOpNode(NumberNode(3), -, UnaryOpNode(-, NumberNode(2))))"])
+
+    def test_values(self):
+        code = ("x = -5\nprint(x)\nprint(2 * -3)\nprint(- -4)\nprint(-(1 + 2) * 3)\nprint(-x % 3)\n"
+                "print(-0.5)\nprint(-0.0)\n")
+        for level in (0, 2):
+            with self.subTest(level=level):
+                self.assertEqual(vm_output(code, level), ["-5", "-6", "4", "-9", "2", "-0.5", "-0"])
+
+    def test_rejects_strings(self):
+        with self.assertRaises(CompilerError):
+            compile_code('x = -"a"\n')
+
+    def test_binary_operator_cannot_start_operand(self):
+        with self.assertRaises(CompilerError):
+            compile_code("x = * 2\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# Tests for the output runtime's C++ variants.
+
+import unittest
+
+from PrintRuntime import CAPTURE_MACRO, runtime_lines, select_variant
+
+
+class RuntimeVariantTest(unittest.TestCase):
+    def test_executable_has_no_capture_code(self):
+        text = "\n".join(runtime_lines('auto'))
+        self.assertNotIn(CAPTURE_MACRO, text)
+        self.assertNotIn("captured", text)
+        self.assertIn("flush_and_die", text)
+
+    def test_library_leaves_signals_alone(self):
+        text = "\n".join(runtime_lines('capture'))
+        self.assertNotIn(CAPTURE_MACRO, text)
+        self.assertIn("captured.append", text)
+        self.assertNotIn("std::signal", text)
+
+    def test_other_conditionals_are_kept(self):
+        lines = ["#ifdef _WIN32", "a", f"#ifndef {CAPTURE_MACRO}", "b", "#else", "c", "#endif", "#else", "d", "#endif"]
+        self.assertEqual(select_variant(lines, False), ["#ifdef _WIN32", "a", "b", "#else", "d", "#endif"])
+        self.assertEqual(select_variant(lines, True), ["#ifdef _WIN32", "a", "c", "#else", "d", "#endif"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+# Tests for the if/else and loop statements rebuilt from the IR's jumps.
+
+import unittest
+
+from CPPCompiler import compile_code
+
+
+def main_body(code, options=None):
+    cpp = compile_code(code, options).cpp
+    return cpp[cpp.index("int main() {"):]
+
+
+class IfElseTest(unittest.TestCase):
+    def test_if_without_else_has_no_else_block(self):
+        # x isn't an induction variable, so -O2 can't work out its value after the loop
+        code = "i = 0\nx = 1\nwhile i < 3:\n    x = x * 3 % 7\n    i = i + 1\nif x > 2:\n    print(x)\n"
+        for level in (0, 2):
+            with self.subTest(level=level):
+                body = main_body(code, {'opt_level': level})
+                self.assertIn("if (", body)
+                self.assertNotIn("else", body)
+
+    def test_if_else_keeps_both_branches(self):
+        body = main_body("x = 5\nif x > 3:\n    print(1)\nelse:\n    print(2)\n")
+        self.assertIn("} else {", body)
+        self.assertIn("print_int(1)", body)
+        self.assertIn("print_int(2)", body)
+
+
+if __name__ == '__main__':
+    unittest.main()
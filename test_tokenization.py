@@ -0,0 +1,147 @@
+# Tests for the print statement converter in Tokenization.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import Tokenization
+from Tokenization import (CppConvert, RuleEngine, ShardReader, conversion_tokens, convert_file, shard_ranges,
+                          split_arguments)
+
+RULES = conversion_tokens + [
+    {'python': 'max', 'template': "std::max({0}, {1})"},
+    {'python': 'len', 'template': "std::size({args})"},
+]
+
+
+class SplitArgumentsTest(unittest.TestCase):
+    def test_nested_brackets(self):
+        line = "f(a, g(b, c), [d, (e, f)], {g: h}) + 1"
+        self.assertEqual(split_arguments(line, 2), (['a', 'g(b, c)', '[d, (e, f)]', '{g: h}'], line.index(" +")))
+
+    def test_commas_and_brackets_in_strings(self):
+        line = '''f("a, b", 'c, (d', "e\\", f)", x)'''
+        self.assertEqual(split_arguments(line, 2)[0], ['"a, b"', "'c, (d'", '"e\\", f)"', 'x'])
+
+    def test_no_arguments(self):
+        self.assertEqual(split_arguments("f()", 2), ([], 3))
+        self.assertEqual(split_arguments("f(  )", 2), ([], 5))
+
+    def test_unbalanced(self):
+        self.assertIsNone(split_arguments("f(a, (b", 2))
+        self.assertIsNone(split_arguments("f(a, [b)", 2))
+        self.assertIsNone(split_arguments('f(a, ")"', 2))
+
+
+class RuleEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = RuleEngine(RULES)
+
+    def test_default_rule(self):
+        self.assertEqual(self.engine.convert('print("Hi", x)'), 'cout << "Hi" << x;')
+        self.assertEqual(self.engine.convert("print (x)"), "cout << x;")
+
+    def test_nested_calls(self):
+        self.assertEqual(self.engine.convert("print(max(a, (b, c)), len(s))"),
+                         "cout << std::max(a, (b, c)) << std::size(s);")
+
+    def test_strings_are_not_converted(self):
+        self.assertEqual(self.engine.convert('print("print(x), max(a, b)")'), 'cout << "print(x), max(a, b)";')
+        self.assertEqual(self.engine.convert('s = "print(x)"'), 's = "print(x)"')
+
+    def test_unknown_names_are_scanned_through(self):
+        # Names without a rule miss in the dict; the scan carries on into their arguments
+        self.assertEqual(self.engine.convert("foo(print(x), bar(y, z))"), "foo(cout << x;, bar(y, z))")
+        self.assertEqual(self.engine.convert("myprint(x)"), "myprint(x)")
+        self.assertEqual(self.engine.convert("obj.print(x)"), "obj.print(x)")
+        self.assertEqual(self.engine.convert("x = y"), "x = y")
+
+    def test_unbalanced_call_is_left_alone(self):
+        self.assertEqual(self.engine.convert("print(a"), "print(a")
+        self.assertEqual(self.engine.convert("print(a]) + print(b)"), "print(a]) + cout << b;")
+
+    def test_later_rule_with_same_name_wins(self):
+        engine = RuleEngine(RULES + [{'python': 'print', 'template': "puts({0});"}])
+        self.assertEqual(engine.convert('print("x")'), 'puts("x");')
+
+    def test_cpp_convert_takes_rules_or_engine(self):
+        line = "print(max(a, b))"
+        self.assertEqual(CppConvert(line, RULES), CppConvert(line, self.engine))
+
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.input_path = os.path.join(self.directory, "input.py")
+
+    def write_input(self, data):
+        with open(self.input_path, 'wb') as file:
+            file.write(data)
+
+    def check_ranges(self, data, shards):
+        self.write_input(data)
+        ranges = shard_ranges(self.input_path, shards)
+        self.assertLessEqual(len(ranges), shards)
+        self.assertEqual(b"".join(data[start:end] for start, end in ranges), data)
+        for start, end in ranges:
+            self.assertLess(start, end)
+            self.assertTrue(end == len(data) or data[end - 1:end] == b"\n", (start, end))
+        return ranges
+
+    def test_boundaries_move_to_line_ends(self):
+        data = b"short\n" + b"x" * 100 + b"\n" + b"y" * 7 + b"\n"
+        # The first boundary, at byte 38, falls inside the long line
+        self.assertEqual(self.check_ranges(data, 3), [(0, 107), (107, 115)])
+
+    def test_more_shards_than_lines(self):
+        self.assertEqual(self.check_ranges(b"a\nb", 10), [(0, 2), (2, 3)])
+        self.assertEqual(self.check_ranges(b"a", 4), [(0, 1)])
+        self.assertEqual(self.check_ranges(b"", 4), [])
+
+    def test_reader_stops_at_limit(self):
+        infile = io.BytesIO(b"line one\nline two\n")
+        infile.seek(5)
+        reader = io.TextIOWrapper(io.BufferedReader(ShardReader(infile, 8)), encoding='utf-8')
+        self.assertEqual(list(reader), ["one\n", "line"])
+
+    def convert(self, data, jobs):
+        """What convert_file writes for data with jobs workers, cutting shards as small as a line."""
+        self.write_input(data)
+        output_path = os.path.join(self.directory, f"output{jobs}.cpp")
+        with mock.patch.object(Tokenization, 'MIN_SHARD_BYTES', 1):
+            convert_file(self.input_path, output_path, conversion_tokens, jobs, 'utf-8')
+        with open(output_path, 'rb') as file:
+            return file.read()
+
+    def check_matches_serial(self, data, jobs=3):
+        self.assertEqual(self.convert(data, jobs), self.convert(data, 1))
+        self.assertEqual(sorted(os.listdir(self.directory)), ["input.py", "output1.cpp", f"output{jobs}.cpp"])
+
+    def test_sharded_output_matches_serial(self):
+        lines = ['print("a, b", x)', "x = 1", 'print("\u00e9t\u00e9", (y, z))', "", "    print( 'q' )"]
+        data = "\n".join(lines * 40).encode('utf-8')
+        self.write_input(data)
+        self.assertGreater(len(shard_ranges(self.input_path, 12)), 1)
+        self.check_matches_serial(data)
+        self.check_matches_serial(data + b"\n")
+
+    def test_boundary_inside_a_character(self):
+        # Three-byte characters put most byte offsets inside one
+        data = ("print('\u20ac\u20ac\u20ac')\n" * 30).encode('utf-8')
+        self.check_matches_serial(data, jobs=5)
+
+    def test_crlf_line_ends(self):
+        self.check_matches_serial(b"x = 1\r\nprint(x)\r\n" * 25)
+
+    def test_input_smaller_than_shard_count(self):
+        self.check_matches_serial(b"print(1)\nprint(2)", jobs=8)
+        self.check_matches_serial(b"print(1)", jobs=8)
+        self.check_matches_serial(b"", jobs=8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+# Tests for watch mode: incremental rebuilds must give what a fresh compile
+# of the same text gives, and the watcher must follow files as they come and go.
+
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+
+from CPPCompiler import CPP_TYPES, compile_source
+from test_differential import ProgramGenerator
+from WatchMode import IncrementalCompiler, Watcher
+
+# Temps, IR labels and block labels, which incremental builds number differently
+GENERATED_NAME = re.compile(r'\b[TLB]\d+\b')
+DECLARATION = re.compile(r'    (?:%s) \w+' % '|'.join(re.escape(cpp_type) for cpp_type, _ in CPP_TYPES.values()))
+
+# Options the incremental C++ must match a fresh compile's under, up to the numbering of generated names
+EXACT_VARIANTS = {
+    'O0': {'reuse_temps': False},
+    'O0 unstructured': {'reuse_temps': False, 'structured': False},
+    'O2': {'opt_level': 2},
+}
+
+EDITS = [
+    "x = 1\nprint(x)\n",
+    "x = 1\ny = x * 2\nprint(x)\nprint(y)\n",
+    # Widens x everywhere it is used
+    "x = 1\ny = x * 2\nprint(x)\nx = 0.5\nprint(y)\n",
+    "x = 1\nwhile x < 4:\n    x = x + 1\n    print(x)\nx = 0.5\nprint(x)\n",
+    "x = 1\nwhile x < 4:\n    x = x + 1\n    print(x)\nx = 0.5\nprint(x",
+    # Drops the store that widened x
+    "x = 1\nwhile x < 4:\n    x = x + 1\n    print(x)\nprint(x)\n",
+    's = "a"\nx = 1\nif x > 0:\n    s = s + "b"\nelse:\n    print(x)\nprint(s)\n',
+    "",
+    "print(2.5)\n",
+]
+
+
+def normalize(cpp):
+    """cpp with generated names numbered by where the statements first use them and declarations sorted."""
+    prologue, main = cpp.split("int main() {\n")
+    lines = main.split("\n")
+    declarations = [line for line in lines if DECLARATION.match(line)]
+    statements = [line for line in lines if not DECLARATION.match(line)]
+    names = {}
+    for line in statements:
+        for name in GENERATED_NAME.findall(line):
+            names.setdefault(name, f"N{len(names)}")
+
+    def rename(line):
+        return GENERATED_NAME.sub(lambda match: names.get(match.group(), match.group()), line)
+
+    return prologue, sorted(map(rename, declarations)), list(map(rename, statements))
+
+
+def without_temps(cpp):
+    """normalize(cpp) with every generated name the same and only the variables' declarations."""
+    prologue, declarations, statements = normalize(cpp)
+    return (prologue, [line for line in declarations if not GENERATED_NAME.search(line)],
+            [GENERATED_NAME.sub("T", line) for line in statements])
+
+
+def fresh_compile(source, options):
+    """compile_source's C++ for source, or the type of what it raised."""
+    try:
+        return compile_source(source, options).cpp
+    except Exception as e:
+        return type(e)
+
+
+def random_edits(seed, rounds=8):
+    """Sources a program goes through as lines are inserted, deleted and replaced."""
+    generator = random.Random(seed)
+    lines = ProgramGenerator(seed).program().splitlines()
+    spare = ProgramGenerator(seed + 1000).program().splitlines()
+    for _ in range(rounds):
+        index = generator.randrange(len(lines) + 1)
+        roll = generator.random()
+        if roll < 0.4 or not lines:
+            lines.insert(index, generator.choice(spare))
+        elif roll < 0.7:
+            del lines[min(index, len(lines) - 1)]
+        else:
+            lines[min(index, len(lines) - 1)] = generator.choice(spare)
+        yield "\n".join(lines) + "\n"
+
+
+class IncrementalCompilerTest(unittest.TestCase):
+    def check_rounds(self, sources, options):
+        compiler = IncrementalCompiler(options)
+        for number, source in enumerate(sources):
+            with self.subTest(round=number):
+                expected = fresh_compile(source, options)
+                if isinstance(expected, type):
+                    with self.assertRaises(expected):
+                        compiler.update(source)
+                else:
+                    self.assertEqual(normalize(compiler.update(source)), normalize(expected))
+
+    def test_edits_match_fresh_compile(self):
+        for name, options in EXACT_VARIANTS.items():
+            with self.subTest(variant=name):
+                self.check_rounds(EDITS, options)
+
+    def test_random_edits_match_fresh_compile(self):
+        for seed in range(25):
+            for name, options in EXACT_VARIANTS.items():
+                with self.subTest(seed=seed, variant=name):
+                    self.check_rounds(list(random_edits(seed)), options)
+
+    def test_reused_temps_match_up_to_slots(self):
+        # Temp reuse picks slots per statement here and across the program in a fresh compile
+        compiler = IncrementalCompiler()
+        for number, source in enumerate(EDITS):
+            expected = fresh_compile(source, {})
+            if isinstance(expected, type):
+                continue
+            with self.subTest(round=number):
+                self.assertEqual(without_temps(compiler.update(source)), without_temps(expected))
+
+    def test_reparses_only_the_edited_statement(self):
+        lines = [f"v{index} = {index}" for index in range(200)] + ["print(v0)"]
+        compiler = IncrementalCompiler()
+        compiler.update("\n".join(lines) + "\n")
+        lines[100] = "v100 = 7"
+        compiler.update("\n".join(lines) + "\n")
+        self.assertEqual(compiler.stats['statements'], 201)
+        self.assertEqual(compiler.stats['reparsed'], 1)
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # Without an output directory the manifest goes in the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        self.output = io.StringIO()
+        self.mtime = 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, source):
+        with open(self.path(name), 'w') as file:
+            file.write(source)
+        self.touch(name)
+
+    def touch(self, name):
+        # Saves within one mtime tick must still look like changes
+        self.mtime += 1
+        os.utime(self.path(name), (self.mtime, self.mtime))
+
+    def read(self, name):
+        with open(self.path(name)) as file:
+            return file.read()
+
+    def test_rebuilds_on_change(self):
+        self.write("a.src", "x = 1\nprint(x)\n")
+        watcher = Watcher([self.directory], output=self.output)
+        self.assertEqual(watcher.poll(), 1)
+        self.assertEqual(watcher.poll(), 0)
+        self.write("a.src", "x = 1.5\nprint(x)\n")
+        self.assertEqual(watcher.poll(), 1)
+        self.assertIn("double x", self.read("a.cpp"))
+
+    def test_follows_deletes_and_renames(self):
+        self.write("a.src", "print(1)\n")
+        self.write("b.src", "print(2)\n")
+        watcher = Watcher([self.directory], output=self.output)
+        self.assertEqual(watcher.poll(), 2)
+
+        os.remove(self.path("b.src"))
+        self.assertEqual(watcher.poll(), 0)
+        self.assertEqual(watcher.paths, [self.path("a.src")])
+
+        os.rename(self.path("a.src"), self.path("c.src"))
+        self.assertEqual(watcher.poll(), 1)
+        self.assertEqual(watcher.paths, [self.path("c.src")])
+        self.assertEqual(sorted(watcher.compilers), [self.path("c.src")])
+        self.assertIn("print_int(1)", self.read("c.cpp"))
+
+        # A file renamed back onto an old name starts from scratch, not from that name's last build
+        self.write("b.src", "print(2.5)\n")
+        os.rename(self.path("b.src"), self.path("a.src"))
+        self.assertEqual(watcher.poll(), 1)
+        self.assertIn("print_double(2.5)", self.read("a.cpp"))
+        self.assertNotIn("Compilation error", self.output.getvalue())
+
+    def test_named_file_deleted_and_recreated(self):
+        self.write("a.src", "print(1)\n")
+        watcher = Watcher([self.path("a.src")], output=self.output)
+        self.assertEqual(watcher.poll(), 1)
+        os.remove(self.path("a.src"))
+        self.assertEqual(watcher.poll(), 0)
+        self.write("a.src", "x = 3\nprint(x)\n")
+        self.assertEqual(watcher.poll(), 1)
+        self.assertEqual(self.read("a.cpp"), IncrementalCompiler().update("x = 3\nprint(x)\n"))
+
+    def test_reports_errors_and_recovers(self):
+        self.write("a.src", "x = (1\n")
+        watcher = Watcher([self.directory], output=self.output)
+        watcher.poll()
+        self.assertIn("Compilation error", self.output.getvalue())
+        self.assertFalse(os.path.exists(self.path("a.cpp")))
+        self.write("a.src", "x = (1)\nprint(x)\n")
+        watcher.poll()
+        self.assertTrue(os.path.exists(self.path("a.cpp")))
+
+
+if __name__ == '__main__':
+    unittest.main()